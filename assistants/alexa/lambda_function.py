@@ -1,5 +1,81 @@
 import json
-import urllib.request
+import os
+import time
+import http.client
+import socket
+from urllib.parse import urlsplit
+
+# --- API Configuration ---
+API_BASE_URL = os.environ.get("API_BASE_URL", "https://api-inverter.esp32.ip-ddns.com")
+# Alexa waits 8 seconds for the skill, so a slow API must fail well before that
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "3"))
+# Seconds a reading is reused across warm invocations; the ESP32 uploads once a minute
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "30"))
+
+# All intents read one snapshot with every value they speak, fetched in a single request
+SNAPSHOT_PATH = "/api/latest?fields=power_in_total,cumulated_energy_today,inverter_temp"
+
+# Module-level state survives between invocations of a warm Lambda container
+_api_url = urlsplit(API_BASE_URL)
+_connection = None
+_cache = {}
+
+
+def get_connection():
+    """
+    Returns the keep-alive connection to the API, opening it if needed.
+    """
+    global _connection
+    if _connection is None:
+        connection_class = http.client.HTTPSConnection if _api_url.scheme == "https" else http.client.HTTPConnection
+        _connection = connection_class(_api_url.hostname, _api_url.port, timeout=HTTP_TIMEOUT)
+    return _connection
+
+
+def reset_connection():
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def fetch_json(path):
+    """
+    GETs a path of the API over the shared connection. A connection the server
+    closed while the container was frozen is reopened once; timeouts are not retried.
+    """
+    for attempt in range(2):
+        connection = get_connection()
+        try:
+            connection.request("GET", _api_url.path.rstrip("/") + path, headers={"Accept": "application/json"})
+            response = connection.getresponse()
+            body = response.read()
+        except (TimeoutError, socket.timeout):
+            # socket.timeout only became an alias of TimeoutError in Python 3.10
+            reset_connection()
+            raise
+        except (http.client.HTTPException, OSError):
+            reset_connection()
+            if attempt == 1:
+                raise
+            continue
+        if response.status != 200:
+            raise RuntimeError(f"API answered {response.status}")
+        return json.loads(body)
+
+
+def fetch_cached(path):
+    """
+    Returns the API response for a path, reusing it for CACHE_TTL seconds.
+    """
+    now = time.monotonic()
+    cached = _cache.get(path)
+    if cached is not None and now - cached[0] < CACHE_TTL:
+        return cached[1]
+    data = fetch_json(path)
+    _cache[path] = (now, data)
+    return data
+
 
 def lambda_handler(event, context):
     """
@@ -8,7 +84,7 @@ def lambda_handler(event, context):
     request_type = event["request"]["type"]
 
     if request_type == "LaunchRequest":
-        welcome_text = "Ciao! Puoi chiedermi la potenza attuale o la produzione di oggi."
+        welcome_text = "Ciao! Puoi chiedermi la potenza attuale, la produzione di oggi o un riepilogo."
         return build_response(speech_text=welcome_text, should_end_session=False)
 
     elif request_type == "IntentRequest":
@@ -16,35 +92,51 @@ def lambda_handler(event, context):
 
         if intent_name == "GetInverterPowerIntent":
             return handle_get_inverter_power()
-            
+
         elif intent_name == "GetDailyEnergyIntent":
             return handle_get_daily_energy()
-            
+
+        elif intent_name == "GetSummaryIntent":
+            return handle_get_summary()
+
         elif intent_name in ["AMAZON.StopIntent", "AMAZON.CancelIntent"]:
             return build_response(speech_text="A presto!", should_end_session=True)
 
     return build_response(speech_text="Scusa, non ho capito. Cosa vuoi sapere?", should_end_session=False)
 
 
+def power_sentence(data):
+    raw_power_watt = data.get("power_in_total")
+    if isinstance(raw_power_watt, (int, float)):
+        rounded_kilowatt = round(raw_power_watt / 1000, 2)
+        return f"L'inverter sta producendo circa {rounded_kilowatt} kilowatt."
+    return None
+
+
+def energy_sentence(data):
+    raw_daily_energy_wh = data.get("cumulated_energy_today")
+    if isinstance(raw_daily_energy_wh, (int, float)):
+        rounded_energy = round(raw_daily_energy_wh / 1000, 2)
+        return f"L'inverter oggi ha prodotto circa {rounded_energy} kilowattora."
+    return None
+
+
+def temperature_sentence(data):
+    temperature = data.get("inverter_temp")
+    if isinstance(temperature, (int, float)):
+        return f"La temperatura dell'inverter è di {round(temperature)} gradi."
+    return None
+
+
 def handle_get_inverter_power():
     """
     Handle the request for current power and converts it to KILOWATT.
     """
-    api_url = "https://api-inverter.esp32.ip-ddns.com/api/power"
     try:
-        with urllib.request.urlopen(api_url) as response:
-            data = json.loads(response.read())
-            raw_power_watt = data.get("power_in_total")
-            
-            if isinstance(raw_power_watt, (int, float)):
-                power_kilowatt = raw_power_watt / 1000
-                rounded_kilowatt = round(power_kilowatt, 2)
-                speech_text = f"L'inverter sta producendo circa {rounded_kilowatt} kilowatt."
-            else:
-                speech_text = "Non riesco a leggere il dato sulla potenza."
+        speech_text = power_sentence(fetch_cached(SNAPSHOT_PATH)) or "Non riesco a leggere il dato sulla potenza."
     except Exception:
         speech_text = "Non riesco a contattare il server per la potenza attuale."
-    
+
     return build_response(speech_text=speech_text, should_end_session=False)
 
 
@@ -52,26 +144,29 @@ def handle_get_daily_energy():
     """
     Handle the request for daily energy and converts it to KILOWATTORA.
     """
-    api_url = "https://api-inverter.esp32.ip-ddns.com/api/energy/today"
     try:
-        with urllib.request.urlopen(api_url) as response:
-            data = json.loads(response.read())
-            raw_daily_energy_wh = data.get("cumulated_energy_today") 
-            
-            if isinstance(raw_daily_energy_wh, (int, float)):
-                daily_energy_kwh = raw_daily_energy_wh / 1000
-                
-                rounded_energy = round(daily_energy_kwh, 2)
-                
-                speech_text = f"L'inverter oggi ha prodotto circa {rounded_energy} kilowattora."
-            else:
-                speech_text = "Non riesco a leggere il dato sull'energia giornaliera."
+        speech_text = energy_sentence(fetch_cached(SNAPSHOT_PATH)) or \
+            "Non riesco a leggere il dato sull'energia giornaliera."
     except Exception:
         speech_text = "Non riesco a contattare il server per il totale giornaliero."
 
     return build_response(speech_text=speech_text, should_end_session=False)
 
 
+def handle_get_summary():
+    """
+    Handle the request for a summary: current power, daily energy and inverter temperature.
+    """
+    try:
+        data = fetch_cached(SNAPSHOT_PATH)
+        sentences = [s for s in (power_sentence(data), energy_sentence(data), temperature_sentence(data)) if s]
+        speech_text = " ".join(sentences) if sentences else "Non riesco a leggere i dati dell'inverter."
+    except Exception:
+        speech_text = "Non riesco a contattare il server per il riepilogo."
+
+    return build_response(speech_text=speech_text, should_end_session=False)
+
+
 def build_response(speech_text, should_end_session):
     """
     Builds the JSON response for Alexa.
@@ -85,4 +180,4 @@ def build_response(speech_text, should_end_session):
             },
             "shouldEndSession": should_end_session
         }
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,81 @@
+#pragma once
+
+#include <cmath>
+#include <cstdint>
+#include <cstring>
+#include <string>
+
+// Compact binary reading for the /api/inverter_data endpoint
+// (decoded by server-inverter-monitoring/api/binary_format.py).
+//
+//   header: magic "AU", schema version (uint8), entry count (uint8)
+//   entry:  field id (uint8) followed by the value, little-endian
+//
+// Energy counters are sent as uint32 Wh, everything else as float32.
+// Sensors that have no value yet (NaN) are left out. Buffered readings
+// (ReadingBuffer.h) also carry their epoch timestamp as a uint32.
+
+#define AURORA_PAYLOAD_VERSION 1
+#define AURORA_PAYLOAD_CONTENT_TYPE "application/vnd.aurora.reading"
+
+enum AuroraPayloadField : uint8_t
+{
+  PAYLOAD_POWER_IN_TOTAL = 1,
+  PAYLOAD_POWER_PEAK_TODAY = 2,
+  PAYLOAD_POWER_PEAK_MAX = 3,
+  PAYLOAD_INVERTER_TEMP = 4,
+  PAYLOAD_CUMULATED_ENERGY_TODAY = 5,
+  PAYLOAD_CUMULATED_ENERGY_WEEK = 6,
+  PAYLOAD_CUMULATED_ENERGY_MONTH = 7,
+  PAYLOAD_CUMULATED_ENERGY_YEAR = 8,
+  PAYLOAD_CUMULATED_ENERGY_TOTAL = 9,
+  PAYLOAD_GRID_VOLTAGE = 10,
+  PAYLOAD_TIMESTAMP = 11,
+};
+
+class AuroraPayload
+{
+public:
+  AuroraPayload()
+  {
+    data.reserve(64);
+    data.push_back('A');
+    data.push_back('U');
+    data.push_back((char)AURORA_PAYLOAD_VERSION);
+    data.push_back(0); // entry count, updated by every add
+  }
+
+  void add_float(AuroraPayloadField id, float value)
+  {
+    if (std::isnan(value))
+      return;
+    data.push_back((char)id);
+    append(&value, sizeof(value)); // the ESP32 is little-endian, like the wire format
+    data[3]++;
+  }
+
+  void add_energy(AuroraPayloadField id, float value)
+  {
+    if (std::isnan(value) || value < 0)
+      return;
+    uint32_t wh = (uint32_t)lroundf(value);
+    data.push_back((char)id);
+    append(&wh, sizeof(wh));
+    data[3]++;
+  }
+
+  void add_timestamp(uint32_t epoch)
+  {
+    data.push_back((char)PAYLOAD_TIMESTAMP);
+    append(&epoch, sizeof(epoch));
+    data[3]++;
+  }
+
+  std::string data;
+
+private:
+  void append(const void *value, size_t size)
+  {
+    data.append((const char *)value, size);
+  }
+};
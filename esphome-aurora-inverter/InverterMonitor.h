@@ -42,6 +42,35 @@ using namespace sensor;
 
 #define TAG "INVERTER_MONITOR"
 
+// Polling schedule. Input power is read on every update (5 s); every other value
+// has its own interval, so slow-moving values do not take bus time from it.
+#define POLL_MEDIUM_MS 30000   // temperatures, grid, today's energy and peak
+#define POLL_SLOW_MS 300000    // week/month/year/total energy, diagnostics
+// While the inverter waits for the sun it only answers state requests; while it
+// does not answer at all (powered down at night) the probe backs off to this.
+#define STANDBY_PROBE_MS 30000
+#define OFFLINE_PROBE_MAX_MS 60000
+
+#define GLOBAL_STATE_RUN 6
+#define INVERTER_STATE_RUN 2
+
+enum PollKind : uint8_t
+{
+  POLL_DSP,
+  POLL_TEMPERATURE,
+  POLL_ENERGY,
+};
+
+struct PolledValue
+{
+  PollKind kind;
+  uint8_t type;          // DSP_VALUE_TYPE or CUMULATED_ENERGY_TYPE
+  Sensor *sensor;
+  uint32_t interval;
+  bool needs_power;      // cannot change while the inverter produces nothing
+  uint32_t next_due;
+};
+
 class InverterMonitor : public PollingComponent
 {
 
@@ -52,6 +81,10 @@ protected:
 private:
   ABBAurora *inverter;
   uint8_t connection = 0;
+  bool producing = false;
+  uint32_t next_probe = 0;
+  uint32_t probe_backoff = 0;
+  std::vector<PolledValue> polls;
 
 public:
   InverterMonitor(InverterMonitor &other) = delete;
@@ -123,6 +156,66 @@ public:
     ABBAurora::setup(INVERTER_MONITOR_SERIAL, RX, TX, TX_CONTROL_GPIO);
     inverter = new ABBAurora(INVERTER_ADDRESS);
     connection_status->publish_state(DISCONNECTED);
+
+    poll(POLL_DSP, V_IN_1, v_in_1, 0);
+    poll(POLL_DSP, V_IN_2, v_in_2, 0);
+    poll(POLL_DSP, I_IN_1, i_in_1, 0);
+    poll(POLL_DSP, I_IN_2, i_in_2, 0);
+    poll(POLL_DSP, GRID_POWER, grid_power, 0);
+    poll(POLL_DSP, POWER_PEAK_TODAY, power_peak_today, POLL_MEDIUM_MS, true);
+    poll(POLL_DSP, POWER_PEAK, power_peak_max, POLL_MEDIUM_MS, true);
+    poll(POLL_DSP, TEMPERATURE_INVERTER, temperature_inverter, POLL_MEDIUM_MS);
+    poll(POLL_DSP, TEMPERATURE_BOOSTER, temperature_booster, POLL_MEDIUM_MS);
+    poll(POLL_ENERGY, CURRENT_DAY, cumulated_energy_today, POLL_MEDIUM_MS, true);
+    poll(POLL_ENERGY, CURRENT_WEEK, cumulated_energy_week, POLL_SLOW_MS, true);
+    poll(POLL_ENERGY, CURRENT_MONTH, cumulated_energy_month, POLL_SLOW_MS, true);
+    poll(POLL_ENERGY, CURRENT_YEAR, cumulated_energy_year, POLL_SLOW_MS, true);
+    poll(POLL_ENERGY, TOTAL, cumulated_energy_total, POLL_SLOW_MS, true);
+    poll(POLL_DSP, GRID_VOLTAGE, grid_voltage, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_CURRENT, grid_current, POLL_MEDIUM_MS);
+    poll(POLL_DSP, FREQUENCY, frequency, POLL_MEDIUM_MS);
+    poll(POLL_DSP, V_BULK, v_bulk, POLL_MEDIUM_MS);
+    poll(POLL_DSP, I_LEAK_DC_DC, i_leak_dc_dc, POLL_SLOW_MS);
+    poll(POLL_DSP, I_LEAK_INVERTER, i_leak_inverter, POLL_SLOW_MS);
+    poll(POLL_DSP, DC_DC_GRID_VOLTAGE, dc_dc_grid_voltage, POLL_MEDIUM_MS);
+    poll(POLL_DSP, DC_DC_GRID_FREQUENCY, dc_dc_grid_frequency, POLL_MEDIUM_MS);
+    poll(POLL_DSP, ISOLATION_RESISTANCE, isolation_resistance, POLL_SLOW_MS);
+    poll(POLL_DSP, DC_DC_V_BULK, dc_dc_v_bulk, POLL_MEDIUM_MS);
+    poll(POLL_DSP, AVERAGE_GRID_VOLTAGE, average_grid_voltage, POLL_MEDIUM_MS);
+    poll(POLL_DSP, V_BULK_MID, v_bulk_mid, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_VOLTAGE_NEUTRAL, grid_voltage_neutral, POLL_MEDIUM_MS);
+    poll(POLL_DSP, WIND_GENERATOR_FREQENCY, wind_generator_frequency, POLL_SLOW_MS);
+    poll(POLL_DSP, GRID_VOLTAGE_NEUTRAL_PHASE, grid_voltage_neutral_phase, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_CURRENT_PHASE_R, grid_current_phase_r, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_CURRENT_PHASE_S, grid_current_phase_s, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_CURRENT_PHASE_T, grid_current_phase_t, POLL_MEDIUM_MS);
+    poll(POLL_DSP, FREQUENCY_PHASE_R, frequency_phase_r, POLL_MEDIUM_MS);
+    poll(POLL_DSP, FREQUENCY_PHASE_S, frequency_phase_s, POLL_MEDIUM_MS);
+    poll(POLL_DSP, FREQUENCY_PHASE_T, frequency_phase_t, POLL_MEDIUM_MS);
+    poll(POLL_DSP, V_BULK_POSITIVE, v_bulk_positive, POLL_MEDIUM_MS);
+    poll(POLL_DSP, V_BULK_NEGATIVE, v_bulk_negative, POLL_MEDIUM_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_SUPERVISOR, temperature_supervisor, POLL_SLOW_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_ALIM, temperature_alim, POLL_SLOW_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_HEAT_SINK, temperature_heat_sink, POLL_SLOW_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_1, temperature_1, POLL_SLOW_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_2, temperature_2, POLL_SLOW_MS);
+    poll(POLL_TEMPERATURE, TEMPERATURE_3, temperature_3, POLL_SLOW_MS);
+    poll(POLL_DSP, FAN_SPEED_1, fan_speed_1, POLL_SLOW_MS);
+    poll(POLL_DSP, FAN_SPEED_2, fan_speed_2, POLL_SLOW_MS);
+    poll(POLL_DSP, FAN_SPEED_3, fan_speed_3, POLL_SLOW_MS);
+    poll(POLL_DSP, FAN_SPEED_4, fan_speed_4, POLL_SLOW_MS);
+    poll(POLL_DSP, FAN_SPEED_5, fan_speed_5, POLL_SLOW_MS);
+    poll(POLL_DSP, POWER_SATURATION_LIMIT, power_saturation_limit, POLL_SLOW_MS);
+    poll(POLL_DSP, V_PANEL_MICRO, v_panel_micro, POLL_SLOW_MS);
+    poll(POLL_DSP, GRID_VOLTAGE_PHASE_R, grid_voltage_phase_r, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_VOLTAGE_PHASE_S, grid_voltage_phase_s, POLL_MEDIUM_MS);
+    poll(POLL_DSP, GRID_VOLTAGE_PHASE_T, grid_voltage_phase_t, POLL_MEDIUM_MS);
+  }
+
+  // Adds a value to the polling schedule; an interval of 0 reads it on every update
+  void poll(PollKind kind, uint8_t type, Sensor *sensor, uint32_t interval, bool needs_power = false)
+  {
+    polls.push_back({kind, type, sensor, interval, needs_power, 0});
   }
 
   void publish_dsp_value(DSP_VALUE_TYPE type, Sensor *sensor)
@@ -158,84 +251,103 @@ public:
 
   void update() override
   {
+    uint32_t now = millis();
+    if ((int32_t)(now - next_probe) < 0)
+      return;
+
     //If inverter is connected
-    if (inverter->ReadState())
-    {     
-     if (!connection)
-      {
-        connection = 1;
-        connection_status->publish_state(CONNECTED);
-      }
-      turn_led_on();
-
-      publish_dsp_value(V_IN_1, v_in_1);
-      publish_dsp_value(V_IN_2, v_in_2);
-      publish_dsp_value(I_IN_1, i_in_1);
-      publish_dsp_value(I_IN_2, i_in_2);
-      publish_dsp_value(POWER_IN_1, power_in_1);
-      publish_dsp_value(POWER_IN_2, power_in_2);
-      power_in_total->publish_state(power_in_1->get_state() + power_in_2->get_state());
-      publish_dsp_value(POWER_PEAK_TODAY, power_peak_today);
-      publish_dsp_value(POWER_PEAK, power_peak_max);
-      publish_dsp_value(TEMPERATURE_INVERTER, temperature_inverter);
-      publish_dsp_value(TEMPERATURE_BOOSTER, temperature_booster);
-      publish_cumulated_energy(CURRENT_DAY, cumulated_energy_today);
-      publish_cumulated_energy(CURRENT_WEEK, cumulated_energy_week);
-      publish_cumulated_energy(CURRENT_MONTH, cumulated_energy_month);
-      publish_cumulated_energy(CURRENT_YEAR, cumulated_energy_year);
-      publish_cumulated_energy(TOTAL, cumulated_energy_total);
-      publish_dsp_value(GRID_VOLTAGE, grid_voltage);
-      publish_dsp_value(GRID_CURRENT, grid_current);
-      publish_dsp_value(GRID_POWER, grid_power);
-      publish_dsp_value(FREQUENCY, frequency);
-      publish_dsp_value(V_BULK, v_bulk);
-      publish_dsp_value(I_LEAK_DC_DC, i_leak_dc_dc);
-      publish_dsp_value(I_LEAK_INVERTER, i_leak_inverter);
-      publish_dsp_value(DC_DC_GRID_VOLTAGE, dc_dc_grid_voltage);
-      publish_dsp_value(DC_DC_GRID_FREQUENCY, dc_dc_grid_frequency);
-      publish_dsp_value(ISOLATION_RESISTANCE, isolation_resistance);
-      publish_dsp_value(DC_DC_V_BULK, dc_dc_v_bulk);
-      publish_dsp_value(AVERAGE_GRID_VOLTAGE, average_grid_voltage);
-      publish_dsp_value(V_BULK_MID, v_bulk_mid);
-      publish_dsp_value(GRID_VOLTAGE_NEUTRAL, grid_voltage_neutral);
-      publish_dsp_value(WIND_GENERATOR_FREQENCY, wind_generator_frequency);
-      publish_dsp_value(GRID_VOLTAGE_NEUTRAL_PHASE, grid_voltage_neutral_phase);
-      publish_dsp_value(GRID_CURRENT_PHASE_R, grid_current_phase_r);
-      publish_dsp_value(GRID_CURRENT_PHASE_S, grid_current_phase_s);
-      publish_dsp_value(GRID_CURRENT_PHASE_T, grid_current_phase_t);
-      publish_dsp_value(FREQUENCY_PHASE_R, frequency_phase_r);
-      publish_dsp_value(FREQUENCY_PHASE_S, frequency_phase_s);
-      publish_dsp_value(FREQUENCY_PHASE_T, frequency_phase_t);
-      publish_dsp_value(V_BULK_POSITIVE, v_bulk_positive);
-      publish_dsp_value(V_BULK_NEGATIVE, v_bulk_negative);
-      publish_temperature(TEMPERATURE_SUPERVISOR, temperature_supervisor);
-      publish_temperature(TEMPERATURE_ALIM, temperature_alim);
-      publish_temperature(TEMPERATURE_HEAT_SINK, temperature_heat_sink);
-      publish_temperature(TEMPERATURE_1, temperature_1);
-      publish_temperature(TEMPERATURE_2, temperature_2);
-      publish_temperature(TEMPERATURE_3, temperature_3);
-      publish_dsp_value(FAN_SPEED_1, fan_speed_1);
-      publish_dsp_value(FAN_SPEED_2, fan_speed_2);
-      publish_dsp_value(FAN_SPEED_3, fan_speed_3);
-      publish_dsp_value(FAN_SPEED_4, fan_speed_4);
-      publish_dsp_value(FAN_SPEED_5, fan_speed_5);
-      publish_dsp_value(POWER_SATURATION_LIMIT, power_saturation_limit);
-      publish_dsp_value(V_PANEL_MICRO, v_panel_micro);
-      publish_dsp_value(GRID_VOLTAGE_PHASE_R, grid_voltage_phase_r);
-      publish_dsp_value(GRID_VOLTAGE_PHASE_S, grid_voltage_phase_s);
-      publish_dsp_value(GRID_VOLTAGE_PHASE_T, grid_voltage_phase_t);
-
-      turn_led_off();
-    }
-    else
+    if (!inverter->ReadState())
     {
       if (connection)
       {
         connection = 0;
         connection_status->publish_state(DISCONNECTED);
       }
-      ESP_LOGD(TAG, "Inverter not connected");
+      // Powered down for the night: probe less and less often instead of timing out every update
+      probe_backoff = std::min<uint32_t>(std::max<uint32_t>(probe_backoff * 2, get_update_interval()), OFFLINE_PROBE_MAX_MS);
+      // A single lost frame is not the end of the day
+      if (probe_backoff == OFFLINE_PROBE_MAX_MS)
+        stop_producing();
+      next_probe = now + probe_backoff;
+      ESP_LOGD(TAG, "Inverter not connected, next probe in %u ms", probe_backoff);
+      return;
+    }
+    probe_backoff = 0;
+    if (!connection)
+    {
+      connection = 1;
+      connection_status->publish_state(CONNECTED);
+    }
+
+    // Waiting for the sun (or a grid fault): nothing but the state can change until it runs again
+    if (inverter->State.GlobalState != GLOBAL_STATE_RUN && inverter->State.InverterState != INVERTER_STATE_RUN)
+    {
+      stop_producing();
+      next_probe = now + STANDBY_PROBE_MS;
+      ESP_LOGD(TAG, "Inverter in standby (global state %d)", inverter->State.GlobalState);
+      return;
+    }
+    if (!producing)
+    {
+      // Read everything once when production starts
+      producing = true;
+      for (auto &polled : polls)
+        polled.next_due = now;
+    }
+    turn_led_on();
+
+    publish_dsp_value(POWER_IN_1, power_in_1);
+    publish_dsp_value(POWER_IN_2, power_in_2);
+    power_in_total->publish_state(power_in_1->get_state() + power_in_2->get_state());
+
+    for (auto &polled : polls)
+    {
+      if ((int32_t)(now - polled.next_due) < 0)
+        continue;
+      polled.next_due = now + polled.interval;
+      if (!can_change(polled))
+        continue;
+      switch (polled.kind)
+      {
+      case POLL_DSP:
+        publish_dsp_value((DSP_VALUE_TYPE)polled.type, polled.sensor);
+        break;
+      case POLL_TEMPERATURE:
+        publish_temperature((DSP_VALUE_TYPE)polled.type, polled.sensor);
+        break;
+      case POLL_ENERGY:
+        publish_cumulated_energy((CUMULATED_ENERGY_TYPE)polled.type, polled.sensor);
+        break;
+      }
     }
+
+    turn_led_off();
+  }
+
+  // False when a value cannot differ from its last reading, so the bus transaction can be skipped
+  bool can_change(const PolledValue &polled)
+  {
+    if (!polled.sensor->has_state())
+      return true;
+    if (polled.needs_power && !(power_in_total->get_state() > 0))
+      return false;
+    // The all-time peak can only move once today's peak reaches it
+    if (polled.sensor == power_peak_max && power_peak_today->get_state() < power_peak_max->get_state())
+      return false;
+    return true;
+  }
+
+  // The power sensors would otherwise keep the last daytime value through the night
+  void stop_producing()
+  {
+    if (!producing)
+      return;
+    producing = false;
+    power_in_1->publish_state(0);
+    power_in_2->publish_state(0);
+    power_in_total->publish_state(0);
+    grid_power->publish_state(0);
+    ESP_LOGI(TAG, "Inverter stopped producing");
   }
 
   void turn_led_on()
@@ -0,0 +1,285 @@
+#pragma once
+
+#include <cinttypes>
+#include "esphome.h"
+#include "AuroraPayload.h"
+
+using namespace esphome;
+
+// Readings waiting to be uploaded to /api/inverter_data/bulk.
+//
+// Every reading is stamped when it is taken and kept in a fixed-size ring until
+// the API acknowledges it, so a WiFi or server outage leaves no gap: the backlog
+// goes out in batches once the link is back, and during normal operation several
+// readings can share one request (and one TLS handshake). When the ring is full
+// the oldest reading is overwritten.
+//
+// With persistence enabled the ring is also saved to flash (NVS) after a failed
+// upload, so readings survive a reboot during an outage. Saves only happen while
+// an outage lasts and ESPHome batches them (preferences: flash_write_interval).
+// The default capacity of two hours (~6 KB) fits the default NVS partition; a
+// larger one can be set with -DREADING_BUFFER_CAPACITY in build_flags.
+
+#ifndef READING_BUFFER_CAPACITY
+#define READING_BUFFER_CAPACITY 120
+#endif
+
+#define READING_BUFFER_FIELDS 10
+#define READING_BUFFER_TAG "READING_BUFFER"
+
+// JSON names of the fields, indexed by AuroraPayloadField - 1
+static const char *const READING_BUFFER_FIELD_NAMES[READING_BUFFER_FIELDS] = {
+    "power_in_total", "power_peak_today", "power_peak_max", "inverter_temp",
+    "cumulated_energy_today", "cumulated_energy_week", "cumulated_energy_month",
+    "cumulated_energy_year", "cumulated_energy_total", "grid_voltage",
+};
+
+struct BufferedReading
+{
+  uint32_t timestamp; // epoch seconds, 0 when the clock was not set yet
+  uint32_t uptime;    // seconds since boot when the reading was taken
+  float values[READING_BUFFER_FIELDS];
+
+  void set(AuroraPayloadField id, float value)
+  {
+    values[id - 1] = value;
+  }
+
+  static bool is_energy(int index)
+  {
+    return index >= PAYLOAD_CUMULATED_ENERGY_TODAY - 1 && index <= PAYLOAD_CUMULATED_ENERGY_TOTAL - 1;
+  }
+};
+
+struct ReadingRing
+{
+  uint16_t head;  // index of the oldest reading
+  uint16_t count;
+  BufferedReading readings[READING_BUFFER_CAPACITY];
+};
+
+class ReadingBuffer : public Component
+{
+
+protected:
+  ReadingBuffer() {}
+  static ReadingBuffer *instance_;
+
+private:
+  ReadingRing ring_{};
+  uint16_t in_flight_ = 0; // oldest readings included in the pending upload
+  bool persistent_ = false;
+  bool saved_ = false;     // the ring in flash holds readings
+  uint32_t overwritten_ = 0;
+  ESPPreferenceObject pref_;
+
+public:
+  ReadingBuffer(ReadingBuffer &other) = delete;
+  void operator=(const ReadingBuffer &) = delete;
+  static ReadingBuffer *get_instance();
+
+  void set_persistent(bool persistent)
+  {
+    persistent_ = persistent;
+  }
+
+  void setup() override
+  {
+    if (!persistent_)
+      return;
+    pref_ = global_preferences->make_preference<ReadingRing>(fnv1_hash("reading_buffer"));
+    if (!pref_.load(&ring_) || ring_.head >= READING_BUFFER_CAPACITY || ring_.count > READING_BUFFER_CAPACITY)
+    {
+      ring_.head = ring_.count = 0;
+      return;
+    }
+
+    // Uptimes belong to the previous boot: readings taken before the clock was set cannot be placed in time
+    std::vector<BufferedReading> restored;
+    for (uint16_t i = 0; i < ring_.count; i++)
+    {
+      const BufferedReading &reading = at(i);
+      if (reading.timestamp != 0)
+        restored.push_back(reading);
+    }
+    ring_.head = 0;
+    ring_.count = restored.size();
+    std::copy(restored.begin(), restored.end(), ring_.readings);
+    for (uint16_t i = 0; i < ring_.count; i++)
+      ring_.readings[i].uptime = 0;
+    saved_ = ring_.count > 0;
+    ESP_LOGI(READING_BUFFER_TAG, "Restored %u buffered readings", ring_.count);
+  }
+
+  void push(BufferedReading reading, ESPTime now)
+  {
+    reading.timestamp = now.is_valid() ? (uint32_t)now.timestamp : 0;
+    reading.uptime = millis() / 1000;
+    if (ring_.count == READING_BUFFER_CAPACITY)
+    {
+      // Overwrite the oldest reading; if it was part of the pending upload, that upload no longer covers it
+      ring_.head = (ring_.head + 1) % READING_BUFFER_CAPACITY;
+      ring_.count--;
+      if (in_flight_ > 0)
+        in_flight_--;
+      overwritten_++;
+    }
+    ring_.readings[(ring_.head + ring_.count) % READING_BUFFER_CAPACITY] = reading;
+    ring_.count++;
+  }
+
+  uint16_t size() const
+  {
+    return ring_.count;
+  }
+
+  uint32_t overwritten() const
+  {
+    return overwritten_;
+  }
+
+  // True when an upload is due: enough readings are waiting, or the oldest has waited max_age seconds
+  bool ready(uint16_t min_readings, uint32_t max_age) const
+  {
+    if (ring_.count == 0)
+      return false;
+    return ring_.count >= min_readings || millis() / 1000 - at(0).uptime >= max_age;
+  }
+
+  // Encodes the oldest readings (up to max_readings) as the body of a bulk upload
+  std::string begin_batch(uint16_t max_readings, bool binary, ESPTime now)
+  {
+    if (in_flight_ > 0)
+    {
+      // The previous upload never got a response (no WiFi, DNS or TLS failure)
+      ESP_LOGW(READING_BUFFER_TAG, "Upload of %u readings got no response, %u buffered", in_flight_, ring_.count);
+      save();
+    }
+    in_flight_ = std::min(max_readings, ring_.count);
+    resolve_timestamps(now);
+
+    std::string body;
+    if (!binary)
+      body.push_back('[');
+    for (uint16_t i = 0; i < in_flight_; i++)
+    {
+      if (binary)
+        body += encode_binary(at(i));
+      else
+      {
+        if (i > 0)
+          body.push_back(',');
+        body += encode_json(at(i));
+      }
+    }
+    if (!binary)
+      body.push_back(']');
+    return body;
+  }
+
+  // Drops the uploaded readings on success; keeps them for the next attempt when the API may accept them later
+  void finish_batch(int status_code)
+  {
+    if (in_flight_ == 0)
+      return;
+    bool retry = status_code == 401 || status_code == 408 || status_code == 429 || status_code >= 500;
+    if (status_code >= 200 && !retry)
+    {
+      if (status_code >= 300)
+        ESP_LOGW(READING_BUFFER_TAG, "Upload refused with HTTP %d, dropping %u readings", status_code, in_flight_);
+      ring_.head = (ring_.head + in_flight_) % READING_BUFFER_CAPACITY;
+      ring_.count -= in_flight_;
+      in_flight_ = 0;
+      if (saved_ && ring_.count == 0)
+        save();
+      return;
+    }
+    ESP_LOGW(READING_BUFFER_TAG, "Upload failed with HTTP %d, %u readings buffered", status_code, ring_.count);
+    in_flight_ = 0;
+    save();
+  }
+
+private:
+  const BufferedReading &at(uint16_t i) const
+  {
+    return ring_.readings[(ring_.head + i) % READING_BUFFER_CAPACITY];
+  }
+
+  BufferedReading &at(uint16_t i)
+  {
+    return ring_.readings[(ring_.head + i) % READING_BUFFER_CAPACITY];
+  }
+
+  // Readings taken before SNTP synced get their time from how long ago they were taken
+  void resolve_timestamps(ESPTime now)
+  {
+    if (!now.is_valid())
+      return;
+    uint32_t uptime = millis() / 1000;
+    for (uint16_t i = 0; i < ring_.count; i++)
+    {
+      BufferedReading &reading = at(i);
+      if (reading.timestamp == 0)
+        reading.timestamp = (uint32_t)now.timestamp - (uptime - reading.uptime);
+    }
+  }
+
+  void save()
+  {
+    if (!persistent_)
+      return;
+    pref_.save(&ring_);
+    saved_ = ring_.count > 0;
+  }
+
+  static std::string encode_binary(const BufferedReading &reading)
+  {
+    AuroraPayload payload;
+    for (int i = 0; i < READING_BUFFER_FIELDS; i++)
+    {
+      if (BufferedReading::is_energy(i))
+        payload.add_energy((AuroraPayloadField)(i + 1), reading.values[i]);
+      else
+        payload.add_float((AuroraPayloadField)(i + 1), reading.values[i]);
+    }
+    if (reading.timestamp != 0)
+      payload.add_timestamp(reading.timestamp);
+    return payload.data;
+  }
+
+  static std::string encode_json(const BufferedReading &reading)
+  {
+    // A reading without a timestamp is stamped by the API on arrival
+    std::string json = "{";
+    char value[48];
+    if (reading.timestamp != 0)
+    {
+      snprintf(value, sizeof(value), "\"timestamp\":%" PRIu32, reading.timestamp);
+      json += value;
+    }
+    for (int i = 0; i < READING_BUFFER_FIELDS; i++)
+    {
+      float v = reading.values[i];
+      if (std::isnan(v))
+        continue;
+      if (json.size() > 1)
+        json.push_back(',');
+      if (BufferedReading::is_energy(i))
+        snprintf(value, sizeof(value), "\"%s\":%ld", READING_BUFFER_FIELD_NAMES[i], lroundf(v));
+      else
+        snprintf(value, sizeof(value), "\"%s\":%.7g", READING_BUFFER_FIELD_NAMES[i], v);
+      json += value;
+    }
+    json.push_back('}');
+    return json;
+  }
+};
+
+ReadingBuffer *ReadingBuffer::instance_ = nullptr;
+
+ReadingBuffer *ReadingBuffer::get_instance()
+{
+  if (instance_ == nullptr)
+    instance_ = new ReadingBuffer();
+  return instance_;
+}
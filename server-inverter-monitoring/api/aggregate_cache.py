@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class AggregateCache:
+    """
+    Query results shared by every dashboard viewer. Callers build keys from
+    time ranges snapped to the aggregation window, so viewers refreshing the
+    same relative range land on the same entry. While a result is computed,
+    other requests for the same key wait for it instead of querying InfluxDB
+    themselves, so the query cost per refresh does not grow with the viewers.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, ttl=None):
+        """
+        Returns the cached value of key, or computes, stores and returns it.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another request is computing this key; if it fails, this one tries itself
+            pending.wait()
+
+        try:
+            value = compute()
+            with self._lock:
+                self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending.set()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class DailyTotals:
+    """
+    Energy produced on each finished local day, per device. A finished day
+    cannot change any more, so it is queried once and kept; only the days
+    missing from the store are fetched.
+    """
+
+    def __init__(self, max_days=3660):
+        self.max_days = max_days
+        self._days = {}
+        self._lock = threading.Lock()
+
+    def missing(self, device_name, dates):
+        days = self._days.get(device_name, {})
+        return [date for date in dates if date not in days]
+
+    def update(self, device_name, totals):
+        with self._lock:
+            days = self._days.setdefault(device_name, {})
+            days.update(totals)
+            if len(days) > self.max_days:
+                for date in sorted(days)[:len(days) - self.max_days]:
+                    del days[date]
+
+    def get(self, device_name, date):
+        return self._days.get(device_name, {}).get(date)
@@ -0,0 +1,366 @@
+import math
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+
+class Alert:
+    __slots__ = ("device_name", "rule", "title", "message", "priority", "timestamp")
+
+    def __init__(self, device_name, rule, title, message, priority, timestamp):
+        self.device_name = device_name
+        self.rule = rule
+        self.title = title
+        self.message = message
+        self.priority = priority
+        self.timestamp = timestamp
+
+    @property
+    def key(self):
+        return f"{self.device_name}:{self.rule}"
+
+
+class Rule:
+    """
+    Base class for anomaly rules. A rule keeps its rolling state in the object
+    returned by new_state(), one per device, and evaluate() must update it in
+    O(1) per reading. evaluate() returns (title, message) when the rule fires.
+    """
+
+    name = "rule"
+    priority = 5
+
+    def new_state(self):
+        return None
+
+    def evaluate(self, state, fields, timestamp):
+        raise NotImplementedError
+
+
+class StuckValueState:
+    __slots__ = ("last_value", "count")
+
+    def __init__(self):
+        self.last_value = None
+        self.count = 0
+
+
+class StuckValueRule(Rule):
+    """
+    Fires when a field repeats the same non-zero value for `threshold` readings.
+    Zero is ignored, since a sleeping inverter legitimately reports 0 all night.
+    """
+
+    def __init__(self, field="power_in_total", threshold=5, unit="W"):
+        self.name = f"stuck_{field}"
+        self.field = field
+        self.threshold = threshold
+        self.unit = unit
+
+    def new_state(self):
+        return StuckValueState()
+
+    def evaluate(self, state, fields, timestamp):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        if value == 0 or value != state.last_value:
+            state.last_value = value
+            state.count = 0
+            return None
+
+        state.count += 1
+        if state.count >= self.threshold:
+            return ("Inverter Power Alert",
+                    f"{self.field} has not changed for the last {self.threshold} readings: {value} {self.unit}")
+        return None
+
+
+class RateOfChangeState:
+    __slots__ = ("last_value", "last_timestamp")
+
+    def __init__(self):
+        self.last_value = None
+        self.last_timestamp = None
+
+
+class RateOfChangeRule(Rule):
+    """
+    Fires when a field changes faster than max_rate units per minute between two readings.
+    """
+
+    def __init__(self, field, max_rate, unit=""):
+        self.name = f"rate_{field}"
+        self.field = field
+        self.max_rate = max_rate
+        self.unit = unit
+
+    def new_state(self):
+        return RateOfChangeState()
+
+    def evaluate(self, state, fields, timestamp):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        last_value, last_timestamp = state.last_value, state.last_timestamp
+        if last_timestamp is not None and timestamp <= last_timestamp:
+            # A late or repeated reading (bulk import, spool replay) must not replace the newest one
+            return None
+        state.last_value, state.last_timestamp = value, timestamp
+        if last_value is None:
+            return None
+
+        rate = (value - last_value) / ((timestamp - last_timestamp) / 60)
+        if abs(rate) > self.max_rate:
+            return ("Inverter Rate Alert",
+                    f"{self.field} changed by {rate:+.1f} {self.unit}/min (limit {self.max_rate} {self.unit}/min)")
+        return None
+
+
+class TrendState:
+    """
+    Rolling least-squares window: the sums are updated as samples enter and
+    leave, so the slope costs O(1) per reading whatever the window size.
+    x is taken relative to an origin that moves to the oldest sample once per
+    window, where the sums are recomputed, so they neither grow with the uptime
+    nor drift through cancellation.
+    """
+
+    __slots__ = ("samples", "sum_x", "sum_y", "sum_xx", "sum_xy", "origin", "evictions")
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        self.origin = None
+        self.evictions = 0
+
+    def add(self, x, y):
+        if self.origin is None:
+            self.origin = x
+        if len(self.samples) == self.samples.maxlen:
+            old_x, old_y = self.samples[0]
+            old_x -= self.origin
+            self.sum_x -= old_x
+            self.sum_y -= old_y
+            self.sum_xx -= old_x * old_x
+            self.sum_xy -= old_x * old_y
+            self.evictions += 1
+        self.samples.append((x, y))
+        if self.evictions >= self.samples.maxlen:
+            self._rebase()
+            return
+        x -= self.origin
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+
+    def _rebase(self):
+        self.origin = self.samples[0][0]
+        self.evictions = 0
+        self.sum_x = self.sum_y = self.sum_xx = self.sum_xy = 0.0
+        for x, y in self.samples:
+            x -= self.origin
+            self.sum_x += x
+            self.sum_y += y
+            self.sum_xx += x * x
+            self.sum_xy += x * y
+
+    def slope(self):
+        n = len(self.samples)
+        denominator = n * self.sum_xx - self.sum_x * self.sum_x
+        if n < 2 or denominator <= 0:
+            return None
+        return (n * self.sum_xy - self.sum_x * self.sum_y) / denominator
+
+
+class TemperatureTrendRule(Rule):
+    """
+    Fires when the inverter temperature is above min_temperature and has been
+    rising faster than max_slope °C per minute over the last `window` readings.
+    """
+
+    def __init__(self, field="inverter_temp", window=15, max_slope=0.5, min_temperature=60.0):
+        self.name = f"trend_{field}"
+        self.field = field
+        self.window = window
+        self.max_slope = max_slope
+        self.min_temperature = min_temperature
+
+    def new_state(self):
+        return TrendState(self.window)
+
+    def evaluate(self, state, fields, timestamp):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        state.add(timestamp / 60, value)
+        if len(state.samples) < self.window or value < self.min_temperature:
+            return None
+
+        slope = state.slope()
+        if slope is not None and slope > self.max_slope:
+            return ("Inverter Temperature Alert",
+                    f"{self.field} is {value:.1f} °C and rising {slope:.2f} °C/min")
+        return None
+
+
+class ExcursionState:
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+class ExcursionRule(Rule):
+    """
+    Fires when a field stays outside [low, high] for `consecutive` readings in a row.
+    """
+
+    def __init__(self, field, low, high, consecutive=3, unit="", title="Inverter Range Alert"):
+        self.name = f"excursion_{field}"
+        self.title = title
+        self.field = field
+        self.low = low
+        self.high = high
+        self.consecutive = consecutive
+        self.unit = unit
+
+    def new_state(self):
+        return ExcursionState()
+
+    def evaluate(self, state, fields, timestamp):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        if self.low <= value <= self.high:
+            state.count = 0
+            return None
+
+        state.count += 1
+        if state.count >= self.consecutive:
+            return (self.title,
+                    f"{self.field} has been outside {self.low}-{self.high} {self.unit} for "
+                    f"{state.count} readings: {value} {self.unit}")
+        return None
+
+
+def clear_sky_factor(timestamp, latitude, longitude):
+    """
+    Rough clear-sky output as a fraction of peak power: the sine of the solar
+    elevation (equation of time and atmosphere ignored), 0 when the sun is down.
+    """
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    day_of_year = moment.timetuple().tm_yday
+    declination = math.radians(23.44) * math.sin(2 * math.pi * (284 + day_of_year) / 365)
+    solar_hours = moment.hour + moment.minute / 60 + longitude / 15
+    hour_angle = math.radians(15 * (solar_hours - 12))
+    lat = math.radians(latitude)
+    sin_elevation = (math.sin(lat) * math.sin(declination)
+                     + math.cos(lat) * math.cos(declination) * math.cos(hour_angle))
+    return max(sin_elevation, 0.0)
+
+
+class RollingMeanState:
+    __slots__ = ("samples", "sum_actual", "sum_expected")
+
+    def __init__(self, size):
+        self.samples = deque(maxlen=size)
+        self.sum_actual = 0.0
+        self.sum_expected = 0.0
+
+    def add(self, actual, expected):
+        if len(self.samples) == self.samples.maxlen:
+            old_actual, old_expected = self.samples[0]
+            self.sum_actual -= old_actual
+            self.sum_expected -= old_expected
+        self.samples.append((actual, expected))
+        self.sum_actual += actual
+        self.sum_expected += expected
+
+
+class LowProductionRule(Rule):
+    """
+    Fires when production over the last `window` readings is below min_ratio of
+    the clear-sky expectation for the site. Only evaluated in daylight, when the
+    expectation is at least min_expected_factor of peak power.
+    """
+
+    def __init__(self, latitude, longitude, peak_power, field="power_in_total", window=30,
+                 min_ratio=0.1, min_expected_factor=0.25, system_efficiency=0.75):
+        self.name = f"low_{field}"
+        self.field = field
+        self.latitude = latitude
+        self.longitude = longitude
+        self.peak_power = peak_power
+        self.window = window
+        self.min_ratio = min_ratio
+        self.min_expected_factor = min_expected_factor
+        self.system_efficiency = system_efficiency
+
+    def new_state(self):
+        return RollingMeanState(self.window)
+
+    def evaluate(self, state, fields, timestamp):
+        value = fields.get(self.field)
+        if value is None:
+            return None
+        factor = clear_sky_factor(timestamp, self.latitude, self.longitude)
+        if factor < self.min_expected_factor:
+            # Dawn, dusk and night readings say nothing about the plant
+            state.samples.clear()
+            state.sum_actual = state.sum_expected = 0.0
+            return None
+
+        state.add(value, self.peak_power * self.system_efficiency * factor)
+        if len(state.samples) < self.window:
+            return None
+        if state.sum_actual < self.min_ratio * state.sum_expected:
+            n = len(state.samples)
+            return ("Inverter Production Alert",
+                    f"Average production {state.sum_actual / n:.0f} W is below {self.min_ratio:.0%} "
+                    f"of the clear-sky expectation ({state.sum_expected / n:.0f} W)")
+        return None
+
+
+class DeviceState:
+    __slots__ = ("lock", "rule_states")
+
+    def __init__(self, rules):
+        self.lock = threading.Lock()
+        self.rule_states = [rule.new_state() for rule in rules]
+
+
+class AnomalyEngine:
+    """
+    Runs every rule incrementally on each reading, with separate state per device.
+    A rule keeps firing while its condition holds; repeated alerts share a key
+    so the notification dispatcher can rate limit them.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device_state(self, device_name):
+        state = self._devices.get(device_name)
+        if state is None:
+            with self._lock:
+                state = self._devices.setdefault(device_name, DeviceState(self.rules))
+        return state
+
+    def process(self, device_name, fields, timestamp):
+        """
+        Feeds one reading to every rule and returns the alerts it raised.
+        """
+        alerts = []
+        device = self._device_state(device_name)
+        with device.lock:
+            for rule, rule_state in zip(self.rules, device.rule_states):
+                result = rule.evaluate(rule_state, fields, timestamp)
+                if result is not None:
+                    title, message = result
+                    alerts.append(Alert(device_name, rule.name, title, f"[{device_name}] {message}",
+                                        rule.priority, timestamp))
+        return alerts
@@ -1,15 +1,63 @@
 import os
+import atexit
+import functools
+import logging
 import math
 import time
-from flask import Flask, request, jsonify
+import json
+import re
+import hashlib
+import threading
+import queue
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
 from influxdb_client.client.query_api import QueryApi
-import requests
+from write_pipeline import WritePipeline
+from spool import Spool, SpoolReplayer
+from ingest_routes import IngestRoute
+from tenants import TenantIndex
+from last_value_cache import LastValueCache
+from aggregate_cache import AggregateCache, DailyTotals
+from anomaly import AnomalyEngine, clear_sky_factor, StuckValueRule, RateOfChangeRule, TemperatureTrendRule, ExcursionRule, LowProductionRule
+from notifications import NotificationDispatcher, GotifySink, WebhookSink, SmtpSink, pooled_session
+from device_registry import DeviceRegistry
+from derived_metrics import DerivedMetrics
+from live_stream import LiveBroadcaster, format_event
+import binary_format
+from schema import READING_SCHEMA, ReadingValidator, parse_timestamp
+from downsampling import build_tiers, format_seconds, select_tier, start_downsampling_setup
+from metrics import Registry, DEFAULT_SIZE_BUCKETS
+from structured_logging import configure_logging
+
+# --- Logging Configuration ---
+# LOG_FORMAT=json emits one JSON object per line for log collectors.
+configure_logging(os.environ.get("LOG_LEVEL", "INFO"), os.environ.get("LOG_FORMAT", "text").lower())
+log = logging.getLogger("inverter_api")
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
 
+# --- Metrics ---
+# Exposed in Prometheus text format on /metrics.
+registry = Registry()
+request_latency = registry.histogram(
+    "inverter_api_request_duration_seconds", "Time spent handling an API request", labels=("endpoint",))
+influx_write_latency = registry.histogram(
+    "inverter_api_influxdb_write_duration_seconds", "Duration of InfluxDB write calls")
+influx_write_batch_size = registry.histogram(
+    "inverter_api_influxdb_write_batch_size", "Records sent per InfluxDB write call", buckets=DEFAULT_SIZE_BUCKETS)
+influx_query_latency = registry.histogram(
+    "inverter_api_influxdb_query_duration_seconds", "Duration of InfluxDB queries", labels=("query",))
+validation_rejects = registry.counter(
+    "inverter_api_validation_rejects_total", "Reading values rejected by the schema", labels=("field",))
+alerts_raised = registry.counter(
+    "inverter_api_alerts_total", "Alerts raised by the anomaly rules", labels=("rule",))
+rate_limited = registry.counter(
+    "inverter_api_rate_limited_total", "Uploads refused by a tenant rate limit", labels=("tenant",))
+
 # --- InfluxDB Configuration ---
 INFLUXDB_URL = os.environ.get("INFLUXDB_URL")
 INFLUXDB_TOKEN = os.environ.get("INFLUXDB_TOKEN")
@@ -18,195 +66,1259 @@ INFLUXDB_BUCKET = os.environ.get("INFLUXDB_BUCKET")
 
 # --- Initialize InfluxDB Client ---
 try:
-    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG)
+    # One pooled client per process, shared by every request handler
+    client = InfluxDBClient(url=INFLUXDB_URL, token=INFLUXDB_TOKEN, org=INFLUXDB_ORG,
+                            connection_pool_maxsize=int(os.environ.get("INFLUXDB_POOL_SIZE", "50")))
     write_api = client.write_api(write_options=SYNCHRONOUS)
-    print("Successfully connected to InfluxDB.")
+    log.info("InfluxDB client initialized for %s", INFLUXDB_URL)
 except Exception as e:
-    print(f"FATAL: Could not connect to InfluxDB. Please check credentials and URL. Error: {e}")
+    log.critical("Could not connect to InfluxDB. Please check credentials and URL. Error: %s", e)
     client = None
     
 query_api = client.query_api()
 
-VALIDATION_RANGES = {
-    "grid_voltage": (180, 280),
-    "power_in_total": (0, 10000), 
-    "inverter_temp": (-20, 120),
+
+def write_records(records, bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG):
+    """
+    Writes points or line protocol to InfluxDB; every write path goes through here so it is measured.
+    """
+    influx_write_batch_size.observe(len(records) if isinstance(records, list) else 1)
+    with influx_write_latency.time():
+        write_api.write(bucket=bucket, org=org, record=records)
+
+
+# --- Ingest Pipeline Configuration ---
+# "sync" writes each request to InfluxDB before answering, "async" queues the
+# points and lets a background flusher write them in batches, "spool" appends
+# them to an on-disk write-ahead log that is replayed into InfluxDB.
+INGEST_MODE = os.environ.get("INGEST_MODE", "sync").lower()
+
+INGEST_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", "500"))
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "/app/spool")
+
+
+def build_ingest_route(name, bucket, org, batch_size=INGEST_BATCH_SIZE, spool_dir=SPOOL_DIR):
+    """
+    Creates the writer of one destination bucket for the configured ingest mode.
+    """
+    write = functools.partial(write_records, bucket=bucket, org=org)
+    if client and INGEST_MODE == "async":
+        pipeline = WritePipeline(
+            write,
+            max_queue_size=int(os.environ.get("INGEST_QUEUE_SIZE", "10000")),
+            batch_size=batch_size,
+            max_batch_age=float(os.environ.get("INGEST_BATCH_MAX_AGE", "1.0")),
+            max_retries=int(os.environ.get("INGEST_MAX_RETRIES", "5")),
+        )
+        pipeline.start()
+        return IngestRoute(name, bucket, write, pipeline=pipeline)
+
+    if client and INGEST_MODE == "spool":
+        spool = Spool(
+            spool_dir,
+            segment_max_bytes=int(os.environ.get("SPOOL_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024))),
+            max_total_bytes=int(os.environ.get("SPOOL_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024))),
+            fsync_interval=float(os.environ.get("SPOOL_FSYNC_INTERVAL", "1.0")),
+            fsync_batch=int(os.environ.get("SPOOL_FSYNC_BATCH", "100")),
+        )
+        replayer = SpoolReplayer(
+            spool,
+            write,
+            batch_size=int(os.environ.get("SPOOL_REPLAY_BATCH_SIZE", "5000")),
+        )
+        replayer.start()
+        return IngestRoute(name, bucket, write, spool=spool, replayer=replayer)
+
+    return IngestRoute(name, bucket, write)
+
+
+default_route = build_ingest_route("default", INFLUXDB_BUCKET, INFLUXDB_ORG)
+
+# --- Tenant Configuration ---
+# With TENANTS_FILE set, every upload must carry a device token
+# ("Authorization: Bearer <token>"). The token decides the device name and the
+# tenant, whose bucket, rate limit and write batches are used for the reading.
+TENANTS_FILE = os.environ.get("TENANTS_FILE")
+tenant_index = TenantIndex(TENANTS_FILE, INFLUXDB_ORG, default_batch_size=INGEST_BATCH_SIZE) if TENANTS_FILE else None
+tenant_routes = {}
+tenant_routes_lock = threading.Lock()
+
+
+def tenant_route(tenant):
+    """
+    Returns the ingest route of a tenant, creating it on its first reading.
+    """
+    route = tenant_routes.get(tenant.name)
+    if route is None:
+        with tenant_routes_lock:
+            route = tenant_routes.get(tenant.name)
+            if route is None:
+                route = tenant_routes[tenant.name] = build_ingest_route(
+                    tenant.name, tenant.bucket, tenant.org, tenant.batch_size, os.path.join(SPOOL_DIR, tenant.name))
+    return route
+
+
+def all_routes():
+    with tenant_routes_lock:
+        return [default_route] + list(tenant_routes.values())
+
+
+# A tenant's route is otherwise only created by its next upload: open the ones
+# with a spool left by the previous run, so their backlog is replayed at once.
+if tenant_index is not None and client and INGEST_MODE == "spool":
+    for spooled_tenant in tenant_index.tenants.values():
+        if os.path.isdir(os.path.join(SPOOL_DIR, spooled_tenant.name)):
+            tenant_route(spooled_tenant)
+
+
+# --- Last-Value Cache ---
+# Latest value per device and field, kept up to date by ingest so the read
+# endpoints only query InfluxDB after a restart or when the cache went stale.
+last_values = LastValueCache(ttl=float(os.environ.get("LAST_VALUE_CACHE_TTL", "3600")))
+
+# --- Downsampling Configuration ---
+# Hourly and daily rollups of the raw bucket, maintained by InfluxDB tasks.
+# /api/series reads from the coarsest tier that still fits the requested window.
+# Windows of a day cover local days of SITE_TIMEZONE, like the derived metrics.
+SITE_TIMEZONE = os.environ.get("SITE_TIMEZONE", "UTC")
+DOWNSAMPLING_ENABLED = os.environ.get("DOWNSAMPLING_ENABLED", "false").lower() == "true"
+rollup_tiers = build_tiers(
+    INFLUXDB_BUCKET,
+    hourly_retention=int(os.environ.get("ROLLUP_1H_RETENTION_DAYS", "730")) * 86400,
+    daily_retention=int(os.environ.get("ROLLUP_1D_RETENTION_DAYS", "0")) * 86400,
+    location=SITE_TIMEZONE,
+)
+if client and DOWNSAMPLING_ENABLED:
+    raw_retention_days = os.environ.get("RAW_RETENTION_DAYS")
+    start_downsampling_setup(client, INFLUXDB_ORG, INFLUXDB_BUCKET, rollup_tiers,
+                             raw_retention=int(raw_retention_days) * 86400 if raw_retention_days else None)
+
+# --- Live Stream Configuration ---
+# Accepted readings are pushed to /api/stream subscribers of this process.
+# Each stream client holds one of the worker's WORKER_CONNECTIONS greenlets for
+# as long as it stays connected, so streams get at most half of them and
+# uploads and reads always have spare capacity. STREAM_MAX_CLIENTS can only
+# lower that cap; further clients get a 503.
+WORKER_CONNECTIONS = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+STREAM_MAX_CLIENTS = int(os.environ.get("STREAM_MAX_CLIENTS", str(WORKER_CONNECTIONS // 2)))
+if STREAM_MAX_CLIENTS > WORKER_CONNECTIONS // 2:
+    log.warning("STREAM_MAX_CLIENTS=%d leaves too few of the %d worker connections for uploads, using %d",
+                STREAM_MAX_CLIENTS, WORKER_CONNECTIONS, WORKER_CONNECTIONS // 2)
+    STREAM_MAX_CLIENTS = WORKER_CONNECTIONS // 2
+live_stream = LiveBroadcaster(
+    queue_size=int(os.environ.get("STREAM_CLIENT_QUEUE_SIZE", "100")),
+    max_subscribers=STREAM_MAX_CLIENTS,
+)
+STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", "15"))
+
+# Deferred writes reach InfluxDB later, so points are stamped with their arrival time
+DEFERRED_WRITES = default_route.deferred
+
+# Reading schema compiled once; SCHEMA_STRICT also rejects numeric keys the schema does not know,
+# otherwise at most SCHEMA_MAX_EXTRA_FIELDS such keys are stored as fields
+reading_validator = ReadingValidator(READING_SCHEMA, strict=os.environ.get("SCHEMA_STRICT", "false").lower() == "true",
+                                     max_extra_fields=int(os.environ.get("SCHEMA_MAX_EXTRA_FIELDS", "20")))
+
+DEFAULT_DEVICE_NAME = "main_inverter"
+# Fields sent by the ESP32, returned by /api/latest when no fields are requested
+LATEST_DEFAULT_FIELDS = [
+    "power_in_total", "power_peak_today", "power_peak_max", "inverter_temp",
+    "cumulated_energy_today", "cumulated_energy_week", "cumulated_energy_month",
+    "cumulated_energy_year", "cumulated_energy_total", "grid_voltage",
+]
+FIELD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", "5000"))
+MAX_SERIES_POINTS = int(os.environ.get("MAX_SERIES_POINTS", "5000"))
+SERIES_AGGREGATES = ("mean", "max", "min", "last")
+
+# --- Grafana Datasource Configuration ---
+# /grafana serves the panels of grafana/dashboard-api.json over the JSON datasource protocol.
+# Results are shared by every viewer and recomputed at most once per GRAFANA_CACHE_TTL seconds.
+GRAFANA_CACHE_TTL = float(os.environ.get("GRAFANA_CACHE_TTL", "60"))
+# Series whose range ended before this much time ago cannot change any more and are kept longer
+GRAFANA_CLOSED_RANGE_TTL = 3600
+# A finished day is kept for good once readings buffered on the ESP32 during an outage (two hours) can no longer arrive
+GRAFANA_LATE_READINGS = timedelta(hours=3)
+# Current values older than this are not shown, like the -5m range of the original panels
+GRAFANA_CURRENT_MAX_AGE = 300
+# Stat targets: latest value of a field. "today" values only count when taken on the current local day.
+GRAFANA_STAT_TARGETS = {
+    "energy_today": "cumulated_energy_today",
+    "energy_week": "cumulated_energy_week",
+    "energy_month": "cumulated_energy_month",
+    "energy_year": "cumulated_energy_year",
+    "power_now": "power_in_total",
+    "power_peak_today": "power_peak_today",
+    "power_peak_max": "power_peak_max",
+    "grid_voltage_now": "grid_voltage",
+    "inverter_temp_now": "inverter_temp",
 }
+# Series targets: (field, aggregate) over windows snapped to GRAFANA_WINDOWS
+# Seconds the stats look back when the latest value is older than the last hour, as in
+# the ranges of the original panels; None is all time
+GRAFANA_STAT_LOOKBACK = {
+    "energy_today": 86400,
+    "power_peak_today": 86400,
+    "energy_week": 7 * 86400,
+    "energy_month": 30 * 86400,
+    "energy_year": 365 * 86400,
+    "power_peak_max": None,
+}
+GRAFANA_SERIES_TARGETS = {
+    "power_curve": ("power_in_total", "mean"),
+    "grid_voltage": ("grid_voltage", "mean"),
+    "inverter_temp": ("inverter_temp", "mean"),
+    "energy_total": ("cumulated_energy_total", "last"),
+}
+GRAFANA_WINDOWS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400)
+aggregate_cache = AggregateCache(ttl=GRAFANA_CACHE_TTL)
+daily_totals = DailyTotals()
 
-# --- Gotify Configuration ---
+# --- Notification Configuration ---
+# Alerts are delivered by background workers to every configured sink.
 GOTIFY_URL = os.environ.get("GOTIFY_URL")
 GOTIFY_TOKEN = os.environ.get("GOTIFY_TOKEN")
+ALERT_WEBHOOK_URL = os.environ.get("ALERT_WEBHOOK_URL")
+SMTP_HOST = os.environ.get("SMTP_HOST")
+NOTIFICATION_WORKERS = int(os.environ.get("NOTIFICATION_WORKERS", "2"))
+
+http_session = pooled_session(NOTIFICATION_WORKERS)
+notification_sinks = []
+if GOTIFY_URL and GOTIFY_TOKEN:
+    notification_sinks.append(GotifySink(GOTIFY_URL, GOTIFY_TOKEN, http_session))
+if ALERT_WEBHOOK_URL:
+    notification_sinks.append(WebhookSink(ALERT_WEBHOOK_URL, http_session))
+if SMTP_HOST:
+    notification_sinks.append(SmtpSink(
+        SMTP_HOST, int(os.environ.get("SMTP_PORT", "25")),
+        sender=os.environ.get("SMTP_FROM", "inverter-monitoring@localhost"),
+        recipients=[r.strip() for r in os.environ.get("SMTP_TO", "").split(",") if r.strip()],
+        username=os.environ.get("SMTP_USER"), password=os.environ.get("SMTP_PASSWORD"),
+        starttls=os.environ.get("SMTP_STARTTLS", "false").lower() == "true",
+    ))
+if not notification_sinks:
+    log.warning("No notification sink configured (Gotify, webhook or SMTP), alerts will not be sent.")
+
+notifier = NotificationDispatcher(
+    notification_sinks,
+    workers=NOTIFICATION_WORKERS,
+    cooldown=int(os.environ.get("ALERT_COOLDOWN", "300")),
+    max_retries=int(os.environ.get("NOTIFICATION_MAX_RETRIES", "3")),
+)
+notifier.start()
+
+# --- Anomaly Detection Configuration ---
+# Every rule runs on each stored reading with its own rolling state per device.
 SAME_VALUE_THRESHOLD = 5
+anomaly_rules = [
+    StuckValueRule("power_in_total", threshold=SAME_VALUE_THRESHOLD, unit="W"),
+    RateOfChangeRule("inverter_temp", max_rate=float(os.environ.get("ALERT_TEMP_MAX_RATE", "5")), unit="°C"),
+    TemperatureTrendRule("inverter_temp", min_temperature=float(os.environ.get("ALERT_TEMP_TREND_MIN", "60"))),
+    ExcursionRule("grid_voltage", float(os.environ.get("ALERT_GRID_VOLTAGE_MIN", "207")),
+                  float(os.environ.get("ALERT_GRID_VOLTAGE_MAX", "253")), unit="V", title="Grid Voltage Alert"),
+]
+if os.environ.get("SITE_LATITUDE") and os.environ.get("SITE_LONGITUDE") and os.environ.get("PLANT_PEAK_POWER"):
+    anomaly_rules.append(LowProductionRule(
+        float(os.environ["SITE_LATITUDE"]), float(os.environ["SITE_LONGITUDE"]), float(os.environ["PLANT_PEAK_POWER"])))
+anomaly_engine = AnomalyEngine(anomaly_rules)
+
+# --- Derived Metrics Configuration ---
+# Energy deltas, daily peak, weighted temperature and yield figures are added
+# to each stored reading as extra fields. Days follow SITE_TIMEZONE.
+derived_metrics = DerivedMetrics(
+    peak_power=float(os.environ["PLANT_PEAK_POWER"]) if os.environ.get("PLANT_PEAK_POWER") else None,
+    tz=ZoneInfo(SITE_TIMEZONE),
+)
+
+# --- Device Heartbeat Configuration ---
+# A device is flagged offline after DEVICE_TIMEOUT_FACTOR times its learned
+# upload interval without a request, and never before DEVICE_UPLOAD_MAX_AGE
+# (the firmware's upload_max_age) plus DEVICE_EXPECTED_INTERVAL. The ESP32 only
+# uploads while the inverter produces, so no alert is sent when the last reading
+# was at most OFFLINE_IDLE_POWER watts or production was falling, nor at night
+# when the site location is set.
+OFFLINE_IDLE_POWER = float(os.environ.get("OFFLINE_IDLE_POWER", "10"))
+SITE_LATITUDE = os.environ.get("SITE_LATITUDE")
+SITE_LONGITUDE = os.environ.get("SITE_LONGITUDE")
+
+
+def production_ended(record):
+    """
+    True when the last readings of a device show the inverter stopping: the
+    last power was about 0 or every reading was lower than the one before.
+    """
+    power = list(record.power)
+    if not power:
+        return False
+    if power[-1] <= OFFLINE_IDLE_POWER:
+        return True
+    return len(power) > 1 and all(later < earlier for earlier, later in zip(power, power[1:]))
 
-last_power_value = None
-same_value_count = 0
-last_notification_time = 0
 
-def send_gotify_notification(title, message, priority=5):
-    if not GOTIFY_URL or not GOTIFY_TOKEN:
-        print("Gotify URL or token not configured, skipping notification.")
+def device_offline(record):
+    log.info("Device %s went offline, last seen %.0fs ago", record.name, time.time() - record.last_seen)
+    if production_ended(record):
         return
+    if SITE_LATITUDE and SITE_LONGITUDE and \
+            clear_sky_factor(time.time(), float(SITE_LATITUDE), float(SITE_LONGITUDE)) < 0.05:
+        return
+    alerts_raised.inc("offline")
+    notifier.notify(f"{record.name}:offline", "Inverter Offline Alert",
+                    f"[{record.name}] No reading received for {time.time() - record.last_seen:.0f} seconds", 8)
 
-    headers = {"Content-Type": "application/json"}
-    data = {"title": title, "message": message, "priority": priority}
-    
-    try:
-        response = requests.post(
-            f"{GOTIFY_URL}/message?token={GOTIFY_TOKEN}",
-            json=data,
-            headers=headers,
-            timeout=5
-        )
-        if response.status_code == 200:
-            print("Gotify notification sent successfully.")
-        else:
-            print(f"Failed to send Gotify notification: {response.status_code} - {response.text}")
-    except Exception as e:
-        print(f"Error sending Gotify notification: {e}")
 
+def device_online(record):
+    log.info("Device %s is back online", record.name)
 
-@app.route('/api/power', methods=['GET'])
-def get_power():
-    if not client:
-        return jsonify({"status": "error", "message": "InfluxDB client not initialized"}), 500
-    try:
-        query = f'''
-        from(bucket:"{INFLUXDB_BUCKET}")
-        |> range(start: -1h)
-        |> filter(fn: (r) => r._measurement == "inverter_readings" and r._field == "power_in_total")
-        |> last()
-        '''
+
+device_registry = DeviceRegistry(
+    default_interval=float(os.environ.get("DEVICE_EXPECTED_INTERVAL", "60")),
+    timeout_factor=float(os.environ.get("DEVICE_TIMEOUT_FACTOR", "3")),
+    min_timeout=float(os.environ.get("DEVICE_MIN_TIMEOUT", "180")),
+    upload_max_age=float(os.environ.get("DEVICE_UPLOAD_MAX_AGE", "300")),
+    on_offline=device_offline,
+    on_online=device_online,
+)
+device_registry.start()
+
+
+def check_anomalies(device_name, fields, timestamp=None):
+    """
+    Runs the anomaly rules on a stored reading and queues a notification for every alert raised.
+    """
+    for alert in anomaly_engine.process(device_name, fields, timestamp or time.time()):
+        alerts_raised.inc(alert.rule)
+        log.info("Alert raised for %s: %s", device_name, alert.title)
+        notifier.notify(alert.key, alert.title, alert.message, alert.priority)
+
+
+def pop_device_name(reading, token_device=None):
+    """
+    Removes both device keys ("device_name" and "device") from a reading and
+    returns (device_name, reason): the device named by the reading, else the
+    token's, else the default, and why the reading is refused, if it is.
+    """
+    names = (reading.pop("device_name", None), reading.pop("device", None), token_device)
+    device_name = next((name for name in names if name), DEFAULT_DEVICE_NAME)
+    if reading_validator.check_tag("device_name", device_name) is not None:
+        return device_name, "Invalid device name"
+    if token_device is not None and device_name != token_device:
+        return device_name, "Device not allowed for this token"
+    return device_name, None
+
+
+def build_point(data, device_name=DEFAULT_DEVICE_NAME, timestamp=None):
+    """
+    Builds an "inverter_readings" Point from a reading validated against the schema.
+    Returns (point, fields, rejections); point is None when the reading has no
+    storeable numerical fields.
+    """
+    fields, tags, rejections = reading_validator.validate(data)
+    for rejection in rejections:
+        # Unknown keys are client-controlled, so they share one label value
+        field = rejection["field"] if rejection["field"] in READING_SCHEMA else "_unknown"
+        validation_rejects.inc(field)
+    if rejections and log.isEnabledFor(logging.DEBUG):
+        log.debug("Rejected values from %s: %s", device_name, json.dumps(rejections))
+    if not fields:
+        return None, fields, rejections
+
+    point = Point("inverter_readings") \
+        .tag("device_name", device_name)
+    # The device name is decided by the caller (payload, device token or default)
+    tags.pop("device_name", None)
+    for key, value in tags.items():
+        point.tag(key, value)
+    for key, value in fields.items():
+        point.field(key, value)
+    if timestamp is not None:
+        point.time(timestamp)
+    return point, fields, rejections
+
+
+def add_derived_fields(batch, point, device_name, fields, timestamp=None):
+    """
+    Adds the derived metrics of a reading to its point and returns the fields including them.
+    The device state only advances when the batch is committed, after the points are stored.
+    """
+    derived = batch.process(device_name, fields, timestamp.timestamp() if timestamp else time.time())
+    if not derived:
+        return fields
+    for key, value in derived.items():
+        point.field(key, value)
+    return {**fields, **derived}
+
+
+def store_points(points, route=None):
+    """
+    Writes points to InfluxDB, queues them for the background flusher in async mode
+    or appends them to the write-ahead spool in spool mode, in the bucket of the route.
+    Returns the number of points accepted.
+    """
+    return (route or default_route).store(points)
+
+
+def authorize_ingest(reading_count):
+    """
+    Checks the device token and the tenant rate limit of an upload.
+    Returns (route, device_name, error_response); without tenants every upload
+    goes to the default route and device_name is None.
+    """
+    if tenant_index is None:
+        return default_route, None, None
+
+    authorization = request.headers.get("Authorization", "")
+    token = authorization[7:].strip() if authorization[:7].lower() == "bearer " else None
+    credential = tenant_index.authenticate(token)
+    if credential is None:
+        response = jsonify({"status": "error", "message": "Missing or invalid device token"})
+        response.headers["WWW-Authenticate"] = "Bearer"
+        return None, None, (response, 401)
+
+    limiter = credential.tenant.limiter
+    if reading_count > limiter.capacity:
+        # Waiting would never help: the upload has to be split
+        return None, None, (jsonify({
+            "status": "error",
+            "message": f"Too many readings in one request for this tenant (max {int(limiter.capacity)})"}), 413)
+    wait = limiter.take(reading_count)
+    if wait:
+        rate_limited.inc(credential.tenant.name)
+        response = jsonify({"status": "error", "message": "Rate limit exceeded, retry later"})
+        if wait != float("inf"):
+            response.headers["Retry-After"] = str(math.ceil(wait))
+        return None, None, (response, 429)
+    return tenant_route(credential.tenant), credential.device_name, None
+
+
+def bucket_for_device(device_name):
+    """
+    Bucket holding a device's readings: its tenant's bucket, or the default one.
+    """
+    if tenant_index is not None:
+        credential = tenant_index.device(device_name)
+        if credential is not None:
+            return credential.tenant.bucket
+    return INFLUXDB_BUCKET
+
+
+def flux_string(value):
+    """
+    Quotes a client-supplied value for use as a Flux string literal.
+    """
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("${", "\\${") + '"'
+
+
+def fetch_latest(fields, device_name=DEFAULT_DEVICE_NAME):
+    """
+    Returns {field: (value, timestamp)} with the latest value of each field.
+    Served from the last-value cache when every field is fresh, otherwise from a
+    single pivoted query over the last hour of data (which then seeds the cache).
+    """
+    snapshot = {}
+    for field in fields:
+        cached = last_values.get(device_name, field)
+        if cached is None:
+            break
+        snapshot[field] = cached
+    else:
+        return snapshot
+
+    field_filter = " or ".join(f'r._field == "{field}"' for field in fields)
+    query = f'''
+    from(bucket:"{bucket_for_device(device_name)}")
+    |> range(start: -1h)
+    |> filter(fn: (r) => r._measurement == "inverter_readings" and r.device_name == {flux_string(device_name)})
+    |> filter(fn: (r) => {field_filter})
+    |> last()
+    |> group(columns: ["device_name"])
+    |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+    |> sort(columns: ["_time"])
+    '''
+    with influx_query_latency.time("latest"):
         tables = query_api.query(query, org=INFLUXDB_ORG)
 
-        if not tables or len(tables) == 0:
-            return jsonify({"status": "error", "message": "No data found"}), 404
-        
-        last_power = None
-        for table in tables:
-            for record in table.records:
-                last_power = record.get_value()
-
-        if last_power is None:
-            return jsonify({"status": "error", "message": "No power data available"}), 404
-        
-        return jsonify({
-            "status": "success",
-            "power_in_total": last_power
-        })
+    snapshot = {}
+    for table in tables:
+        for record in table.records:
+            timestamp = record.get_time().timestamp()
+            for field in fields:
+                value = record.values.get(field)
+                if value is not None:
+                    snapshot[field] = (value, timestamp)
+
+    for field, (value, timestamp) in snapshot.items():
+        last_values.update(device_name, {field: value}, timestamp)
+    return snapshot
+
 
+def latest_response(fields, device_name, not_found_message):
+    """
+    Builds the JSON response shared by /api/latest and the single-value endpoints.
+    The ETag lets pollers skip the body with If-None-Match when nothing changed.
+    """
+    if not client:
+        return jsonify({"status": "error", "message": "InfluxDB client not initialized"}), 500
+    try:
+        snapshot = fetch_latest(fields, device_name)
     except Exception as e:
-        print(f"ERROR fetching power data: {e}")
+        log.error("Error fetching latest data: %s", e)
         return jsonify({"status": "error", "message": "Error fetching data"}), 500
-    
+
+    if not snapshot:
+        return jsonify({"status": "error", "message": not_found_message}), 404
+
+    body = {"status": "success", "device_name": device_name}
+    body.update((field, value) for field, (value, _) in snapshot.items())
+    newest = max(timestamp for _, timestamp in snapshot.values())
+    body["time"] = datetime.fromtimestamp(newest, tz=timezone.utc).isoformat()
+
+    response = jsonify(body)
+    response.set_etag(hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest())
+    return response.make_conditional(request)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_latency(response):
+    # Streamed responses are measured up to the first chunk
+    if request.endpoint is not None and "request_started" in g:
+        request_latency.observe(time.perf_counter() - g.request_started, request.endpoint)
+    return response
+
+
+@app.route('/api/latest', methods=['GET'])
+def get_latest():
+    fields_param = request.args.get("fields")
+    fields = [f.strip() for f in fields_param.split(",") if f.strip()] if fields_param else LATEST_DEFAULT_FIELDS
+    if not fields or not all(FIELD_NAME_PATTERN.match(field) for field in fields):
+        return jsonify({"status": "error", "message": "Invalid fields parameter"}), 400
+
+    device_name = request.args.get("device") or DEFAULT_DEVICE_NAME
+    return latest_response(fields, device_name, "No data available for the requested fields")
+
+
+@app.route('/api/power', methods=['GET'])
+def get_power():
+    device_name = request.args.get("device") or DEFAULT_DEVICE_NAME
+    return latest_response(["power_in_total"], device_name, "No power data available")
+
 
 @app.route('/api/energy/today', methods=['GET'])
 def get_today_energy():
+    device_name = request.args.get("device") or DEFAULT_DEVICE_NAME
+    return latest_response(["cumulated_energy_today"], device_name, "No energy data available")
+    
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_PATTERN = re.compile(r"^(\d+)([smhdw])$")
+RELATIVE_TIME_PATTERN = re.compile(r"^-((?:\d+[smhdw])+)$")
+
+
+def parse_duration(value):
+    """
+    Converts a simple duration such as "90s", "5m" or "1d" into seconds.
+    """
+    match = DURATION_PATTERN.match(value)
+    if not match:
+        raise ValueError(f"invalid duration: {value}")
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_time_param(value, now):
+    """
+    Parses a series start/stop parameter: a relative duration ("-7d", "-1h30m"),
+    an epoch in seconds or an ISO 8601 timestamp.
+    """
+    match = RELATIVE_TIME_PATTERN.match(value)
+    if match:
+        seconds = sum(int(amount) * DURATION_UNITS[unit]
+                      for amount, unit in re.findall(r"(\d+)([smhdw])", match.group(1)))
+        return now - timedelta(seconds=seconds)
+    try:
+        return parse_timestamp(float(value))
+    except ValueError:
+        return parse_timestamp(value)
+
+
+def build_series_query(device_name, fields, aggregate, start, stop, window, now):
+    """
+    Builds the Flux query of a windowed series. Returns (query, window as a Flux duration, rollup tier or None).
+    """
+    bucket = bucket_for_device(device_name)
+
+    # Long windows are served from the coarsest rollup tier that fits, re-aggregated in whole tier steps.
+    # Only the default bucket has rollups.
+    tier = None
+    if DOWNSAMPLING_ENABLED and bucket == INFLUXDB_BUCKET:
+        tier = select_tier(rollup_tiers, window, (now - start).total_seconds())
+    tier_filter = ""
+    if tier is not None:
+        window = math.ceil(window / tier.resolution) * tier.resolution
+        bucket = tier.bucket
+        tier_filter = f'\n    |> filter(fn: (r) => r.agg == "{aggregate}")'
+    window = format_seconds(window)
+
+    field_filter = " or ".join(f'r._field == "{field}"' for field in fields)
+    # Windows follow local time, like the rollup tiers
+    query = f'''
+    import "timezone"
+    option location = timezone.location(name: {flux_string(SITE_TIMEZONE)})
+    from(bucket:"{bucket}")
+    |> range(start: {start.isoformat()}, stop: {stop.isoformat()})
+    |> filter(fn: (r) => r._measurement == "inverter_readings" and r.device_name == {flux_string(device_name)})
+    |> filter(fn: (r) => {field_filter}){tier_filter}
+    |> aggregateWindow(every: {window}, fn: {aggregate}, createEmpty: false)
+    |> keep(columns: ["_time", "_field", "_value"])
+    |> group()
+    |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+    |> sort(columns: ["_time"])
+    |> limit(n: {MAX_SERIES_POINTS})
+    '''
+    return query, window, tier
+
+
+@app.route('/api/series', methods=['GET'])
+def get_series():
     if not client:
         return jsonify({"status": "error", "message": "InfluxDB client not initialized"}), 500
+
+    now = datetime.now(timezone.utc)
     try:
-        query = f'''
-        from(bucket:"{INFLUXDB_BUCKET}")
-        |> range(start: -1h)
-        |> filter(fn: (r) => r._measurement == "inverter_readings" and r._field == "cumulated_energy_today")
-        |> last()
-        '''
-        tables = query_api.query(query, org=INFLUXDB_ORG)
+        start = parse_time_param(request.args.get("start", "-24h"), now)
+        stop = parse_time_param(request.args["stop"], now) if request.args.get("stop") else now
+    except (ValueError, OverflowError, OSError):
+        return jsonify({"status": "error", "message": "Invalid start or stop parameter"}), 400
+    if start >= stop:
+        return jsonify({"status": "error", "message": "start must be before stop"}), 400
+
+    fields = [f.strip() for f in request.args.get("fields", "power_in_total").split(",") if f.strip()]
+    if not fields or not all(FIELD_NAME_PATTERN.match(field) for field in fields):
+        return jsonify({"status": "error", "message": "Invalid fields parameter"}), 400
 
-        if not tables or len(tables) == 0:
-            return jsonify({"status": "error", "message": "No data found"}), 404
-        
-        cumulated_energy_today = None
-        for table in tables:
-            for record in table.records:
-                cumulated_energy_today = record.get_value()
-
-        if cumulated_energy_today is None:
-            return jsonify({"status": "error", "message": "No energy data available"}), 404
-        
-        return jsonify({
-            "status": "success",
-            "cumulated_energy_today": cumulated_energy_today
-        })
+    aggregate = request.args.get("fn", "mean")
+    if aggregate not in SERIES_AGGREGATES:
+        return jsonify({"status": "error", "message": f"fn must be one of {', '.join(SERIES_AGGREGATES)}"}), 400
 
+    output_format = request.args.get("format", "json")
+    if output_format not in ("json", "csv"):
+        return jsonify({"status": "error", "message": "format must be json or csv"}), 400
+
+    # Widen the window when the requested one would return more than MAX_SERIES_POINTS rows
+    span = (stop - start).total_seconds()
+    min_window = max(1, math.ceil(span / MAX_SERIES_POINTS))
+    if min_window > 60:
+        min_window = math.ceil(min_window / 60) * 60
+    try:
+        window = parse_duration(request.args["window"]) if request.args.get("window") else min_window
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid window parameter"}), 400
+    window = max(window, min_window)
+
+    device_name = request.args.get("device") or DEFAULT_DEVICE_NAME
+    query, window, tier = build_series_query(device_name, fields, aggregate, start, stop, window, now)
+
+    try:
+        # Timed up to the first record; the rest is streamed to the client
+        with influx_query_latency.time("series"):
+            records = query_api.query_stream(query, org=INFLUXDB_ORG)
+            # Pull the first record now so query errors still produce a proper error response
+            first = next(records, None)
     except Exception as e:
-        print(f"ERROR fetching power data: {e}")
+        log.error("Error fetching series data: %s", e)
         return jsonify({"status": "error", "message": "Error fetching data"}), 500
-    
+
+    def rows():
+        if first is None:
+            return
+        yield first
+        yield from records
+
+    if output_format == "csv":
+        def generate_csv():
+            yield ",".join(["time"] + fields) + "\n"
+            for record in rows():
+                values = [record.values.get(field) for field in fields]
+                yield ",".join([record.get_time().isoformat()] + ["" if v is None else repr(v) for v in values]) + "\n"
+
+        return Response(stream_with_context(generate_csv()), mimetype="text/csv")
+
+    def generate_json():
+        header = {"status": "success", "device_name": device_name, "fields": fields,
+                  "window": window, "fn": aggregate, "tier": tier.name if tier else "raw"}
+        yield json.dumps(header)[:-1] + ', "points": ['
+        separator = ""
+        for record in rows():
+            point = {"time": record.get_time().isoformat()}
+            for field in fields:
+                point[field] = record.values.get(field)
+            yield separator + json.dumps(point)
+            separator = ","
+        yield "]}"
+
+    return Response(stream_with_context(generate_json()), mimetype="application/json")
+
 
 @app.route('/api/inverter_data', methods=['POST'])
 def receive_reading():
-    global last_power_value, same_value_count, last_notification_time
-
     if not client:
         return jsonify({"status": "error", "message": "Server-side error: InfluxDB client not initialized"}), 500
+    route, token_device, error = authorize_ingest(1)
+    if error is not None:
+        return error
 
-    data = request.get_json()
-    if not data:
+    if request.mimetype in binary_format.MIMETYPES:
+        try:
+            data = binary_format.decode_reading(request.get_data())
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid binary payload: {e}"}), 400
+    else:
+        data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
         return jsonify({"status": "error", "message": "Invalid or empty JSON payload"}), 400
 
-    current_power = data.get('power_in_total')
-    if current_power is not None and isinstance(current_power, (int, float)) and math.isfinite(current_power):
-        if last_power_value is None:
-            # First reading, initialize the last power value
-            last_power_value = current_power
-            same_value_count = 0
-        elif current_power == last_power_value:
-            same_value_count += 1
-            print(f"Received same power value: {current_power} W, count: {same_value_count}")
-
-            if same_value_count >= SAME_VALUE_THRESHOLD:
-                current_time = time.time()
-                if current_time - last_notification_time >= 300:
-                    send_gotify_notification(
-                        title="Inverter Power Alert",
-                        message=f"Power value has not changed for the last {SAME_VALUE_THRESHOLD} readings: {current_power} W",
-                        priority=5
-                    )
-                    last_notification_time = current_time
-        else:
-            # New reading, reset the counter
-            last_power_value = current_power
-            same_value_count = 0
-            print(f"New power value received: {current_power} W, resetting counter.")            
+    device_name, reason = pop_device_name(data, token_device)
+    if reason is not None:
+        return jsonify({"status": "error", "message": reason}), 400
+
+    # A reading buffered on the device carries the time it was taken
+    timestamp = data.pop("timestamp", None)
+    if timestamp is not None:
+        try:
+            timestamp = parse_timestamp(timestamp)
+        except (ValueError, OverflowError, OSError):
+            return jsonify({"status": "error", "message": "Invalid timestamp"}), 400
+    elif DEFERRED_WRITES:
+        timestamp = datetime.now(timezone.utc)
+
     try:
-        point = Point("inverter_readings") \
-            .tag("device_name", "main_inverter")
+        point, fields, rejections = build_point(data, device_name=device_name, timestamp=timestamp)
+        if point is None:
+            return jsonify({"status": "success", "message": "Data received but contained no storeable fields",
+                            "rejected_fields": rejections}), 200
+        derived_batch = derived_metrics.begin()
+        fields = add_derived_fields(derived_batch, point, device_name, fields, timestamp)
 
-        valid_fields = 0
-        for key, value in data.items():
-            if value is None:
+        if store_points(point, route) == 0:
+            return jsonify({"status": "error", "message": "Ingest queue is full, retry later"}), 503
+        derived_batch.commit()
+        seconds = timestamp.timestamp() if timestamp else None
+        last_values.update(device_name, fields, seconds)
+        device_registry.record(device_name, power=[fields["power_in_total"]] if "power_in_total" in fields else ())
+        live_stream.publish(device_name, fields, (timestamp or datetime.now(timezone.utc)).isoformat())
+        check_anomalies(device_name, fields, seconds)
+        log.debug("Reading from %s: %s", device_name, fields)
+        body = {"status": "success", "message": "Data queued" if DEFERRED_WRITES else "Data stored"}
+        if rejections:
+            body["rejected_fields"] = rejections
+        return jsonify(body), 202 if DEFERRED_WRITES else 201
+
+    except Exception as e:
+        log.exception("An unexpected error occurred while processing data: %s", e)
+        return jsonify({"status": "error", "message": "An internal error occurred while processing the data"}), 500
+
+
+def parse_bulk_payload():
+    """
+    Reads the bulk request body as a JSON array, as NDJSON (one reading per line)
+    or as binary readings sent back to back.
+    Lines that are not valid JSON are returned as None so they can be reported.
+    """
+    if request.mimetype in binary_format.MIMETYPES:
+        try:
+            return binary_format.decode_readings(request.get_data())
+        except ValueError:
+            return None
+
+    if request.mimetype in ("application/x-ndjson", "application/jsonlines"):
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)
+        return items
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get("readings")
+    return data if isinstance(data, list) else None
+
+
+@app.route('/api/inverter_data/bulk', methods=['POST'])
+def receive_readings_bulk():
+    if not client:
+        return jsonify({"status": "error", "message": "Server-side error: InfluxDB client not initialized"}), 500
+
+    items = parse_bulk_payload()
+    if not items:
+        return jsonify({"status": "error", "message": "Invalid or empty bulk payload"}), 400
+    if len(items) > MAX_BULK_ITEMS:
+        return jsonify({"status": "error", "message": f"Too many readings in one request (max {MAX_BULK_ITEMS})"}), 413
+    route, token_device, error = authorize_ingest(len(items))
+    if error is not None:
+        return error
+
+    points = []
+    derived_batch = derived_metrics.begin()
+    cache_updates = []
+    point_results = []
+    results = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({"index": index, "status": "rejected", "reason": "Reading is not a JSON object"})
+            continue
+
+        reading = dict(item)
+        device_name, reason = pop_device_name(reading, token_device)
+        if reason is not None:
+            results.append({"index": index, "status": "rejected", "reason": reason})
+            continue
+
+        timestamp = reading.pop("timestamp", None)
+        if timestamp is not None:
+            try:
+                timestamp = parse_timestamp(timestamp)
+            except (ValueError, OverflowError, OSError):
+                results.append({"index": index, "status": "rejected", "reason": "Invalid timestamp"})
                 continue
+        elif DEFERRED_WRITES:
+            timestamp = datetime.now(timezone.utc)
 
-            if isinstance(value, (int, float)):
-                if not math.isfinite(value):
-                    print(f"Skipping non-finite value for key '{key}': {value}")
-                    continue
-                
-                if key in VALIDATION_RANGES:
-                    min_val, max_val = VALIDATION_RANGES[key]
-                    if not (min_val <= value <= max_val):
-                        print(f"Skipping out-of-range value for key '{key}': {value}")
-                        continue
-                    
-                point.field(key, float(value)) 
-                valid_fields += 1
-            
-            elif isinstance(value, str):
-                if value:
-                    point.tag(key, value)
-
-        if valid_fields == 0:
-            print("Warning: Received data but no valid numerical fields to store.")
-            return jsonify({"status": "success", "message": "Data received but contained no storeable fields"}), 200
-
-        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=point)
-        return jsonify({"status": "success", "message": "Data stored"}), 201
+        point, fields, rejections = build_point(reading, device_name=device_name, timestamp=timestamp)
+        if point is None:
+            results.append({"index": index, "status": "rejected", "reason": "No storeable fields",
+                            "rejected_fields": rejections})
+            continue
 
+        fields = add_derived_fields(derived_batch, point, device_name, fields, timestamp)
+        points.append(point)
+        cache_updates.append((device_name, fields, timestamp.timestamp() if timestamp else None))
+        result = {"index": index, "status": "accepted"}
+        if rejections:
+            result["rejected_fields"] = rejections
+        point_results.append(result)
+        results.append(result)
+
+    if not points:
+        return jsonify({"status": "success", "message": "Data received but contained no storeable readings",
+                        "accepted": 0, "rejected": len(results), "results": results}), 200
+
+    try:
+        stored = store_points(points, route)
     except Exception as e:
-        print(f"ERROR: An unexpected error occurred while processing data: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({"status": "error", "message": "An internal error occurred while processing the data"}), 500
+        log.error("Could not write bulk readings to InfluxDB: %s", e)
+        return jsonify({"status": "error", "message": "An internal error occurred while storing the data"}), 500
+
+    derived_batch.commit(stored)
+    # Readings that did not fit in the ingest queue are reported back so the client can resend them
+    for result in point_results[stored:]:
+        result["status"] = "rejected"
+        result["reason"] = "Ingest queue is full"
+    device_counts = {}
+    device_power = {}
+    for device_name, fields, timestamp in cache_updates[:stored]:
+        last_values.update(device_name, fields, timestamp)
+        live_stream.publish(device_name, fields,
+                            datetime.fromtimestamp(timestamp or time.time(), tz=timezone.utc).isoformat())
+        check_anomalies(device_name, fields, timestamp)
+        device_counts[device_name] = device_counts.get(device_name, 0) + 1
+        if "power_in_total" in fields:
+            device_power.setdefault(device_name, []).append(fields["power_in_total"])
+    for device_name, count in device_counts.items():
+        device_registry.record(device_name, count, power=device_power.get(device_name, ()))
+
+    summary = {"accepted": stored, "rejected": len(results) - stored, "results": results}
+    if stored == 0:
+        return jsonify({"status": "error", "message": "Ingest queue is full, retry later", **summary}), 503
+    if DEFERRED_WRITES:
+        return jsonify({"status": "success", "message": "Data queued", **summary}), 202
+    return jsonify({"status": "success", "message": "Data stored", **summary}), 201
+
+
+@app.route('/api/ingest/stats', methods=['GET'])
+def get_ingest_stats():
+    stats = {"status": "success", "mode": INGEST_MODE}
+    stats.update(default_route.stats())
+    if tenant_index is not None:
+        with tenant_routes_lock:
+            stats["tenants"] = {name: route.stats() for name, route in tenant_routes.items()}
+    stats["notifications"] = notifier.stats()
+    return jsonify(stats)
+
+
+def add_count(values, name, value):
+    """
+    Sums a per-route value into the ingest metrics, which are not labelled by tenant.
+    """
+    values[name] = values.get(name, 0) + value
+
+
+def ingest_stats():
+    values = {}
+    for route in all_routes():
+        if route.pipeline is not None:
+            for key, value in route.pipeline.stats().items():
+                add_count(values, f"pipeline_{key}", value)
+        if route.spool is not None:
+            spool_stats = route.spool.stats()
+            for key in ("spool_segments", "spool_disk_bytes", "spool_appended", "spool_replayed",
+                        "spool_dropped_bytes"):
+                add_count(values, key, spool_stats[key])
+            add_count(values, "spool_replay_errors", route.replayer.write_errors)
+    for key, value in notifier.stats().items():
+        if key != "sinks":
+            values[f"notifications_{key}"] = value
+    for key, value in live_stream.stats().items():
+        values[f"stream_{key}"] = value
+    for key, value in last_values.stats().items():
+        values[f"last_value_cache_{key}"] = value
+    for key, value in aggregate_cache.stats().items():
+        values[f"grafana_cache_{key}"] = value
+    device_stats = device_registry.stats()
+    values["devices_online"] = device_stats["online"]
+    values["devices_offline"] = device_stats["offline"]
+    return values
+
+
+# One metric per value, (name, help, type, key in ingest_stats())
+INGEST_METRICS = [
+    ("inverter_api_write_queue_depth", "Points waiting in the write queues", "gauge", "pipeline_queue_depth"),
+    ("inverter_api_write_queue_capacity", "Capacity of the write queues", "gauge", "pipeline_queue_capacity"),
+    ("inverter_api_write_enqueued_total", "Points queued for writing", "counter", "pipeline_enqueued"),
+    ("inverter_api_write_points_total", "Points written to InfluxDB", "counter", "pipeline_written"),
+    ("inverter_api_write_batches_total", "Batches written to InfluxDB", "counter", "pipeline_batches"),
+    ("inverter_api_write_retries_total", "Retried InfluxDB batch writes", "counter", "pipeline_retries"),
+    ("inverter_api_write_errors_total", "Failed InfluxDB batch writes", "counter", "pipeline_write_errors"),
+    ("inverter_api_write_dropped_queue_full_total", "Points refused because the write queue was full", "counter",
+     "pipeline_dropped_queue_full"),
+    ("inverter_api_write_dropped_failed_total", "Points dropped after their write kept failing", "counter",
+     "pipeline_dropped_write_failed"),
+    ("inverter_api_spool_segments", "Segment files in the spools", "gauge", "spool_segments"),
+    ("inverter_api_spool_disk_bytes", "Disk space used by the spools", "gauge", "spool_disk_bytes"),
+    ("inverter_api_spool_appended_total", "Lines appended to the spools", "counter", "spool_appended"),
+    ("inverter_api_spool_replayed_total", "Spooled lines written to InfluxDB", "counter", "spool_replayed"),
+    ("inverter_api_spool_dropped_bytes_total", "Unreplayed spool bytes deleted to stay under the disk limit", "counter",
+     "spool_dropped_bytes"),
+    ("inverter_api_spool_replay_errors_total", "Failed writes while replaying the spools", "counter",
+     "spool_replay_errors"),
+    ("inverter_api_notification_queue_depth", "Notifications waiting to be sent", "gauge",
+     "notifications_queue_depth"),
+    ("inverter_api_notifications_queued_total", "Notifications queued", "counter", "notifications_queued"),
+    ("inverter_api_notifications_deduplicated_total", "Notifications skipped within the alert cooldown", "counter",
+     "notifications_deduplicated"),
+    ("inverter_api_notifications_dropped_total", "Notifications dropped because the queue was full", "counter",
+     "notifications_dropped"),
+    ("inverter_api_notifications_sent_total", "Notifications delivered to a sink", "counter", "notifications_sent"),
+    ("inverter_api_notifications_failed_total", "Notifications a sink failed to deliver", "counter",
+     "notifications_failed"),
+    ("inverter_api_stream_subscribers", "Connected live stream clients", "gauge", "stream_subscribers"),
+    ("inverter_api_stream_published_total", "Readings published to the live stream", "counter", "stream_published"),
+    ("inverter_api_stream_delivered_total", "Events queued for live stream clients", "counter", "stream_delivered"),
+    ("inverter_api_stream_dropped_total", "Live stream clients disconnected for falling behind", "counter",
+     "stream_dropped"),
+    ("inverter_api_last_value_cache_entries", "Entries in the last-value cache", "gauge", "last_value_cache_entries"),
+    ("inverter_api_last_value_cache_hits_total", "Last-value cache hits", "counter", "last_value_cache_hits"),
+    ("inverter_api_last_value_cache_misses_total", "Last-value cache misses", "counter", "last_value_cache_misses"),
+    ("inverter_api_grafana_cache_entries", "Entries in the Grafana aggregate cache", "gauge", "grafana_cache_entries"),
+    ("inverter_api_grafana_cache_hits_total", "Grafana aggregate cache hits", "counter", "grafana_cache_hits"),
+    ("inverter_api_grafana_cache_misses_total", "Grafana aggregate cache misses", "counter", "grafana_cache_misses"),
+    ("inverter_api_devices_online", "Devices currently online", "gauge", "devices_online"),
+    ("inverter_api_devices_offline", "Devices currently offline", "gauge", "devices_offline"),
+]
+registry.callback_group(INGEST_METRICS, ingest_stats)
+
+
+@app.route('/api/stream', methods=['GET'])
+def stream_readings():
+    devices = {d.strip() for d in request.args.get("device", "").split(",") if d.strip()} or None
+    if devices and any(reading_validator.check_tag("device_name", d) is not None for d in devices):
+        return jsonify({"status": "error", "message": "Invalid device parameter"}), 400
+    fields = {f.strip() for f in request.args.get("fields", "").split(",") if f.strip()} or None
+    if fields and not all(FIELD_NAME_PATTERN.match(field) for field in fields):
+        return jsonify({"status": "error", "message": "Invalid fields parameter"}), 400
+
+    subscriber = live_stream.subscribe(devices, frozenset(fields) if fields else None)
+    if subscriber is None:
+        return jsonify({"status": "error", "message": "Too many stream clients, retry later"}), 503
+
+    def generate():
+        try:
+            # Start from the cached latest values, so a new client has something to show at once
+            for device_name in sorted(devices or [DEFAULT_DEVICE_NAME]):
+                snapshot = {}
+                for field in fields or LATEST_DEFAULT_FIELDS:
+                    cached = last_values.get(device_name, field)
+                    if cached is not None:
+                        snapshot[field] = cached
+                if snapshot:
+                    newest = max(timestamp for _, timestamp in snapshot.values())
+                    yield format_event(device_name, {field: value for field, (value, _) in snapshot.items()},
+                                       datetime.fromtimestamp(newest, tz=timezone.utc).isoformat(), "snapshot")
+            while not subscriber.dropped:
+                try:
+                    yield subscriber.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    # Comment line, keeps proxies from closing an idle stream
+                    yield ": keep-alive\n\n"
+            yield "event: dropped\ndata: {\"reason\": \"client too slow\"}\n\n"
+        finally:
+            live_stream.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/api/devices', methods=['GET'])
+def get_devices():
+    devices = device_registry.devices()
+    status = request.args.get("status")
+    if status:
+        if status not in ("online", "offline"):
+            return jsonify({"status": "error", "message": "status must be online or offline"}), 400
+        devices = [device for device in devices if device["status"] == status]
+    return jsonify({"status": "success", **device_registry.stats(), "items": devices})
+
+
+def grafana_window(interval_ms, start, stop):
+    """
+    Snaps the window Grafana asks for up to the next step of GRAFANA_WINDOWS, so
+    nearby zoom levels and panel widths share cached results.
+    """
+    wanted = max(interval_ms / 1000, (stop - start).total_seconds() / MAX_SERIES_POINTS)
+    for window in GRAFANA_WINDOWS:
+        if window >= wanted:
+            return window
+    return math.ceil(wanted / 86400) * 86400
+
+
+def fetch_stat_snapshot(device_name):
+    """
+    Latest value of every stat field: the recent ones from fetch_latest, and the
+    ones not updated in the last hour (at night, after an outage) from a single
+    query over the longest GRAFANA_STAT_LOOKBACK they need.
+    """
+    snapshot = fetch_latest(list(GRAFANA_STAT_TARGETS.values()), device_name)
+    older = {GRAFANA_STAT_TARGETS[target]: lookback for target, lookback in GRAFANA_STAT_LOOKBACK.items()
+             if GRAFANA_STAT_TARGETS[target] not in snapshot}
+    if not older:
+        return snapshot
+
+    start = "0" if None in older.values() else f"-{max(older.values())}s"
+    field_filter = " or ".join(f'r._field == "{field}"' for field in older)
+    query = f'''
+    from(bucket:"{bucket_for_device(device_name)}")
+    |> range(start: {start})
+    |> filter(fn: (r) => r._measurement == "inverter_readings" and r.device_name == {flux_string(device_name)})
+    |> filter(fn: (r) => {field_filter})
+    |> last()
+    |> group(columns: ["device_name"])
+    |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+    |> sort(columns: ["_time"])
+    '''
+    with influx_query_latency.time("grafana_stats"):
+        tables = query_api.query(query, org=INFLUXDB_ORG)
+
+    now = time.time()
+    for table in tables:
+        for record in table.records:
+            timestamp = record.get_time().timestamp()
+            for field, lookback in older.items():
+                value = record.values.get(field)
+                if value is not None and (lookback is None or now - timestamp <= lookback):
+                    snapshot[field] = (value, timestamp)
+    return snapshot
+
+
+def grafana_stats(device_name, now):
+    """
+    Returns {target: [[value, time in ms]]} for every stat target, from one snapshot of the latest values.
+    """
+    snapshot = aggregate_cache.get(("latest", device_name), lambda: fetch_stat_snapshot(device_name))
+    today = now.astimezone(derived_metrics.tz).date()
+    datapoints = {}
+    for target, field in GRAFANA_STAT_TARGETS.items():
+        value, timestamp = snapshot.get(field, (None, None))
+        if value is None:
+            datapoints[target] = []
+            continue
+        taken = datetime.fromtimestamp(timestamp, tz=derived_metrics.tz)
+        if target.endswith("_now") and now.timestamp() - timestamp > GRAFANA_CURRENT_MAX_AGE:
+            datapoints[target] = []
+            continue
+        if target.endswith("_today") and taken.date() != today:
+            # Nothing uploaded yet today: the counters have reset on the inverter
+            value, taken = 0, now
+        datapoints[target] = [[value, int(taken.timestamp() * 1000)]]
+    return datapoints
+
+
+def grafana_series(target, device_name, start, stop, interval_ms, now):
+    field, aggregate = GRAFANA_SERIES_TARGETS[target]
+    window = grafana_window(interval_ms, start, stop)
+    # Whole windows only, so every viewer of the same relative range lands on the same entry
+    start_ts = math.floor(start.timestamp() / window) * window
+    stop_ts = math.ceil(stop.timestamp() / window) * window
+    closed = stop_ts < now.timestamp() - window
+
+    def compute():
+        query, _, _ = build_series_query(
+            device_name, [field], aggregate, datetime.fromtimestamp(start_ts, tz=timezone.utc),
+            datetime.fromtimestamp(stop_ts, tz=timezone.utc), window, now)
+        with influx_query_latency.time("grafana_series"):
+            tables = query_api.query(query, org=INFLUXDB_ORG)
+        return [[record.values.get(field), int(record.get_time().timestamp() * 1000)]
+                for table in tables for record in table.records if record.values.get(field) is not None]
+
+    return aggregate_cache.get(("series", target, device_name, start_ts, stop_ts, window), compute,
+                               ttl=GRAFANA_CLOSED_RANGE_TTL if closed else None)
+
+
+def load_daily_totals(device_name, first, last):
+    """
+    Returns {date: energy} for the local days first..last, the daily maximum of
+    cumulated_energy_today; days without data count as 0.
+    """
+    tz = derived_metrics.tz
+    start = datetime.combine(first, datetime.min.time(), tzinfo=tz)
+    stop = datetime.combine(last + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+    query = f'''
+    import "timezone"
+    option location = timezone.location(name: {flux_string(tz.key)})
+    from(bucket:"{bucket_for_device(device_name)}")
+    |> range(start: {start.isoformat()}, stop: {stop.isoformat()})
+    |> filter(fn: (r) => r._measurement == "inverter_readings" and r.device_name == {flux_string(device_name)})
+    |> filter(fn: (r) => r._field == "cumulated_energy_today")
+    |> aggregateWindow(every: 1d, fn: max, timeSrc: "_start", createEmpty: false)
+    '''
+    with influx_query_latency.time("grafana_daily"):
+        tables = query_api.query(query, org=INFLUXDB_ORG)
+
+    totals = {first + timedelta(days=n): 0 for n in range((last - first).days + 1)}
+    for table in tables:
+        for record in table.records:
+            day = record.get_time().astimezone(tz).date()
+            if day in totals:
+                totals[day] = record.get_value()
+    return totals
+
+
+def grafana_daily_yield(device_name, start, stop, now):
+    """
+    Energy produced on each local day of the range. Settled days come from
+    DailyTotals and are queried only once; recent days go through the cache and
+    today comes from the latest reading.
+    """
+    tz = derived_metrics.tz
+    today = now.astimezone(tz).date()
+    # stop is exclusive: a range ending at midnight does not include the day that starts then
+    last = min((stop - timedelta(microseconds=1)).astimezone(tz).date(), today)
+    first = max(start.astimezone(tz).date(), last - timedelta(days=daily_totals.max_days - 1))
+    days = [first + timedelta(days=n) for n in range((last - first).days + 1)]
+
+    settled = (now - GRAFANA_LATE_READINGS).astimezone(tz).date()
+    wanted = daily_totals.missing(device_name, [day for day in days if day < settled])
+    wanted += [day for day in days if settled <= day < today]
+    totals = {}
+    if wanted:
+        totals = aggregate_cache.get(("daily", device_name, wanted[0], wanted[-1]),
+                                     lambda: load_daily_totals(device_name, wanted[0], wanted[-1]))
+        daily_totals.update(device_name, {day: value for day, value in totals.items() if day < settled})
+
+    datapoints = []
+    for day in days:
+        if day < today:
+            value = totals.get(day, daily_totals.get(device_name, day)) or 0
+        else:
+            value = grafana_stats(device_name, now)["energy_today"]
+            value = value[0][0] if value else 0
+        midnight = datetime.combine(day, datetime.min.time(), tzinfo=tz)
+        datapoints.append([value, int(midnight.timestamp() * 1000)])
+    return datapoints
+
+
+@app.route('/grafana', methods=['GET'])
+@app.route('/grafana/', methods=['GET'])
+def grafana_test():
+    # Used by Grafana's "Save & test" on the datasource
+    return jsonify({"status": "success", "message": "Inverter API datasource"})
+
+
+@app.route('/grafana/search', methods=['POST'])
+@app.route('/grafana/metrics', methods=['POST'])
+def grafana_search():
+    targets = list(GRAFANA_STAT_TARGETS) + list(GRAFANA_SERIES_TARGETS) + ["daily_yield"]
+    if request.path.endswith("/metrics"):
+        return jsonify([{"label": target, "value": target} for target in targets])
+    return jsonify(targets)
+
+
+@app.route('/grafana/query', methods=['POST'])
+def grafana_query():
+    if not client:
+        return jsonify({"status": "error", "message": "InfluxDB client not initialized"}), 500
+
+    body = request.get_json(silent=True)
+    now = datetime.now(timezone.utc)
+    try:
+        start = parse_timestamp(body["range"]["from"])
+        stop = parse_timestamp(body["range"]["to"])
+        interval_ms = float(body.get("intervalMs") or 60000)
+        targets = [target for target in body.get("targets", []) if target.get("target") and not target.get("hide")]
+    except (KeyError, TypeError, AttributeError, ValueError, OverflowError, OSError):
+        return jsonify({"status": "error", "message": "Invalid query"}), 400
+    if start >= stop:
+        return jsonify({"status": "error", "message": "range.from must be before range.to"}), 400
+
+    results = []
+    try:
+        for target in targets:
+            name = target["target"]
+            payload = target.get("payload") if isinstance(target.get("payload"), dict) else {}
+            device_name = payload.get("device") or DEFAULT_DEVICE_NAME
+            if reading_validator.check_tag("device_name", device_name) is not None:
+                return jsonify({"status": "error", "message": "Invalid device in target payload"}), 400
+            if name in GRAFANA_STAT_TARGETS:
+                datapoints = grafana_stats(device_name, now)[name]
+            elif name in GRAFANA_SERIES_TARGETS:
+                datapoints = grafana_series(name, device_name, start, stop, interval_ms, now)
+            elif name == "daily_yield":
+                datapoints = grafana_daily_yield(device_name, start, stop, now)
+            else:
+                return jsonify({"status": "error", "message": f"Unknown target: {name}"}), 400
+            results.append({"target": name, "refId": target.get("refId"), "datapoints": datapoints})
+    except Exception as e:
+        log.error("Error fetching Grafana data: %s", e)
+        return jsonify({"status": "error", "message": "Error fetching data"}), 500
+    return jsonify(results)
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+def shutdown():
+    """
+    Flushes pending writes and notifications and closes the InfluxDB client.
+    Called on interpreter exit and by the gunicorn worker_exit hook.
+    """
+    for route in all_routes():
+        route.stop()
+    device_registry.stop()
+    notifier.stop()
+    if client:
+        client.close()
+
+
+atexit.register(shutdown)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
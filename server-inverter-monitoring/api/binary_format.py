@@ -0,0 +1,119 @@
+import struct
+
+# Compact binary reading sent by the ESP32 (see esphome-aurora-inverter/AuroraPayload.h).
+#
+#   header: magic "AU", schema version (uint8), entry count (uint8)
+#   entry:  field id (uint8) followed by the value, little-endian
+#
+# Energy counters are uint32 Wh so large totals keep full precision; every
+# other field is a float32, decoded as is (231.1999969 for 231.2: the float the
+# ESP32 measured). Ten fields take 54 bytes instead of ~300 as JSON.
+# Readings buffered by the ESP32 carry their epoch "timestamp" and are sent to
+# the bulk endpoint back to back, one frame after the other.
+MIMETYPES = ("application/vnd.aurora.reading", "application/octet-stream")
+MAGIC = b"AU"
+VERSION = 1
+
+HEADER = struct.Struct("<2sBB")
+FLOAT32 = struct.Struct("<f")
+UINT32 = struct.Struct("<I")
+
+FIELD_IDS = {
+    1: ("power_in_total", FLOAT32),
+    2: ("power_peak_today", FLOAT32),
+    3: ("power_peak_max", FLOAT32),
+    4: ("inverter_temp", FLOAT32),
+    5: ("cumulated_energy_today", UINT32),
+    6: ("cumulated_energy_week", UINT32),
+    7: ("cumulated_energy_month", UINT32),
+    8: ("cumulated_energy_year", UINT32),
+    9: ("cumulated_energy_total", UINT32),
+    10: ("grid_voltage", FLOAT32),
+    11: ("timestamp", UINT32),
+}
+
+
+def _layout(field_ids):
+    ids = tuple(field_ids)
+    frame = struct.Struct(HEADER.format + "".join("B" + FIELD_IDS[i][1].format[1:] for i in ids))
+    return frame, ids, tuple(FIELD_IDS[i][0] for i in ids)
+
+
+# Layouts the firmware sends when no value is missing, by entry count: every field in
+# id order, then the timestamp when buffered. They decode with a single unpack.
+FIXED_LAYOUTS = {len(layout[1]): layout for layout in (_layout(range(1, 11)), _layout(range(1, 12)))}
+
+
+def decode_reading(payload):
+    """
+    Decodes a binary reading into the same dict a JSON payload would produce.
+    Raises ValueError when the payload is malformed or uses an unknown version or field id.
+    """
+    data, offset = decode_frame(payload, 0)
+    if offset != len(payload):
+        raise ValueError("trailing bytes after the last entry")
+    return data
+
+
+def decode_readings(payload):
+    """
+    Decodes a sequence of binary readings sent back to back, as posted to the bulk endpoint.
+    Raises ValueError when any of them is malformed.
+    """
+    readings = []
+    offset = 0
+    while offset < len(payload):
+        data, offset = decode_frame(payload, offset)
+        readings.append(data)
+    return readings
+
+
+def decode_frame(payload, offset):
+    """
+    Decodes the reading starting at `offset`. Returns the reading and the offset just past it.
+    """
+    if len(payload) - offset < HEADER.size:
+        raise ValueError("payload shorter than the header")
+    magic, version, count = HEADER.unpack_from(payload, offset)
+    if magic != MAGIC:
+        raise ValueError("bad magic")
+    if version != VERSION:
+        raise ValueError(f"unsupported schema version {version}")
+
+    layout = FIXED_LAYOUTS.get(count)
+    if layout is not None and len(payload) - offset >= layout[0].size:
+        frame, ids, names = layout
+        values = frame.unpack_from(payload, offset)
+        if values[3::2] == ids:
+            return dict(zip(names, values[4::2])), offset + frame.size
+
+    data = {}
+    offset += HEADER.size
+    for _ in range(count):
+        if offset >= len(payload):
+            raise ValueError("truncated payload")
+        field = FIELD_IDS.get(payload[offset])
+        if field is None:
+            raise ValueError(f"unknown field id {payload[offset]}")
+        name, value_struct = field
+        offset += 1
+        if offset + value_struct.size > len(payload):
+            raise ValueError("truncated payload")
+        data[name] = value_struct.unpack_from(payload, offset)[0]
+        offset += value_struct.size
+    return data, offset
+
+
+def encode_reading(data):
+    """
+    Encodes a reading dict; the inverse of decode_reading, used by tools and tests of the format.
+    """
+    ids = {name: (field_id, value_struct) for field_id, (name, value_struct) in FIELD_IDS.items()}
+    entries = []
+    for name, value in data.items():
+        if name not in ids or value is None:
+            continue
+        field_id, value_struct = ids[name]
+        value = int(round(value)) if value_struct is UINT32 else float(value)
+        entries.append(bytes([field_id]) + value_struct.pack(value))
+    return HEADER.pack(MAGIC, VERSION, len(entries)) + b"".join(entries)
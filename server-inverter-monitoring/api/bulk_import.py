@@ -0,0 +1,477 @@
+"""
+Bulk import of historical readings into InfluxDB.
+
+Streams CSV or line-protocol files (optionally gzip-compressed) through the
+same schema checks as /api/inverter_data and writes them in parallel batches.
+Memory use does not depend on the input size: the file is read line by line
+and only a bounded number of batches is in flight.
+
+Every reading must carry its own timestamp, so running an import twice
+writes the same points again and InfluxDB simply overwrites them. With
+--checkpoint the position up to which everything has been written is
+saved, and an interrupted import resumes from there.
+
+CSV files need a header row with a "timestamp" (or "time") column holding an
+epoch in seconds or an ISO 8601 time; the other columns are reading keys,
+optionally including device_name. Line protocol must use the
+inverter_readings measurement.
+
+    python bulk_import.py archive.csv.gz --device main_inverter
+    python bulk_import.py export.lp --precision s --checkpoint export.ckpt
+    python bulk_import.py logger.csv --dry-run --rejects rejects.ndjson
+"""
+import argparse
+import concurrent.futures
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+from schema import READING_SCHEMA, ReadingValidator, parse_timestamp
+
+MEASUREMENT = "inverter_readings"
+DEFAULT_DEVICE_NAME = "main_inverter"
+TIMESTAMP_COLUMNS = ("timestamp", "time", "_time")
+PRECISION_NS = {"s": 10 ** 9, "ms": 10 ** 6, "us": 10 ** 3, "ns": 1}
+
+
+class InputFile:
+    """
+    Binary line reader over a plain or gzip file. It tracks the position of the
+    next line as (offset in the uncompressed stream, line number), and the
+    position in the file on disk for progress reporting.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self._raw = open(path, "rb")
+        self._stream = gzip.GzipFile(fileobj=self._raw) if path.endswith(".gz") else self._raw
+        self.offset = 0
+        self.line_number = 0
+
+    @property
+    def position(self):
+        return self.offset, self.line_number
+
+    def disk_position(self):
+        return self._raw.tell()
+
+    def readline(self):
+        line = self._stream.readline()
+        if line:
+            self.offset += len(line)
+            self.line_number += 1
+        return line
+
+    def skip_to(self, position):
+        offset, self.line_number = position
+        if self._stream is self._raw:
+            self._raw.seek(offset)
+        else:
+            while self.offset < offset:
+                chunk = self._stream.read(min(1024 * 1024, offset - self.offset))
+                if not chunk:
+                    break
+                self.offset += len(chunk)
+        self.offset = offset
+
+    def close(self):
+        self._stream.close()
+        self._raw.close()
+
+
+def parse_number(text):
+    text = text.strip()
+    if not text:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def split_unescaped(text, separator, keep_quotes=False):
+    """
+    Splits line protocol on a separator that is neither backslash-escaped nor inside a quoted string.
+    """
+    parts = []
+    current = []
+    escaped = quoted = False
+    for char in text:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"' and keep_quotes:
+            current.append(char)
+            quoted = not quoted
+        elif char == separator and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def unescape(text):
+    out = []
+    escaped = False
+    for char in text:
+        if escaped or char != "\\":
+            out.append(char)
+            escaped = False
+        else:
+            escaped = True
+    return "".join(out)
+
+
+def parse_field_value(text):
+    if text.startswith('"') and text.endswith('"') and len(text) >= 2:
+        return text[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if text in ("t", "T", "true", "True", "TRUE"):
+        return True
+    if text in ("f", "F", "false", "False", "FALSE"):
+        return False
+    if text[-1:] in ("i", "u"):
+        return int(text[:-1])
+    return float(text)
+
+
+def parse_line_protocol(line, precision_ns):
+    """
+    Parses one line of line protocol into (measurement, data, timestamp in ns).
+    Raises ValueError on malformed lines.
+    """
+    parts = [part for part in split_unescaped(line, " ", keep_quotes=True) if part]
+    if len(parts) not in (2, 3):
+        raise ValueError("expected measurement, fields and timestamp")
+    key = split_unescaped(parts[0], ",")
+    measurement = unescape(key[0])
+    data = {}
+    for tag in key[1:]:
+        name, separator, value = tag.partition("=")
+        if not separator:
+            raise ValueError(f"malformed tag '{tag}'")
+        data[unescape(name)] = unescape(value)
+    for field in split_unescaped(parts[1], ",", keep_quotes=True):
+        name, separator, value = field.partition("=")
+        if not separator or not value:
+            raise ValueError(f"malformed field '{field}'")
+        data[unescape(name)] = parse_field_value(value)
+    timestamp = int(parts[2]) * precision_ns if len(parts) == 3 else None
+    return measurement, data, timestamp
+
+
+class Importer:
+    """
+    Turns readings into validated line protocol and writes them in batches from
+    a thread pool. At most `workers * 2` batches are queued or in flight.
+    """
+
+    def __init__(self, write_fn, validator, batch_size=5000, workers=4, max_retries=5,
+                 checkpoint=None, rejects=None, dry_run=False):
+        self.write_fn = write_fn
+        self.validator = validator
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.checkpoint = checkpoint
+        self.rejects = rejects
+        self.dry_run = dry_run
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self._in_flight = {}
+        # Batches are numbered in file order; the checkpoint only moves past a
+        # batch once it and every batch before it have been written
+        self._next_batch_id = 0
+        self._completed = {}
+        self._committed_id = -1
+        self.committed_position = None
+
+        self._batch = []
+        self.readings = 0
+        self.written = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def add(self, line_number, data, timestamp_ns, end_position):
+        """
+        Validates one reading and queues its line protocol.
+        end_position is the input position just after the reading.
+        """
+        self.readings += 1
+        reason = self.validator.check_tag("device_name", data.get("device_name"))
+        if reason is not None:
+            self.reject(line_number, [{"field": "device_name", "reason": reason}])
+            return
+        fields, tags, rejections = self.validator.validate(data)
+        if timestamp_ns is None:
+            rejections.append({"field": "timestamp", "reason": "missing timestamp"})
+            fields = None
+        if rejections:
+            self.reject(line_number, rejections, stored=bool(fields))
+        if not fields:
+            return
+
+        point = Point(MEASUREMENT)
+        for key, value in tags.items():
+            point.tag(key, value)
+        for key, value in fields.items():
+            point.field(key, value)
+        point.time(timestamp_ns, WritePrecision.NS)
+        self._batch.append(point.to_line_protocol())
+        if len(self._batch) >= self.batch_size:
+            self.flush(end_position)
+
+    def reject_line(self, line_number, reason):
+        """
+        Records an input line that could not be parsed into a reading.
+        """
+        self.readings += 1
+        self.reject(line_number, [{"field": None, "reason": reason}])
+
+    def reject(self, line_number, rejections, stored=False):
+        if not stored:
+            self.rejected += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({"line": line_number, "stored": stored, "rejections": rejections}) + "\n")
+
+    def flush(self, end_position):
+        """
+        Submits the current batch, waiting first if too many batches are in flight.
+        """
+        batch, self._batch = self._batch, []
+        batch_id = self._next_batch_id
+        self._next_batch_id += 1
+        while len(self._in_flight) >= self.workers * 2:
+            done, _ = concurrent.futures.wait(self._in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                self._finish(future)
+        future = self._executor.submit(self._write, batch)
+        self._in_flight[future] = (batch_id, end_position, len(batch))
+
+    def close(self, end_position):
+        """
+        Writes the last partial batch and waits for every batch to finish.
+        """
+        self.flush(end_position)
+        for future in concurrent.futures.as_completed(list(self._in_flight)):
+            self._finish(future)
+        self._executor.shutdown()
+
+    def _write(self, batch):
+        if self.dry_run or not batch:
+            return True
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_fn(batch)
+                return True
+            except Exception as e:
+                print(f"Batch write failed (attempt {attempt + 1}/{self.max_retries + 1}): {e}", file=sys.stderr)
+                if attempt < self.max_retries:
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+        return False
+
+    def _finish(self, future):
+        batch_id, end_position, size = self._in_flight.pop(future)
+        if not future.result():
+            self.failed += size
+            # A lost batch pins the checkpoint, so a rerun retries it
+            return
+        self.written += size
+        self._completed[batch_id] = end_position
+        while self._committed_id + 1 in self._completed:
+            self._committed_id += 1
+            self.committed_position = self._completed.pop(self._committed_id)
+        if self.checkpoint is not None and self.committed_position is not None:
+            self.checkpoint.save(self.committed_position)
+
+
+class Checkpoint:
+    """
+    Position up to which an input file has been fully written, stored as JSON next to the import.
+    """
+
+    def __init__(self, path, input_path, input_size):
+        self.path = path
+        self.input_path = os.path.abspath(input_path)
+        self.input_size = input_size
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("input") != self.input_path or state.get("size") != self.input_size:
+            return None
+        return state["offset"], state["line"]
+
+    def save(self, position):
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump({"input": self.input_path, "size": self.input_size,
+                       "offset": position[0], "line": position[1]}, f)
+        os.replace(temporary, self.path)
+
+
+class Progress:
+    def __init__(self, input_file, interval=5.0, stream=sys.stderr):
+        self.input_file = input_file
+        self.interval = interval
+        self.stream = stream
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def maybe_report(self, importer, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < self.interval:
+            return
+        self._last_report = now
+        elapsed = max(now - self.started, 1e-9)
+        percent = 100.0 * self.input_file.disk_position() / self.input_file.size if self.input_file.size else 100.0
+        print(f"{percent:5.1f}%  {importer.readings} readings ({importer.readings / elapsed:.0f}/s), "
+              f"{importer.written} written, {importer.rejected} rejected, {importer.failed} failed",
+              file=self.stream)
+
+
+def csv_readings(input_file, default_device, start_position):
+    """
+    Yields (line number, data, timestamp in ns, error, end position) for every CSV row.
+    Rows that cannot be parsed come with data None and the reason as error.
+    """
+    header_line = input_file.readline().decode("utf-8-sig")
+    header = [column.strip() for column in next(csv.reader([header_line]))]
+    timestamp_column = next((column for column in header if column in TIMESTAMP_COLUMNS), None)
+    if timestamp_column is None:
+        raise ValueError(f"CSV header has no timestamp column ({', '.join(TIMESTAMP_COLUMNS)})")
+    if start_position is not None:
+        input_file.skip_to(start_position)
+
+    while True:
+        line = input_file.readline()
+        if not line:
+            return
+        line_number = input_file.line_number
+        text = line.decode("utf-8").strip()
+        if not text:
+            continue
+        values = next(csv.reader([text]))
+        if len(values) != len(header):
+            yield line_number, None, None, "wrong number of columns", input_file.position
+            continue
+        row = dict(zip(header, values))
+        try:
+            timestamp = parse_timestamp(parse_number(row.pop(timestamp_column)))
+        except (ValueError, TypeError, OverflowError, OSError):
+            yield line_number, None, None, "invalid timestamp", input_file.position
+            continue
+        data = {key: parse_number(value) for key, value in row.items()}
+        data["device_name"] = data.get("device_name") or default_device
+        yield line_number, data, int(timestamp.timestamp() * 10 ** 6) * 1000, None, input_file.position
+
+
+def line_protocol_readings(input_file, default_device, precision_ns, start_position):
+    if start_position is not None:
+        input_file.skip_to(start_position)
+    while True:
+        line = input_file.readline()
+        if not line:
+            return
+        line_number = input_file.line_number
+        text = line.decode("utf-8").strip()
+        if not text or text.startswith("#"):
+            continue
+        try:
+            measurement, data, timestamp = parse_line_protocol(text, precision_ns)
+        except ValueError as e:
+            yield line_number, None, None, f"malformed line: {e}", input_file.position
+            continue
+        if measurement != MEASUREMENT:
+            yield line_number, None, None, f"measurement is not {MEASUREMENT}", input_file.position
+            continue
+        data.setdefault("device_name", default_device)
+        yield line_number, data, timestamp, None, input_file.position
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or line-protocol file, optionally .gz")
+    parser.add_argument("--format", choices=["csv", "lp"], help="input format (default: from the file name)")
+    parser.add_argument("--device", default=DEFAULT_DEVICE_NAME, help="device_name for readings without one")
+    parser.add_argument("--precision", choices=sorted(PRECISION_NS), default="ns", help="line-protocol timestamps")
+    parser.add_argument("--batch-size", type=int, default=5000, help="points per InfluxDB write")
+    parser.add_argument("--workers", type=int, default=4, help="parallel write requests")
+    parser.add_argument("--checkpoint", help="file recording the progress, to resume an interrupted import")
+    parser.add_argument("--rejects", help="write rejected readings to this NDJSON file")
+    parser.add_argument("--strict", action="store_true", help="also reject numeric keys the schema does not know")
+    parser.add_argument("--dry-run", action="store_true", help="validate only, write nothing")
+    args = parser.parse_args()
+
+    input_format = args.format
+    if input_format is None:
+        name = args.path[:-3] if args.path.endswith(".gz") else args.path
+        input_format = "csv" if name.endswith(".csv") else "lp"
+
+    client = None
+    write_fn = None
+    if not args.dry_run:
+        bucket = os.environ.get("INFLUXDB_BUCKET")
+        org = os.environ.get("INFLUXDB_ORG")
+        client = InfluxDBClient(url=os.environ.get("INFLUXDB_URL"), token=os.environ.get("INFLUXDB_TOKEN"), org=org,
+                                connection_pool_maxsize=args.workers, timeout=60_000)
+        write_api = client.write_api(write_options=SYNCHRONOUS)
+
+        def write_lines(lines):
+            write_api.write(bucket=bucket, org=org, record=lines, write_precision=WritePrecision.NS)
+        write_fn = write_lines
+
+    input_file = InputFile(args.path)
+    checkpoint = Checkpoint(args.checkpoint, args.path, input_file.size) if args.checkpoint else None
+    start_position = checkpoint.load() if checkpoint else None
+    if start_position is not None:
+        print(f"Resuming {args.path} at line {start_position[1] + 1}", file=sys.stderr)
+    rejects = open(args.rejects, "a") if args.rejects else None
+
+    importer = Importer(write_fn, ReadingValidator(READING_SCHEMA, strict=args.strict),
+                        batch_size=args.batch_size, workers=args.workers, checkpoint=checkpoint,
+                        rejects=rejects, dry_run=args.dry_run)
+    progress = Progress(input_file)
+    try:
+        if input_format == "csv":
+            readings = csv_readings(input_file, args.device, start_position)
+        else:
+            readings = line_protocol_readings(input_file, args.device, PRECISION_NS[args.precision], start_position)
+        for line_number, data, timestamp, error, end_position in readings:
+            if error is not None:
+                importer.reject_line(line_number, error)
+            else:
+                importer.add(line_number, data, timestamp, end_position)
+            progress.maybe_report(importer)
+        importer.close(input_file.position)
+        progress.maybe_report(importer, force=True)
+    finally:
+        input_file.close()
+        if rejects is not None:
+            rejects.close()
+        if client is not None:
+            client.close()
+
+    if importer.failed:
+        print(f"{importer.failed} readings could not be written; rerun to retry them.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+
+class DerivedState:
+    __slots__ = ("last_timestamp", "last_energy", "counter_resets", "day",
+                 "peak_power", "temp_power_sum", "power_sum")
+
+    def __init__(self):
+        self.last_timestamp = None
+        self.last_energy = None
+        self.counter_resets = 0
+        self.day = None
+        self.peak_power = 0.0
+        self.temp_power_sum = 0.0
+        self.power_sum = 0.0
+
+    def copy(self):
+        state = DerivedState.__new__(DerivedState)
+        for slot in DerivedState.__slots__:
+            setattr(state, slot, getattr(self, slot))
+        return state
+
+
+class DerivedBatch:
+    """
+    Derived fields of the readings of one upload. The device states only move
+    forward on commit(), once the points are stored: an upload that fails is
+    retried by the device and must be computed again from the same state.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._count = 0
+        self._pending = []  # (reading index, device name, state after the reading)
+
+    def process(self, device_name, fields, timestamp):
+        """
+        Computes the derived fields of the next reading of the upload.
+        """
+        index = self._count
+        self._count += 1
+        pending = [state for _, name, state in self._pending if name == device_name]
+        state, newest = self.metrics._state_before(device_name, timestamp, pending)
+        if state is None:
+            return {}
+        derived = self.metrics._fold(state, fields, timestamp)
+        if newest:
+            self._pending.append((index, device_name, state))
+        return derived
+
+    def commit(self, count=None):
+        """
+        Keeps the states of the first `count` readings (all by default), the ones that were stored.
+        """
+        self.metrics._commit([(name, state) for index, name, state in self._pending
+                              if count is None or index < count])
+
+
+class DerivedMetrics:
+    """
+    Running per-device aggregates computed from each reading as it is ingested,
+    so dashboards read them instead of scanning the raw history:
+
+      energy_delta           Wh produced since the previous reading, from
+                             cumulated_energy_total; a counter that goes backwards
+                             counts as a reset and contributes no energy
+      energy_counter_resets  resets detected since this process started
+      daily_peak_power       highest power_in_total of the local day
+      daily_weighted_temp    inverter_temp averaged with power_in_total as weight
+      specific_yield_today   cumulated_energy_today per kW of plant peak power (kWh/kWp)
+      capacity_factor_today  cumulated_energy_today over peak power times the hours since midnight
+
+    The last two need the plant peak power. The state after each of the last
+    `history` readings of a device is kept, so a reading sent again (an upload
+    whose response was lost) or arriving late is computed from the reading
+    before it; it does not change the running state. Readings older than the
+    kept history get no derived fields.
+    """
+
+    def __init__(self, peak_power=None, tz=timezone.utc, history=256):
+        self.peak_power = peak_power
+        self.tz = tz
+        self.history = history
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def begin(self):
+        return DerivedBatch(self)
+
+    def process(self, device_name, fields, timestamp):
+        """
+        Folds a reading into the device state and returns its derived fields.
+        """
+        batch = self.begin()
+        derived = batch.process(device_name, fields, timestamp)
+        batch.commit()
+        return derived
+
+    def _state_before(self, device_name, timestamp, pending):
+        """
+        Returns (copy of the state right before timestamp, whether it is the newest state
+        of the device), or (None, False) when the reading is older than the kept history.
+        """
+        with self._lock:
+            committed = self._devices.get(device_name, ())
+            complete = len(committed) < self.history
+            states = list(committed)
+        states += pending
+        if not states:
+            return DerivedState(), True
+        for position in range(len(states) - 1, -1, -1):
+            if states[position].last_timestamp < timestamp:
+                return states[position].copy(), position == len(states) - 1
+        # Before the first reading seen for the device, unless older readings fell out of the history
+        return (DerivedState(), False) if complete else (None, False)
+
+    def _commit(self, updates):
+        with self._lock:
+            for device_name, state in updates:
+                states = self._devices.get(device_name)
+                if states is None:
+                    states = self._devices[device_name] = deque(maxlen=self.history)
+                # A concurrent upload of the same device may have committed newer readings
+                if not states or state.last_timestamp > states[-1].last_timestamp:
+                    states.append(state)
+
+    def _fold(self, state, fields, timestamp):
+        moment = datetime.fromtimestamp(timestamp, tz=self.tz)
+        derived = {}
+        state.last_timestamp = timestamp
+
+        day = moment.date()
+        if day != state.day:
+            state.day = day
+            state.peak_power = 0.0
+            state.temp_power_sum = 0.0
+            state.power_sum = 0.0
+
+        energy = fields.get("cumulated_energy_total")
+        if energy is not None:
+            if state.last_energy is not None:
+                if energy < state.last_energy:
+                    state.counter_resets += 1
+                    derived["energy_delta"] = 0.0
+                else:
+                    derived["energy_delta"] = energy - state.last_energy
+            state.last_energy = energy
+            derived["energy_counter_resets"] = float(state.counter_resets)
+
+        power = fields.get("power_in_total")
+        if power is not None:
+            state.peak_power = max(state.peak_power, power)
+            derived["daily_peak_power"] = state.peak_power
+            temperature = fields.get("inverter_temp")
+            if temperature is not None and power > 0:
+                state.temp_power_sum += temperature * power
+                state.power_sum += power
+            if state.power_sum > 0:
+                derived["daily_weighted_temp"] = round(state.temp_power_sum / state.power_sum, 2)
+
+        energy_today = fields.get("cumulated_energy_today")
+        if energy_today is not None and self.peak_power:
+            derived["specific_yield_today"] = round(energy_today / self.peak_power, 4)
+            midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            hours = (moment - midnight).total_seconds() / 3600
+            if hours > 0:
+                derived["capacity_factor_today"] = round(energy_today / (self.peak_power * hours), 4)
+        return derived
@@ -0,0 +1,171 @@
+import heapq
+import threading
+import time
+from collections import deque
+
+
+class DeviceRecord:
+    __slots__ = ("name", "first_seen", "last_seen", "readings", "interval", "batch_size", "deadline", "online",
+                 "power")
+
+    def __init__(self, name, now, interval):
+        self.name = name
+        self.first_seen = now
+        self.last_seen = now
+        self.readings = 0
+        # Smoothed seconds between two uploads and readings per upload, learned from the arrivals
+        self.interval = interval
+        self.batch_size = 1.0
+        self.deadline = now
+        self.online = True
+        # Power of the last few readings, to tell a device that stopped producing from one that failed
+        self.power = deque(maxlen=3)
+
+    def to_dict(self, now):
+        return {
+            "device_name": self.name,
+            "status": "online" if self.online else "offline",
+            "last_seen": self.last_seen,
+            "seconds_since_last_seen": round(now - self.last_seen, 1),
+            "first_seen": self.first_seen,
+            "readings": self.readings,
+            "expected_interval": round(self.interval, 1),
+            "readings_per_upload": round(self.batch_size, 1),
+            "readings_per_minute": round(60.0 * self.batch_size / self.interval, 2) if self.interval > 0 else None,
+        }
+
+
+class DeviceRegistry:
+    """
+    Every device that sent a reading to this process, with its last-seen time
+    and learned upload interval. A device is flagged offline once it has been
+    silent for timeout_factor times its interval, at least min_timeout seconds
+    and never before upload_max_age plus the default interval: a device that
+    buffers readings may wait that long before its next upload.
+
+    Deadlines live in a min-heap holding one entry per device. Ingest only moves
+    the deadline stored on the record; the monitor re-pushes an entry that
+    turns out to be early, so both sides stay O(log n) per event.
+    """
+
+    def __init__(self, default_interval=60.0, timeout_factor=3.0, min_timeout=120.0, upload_max_age=0.0,
+                 max_interval=3600.0, smoothing=0.2, on_offline=None, on_online=None):
+        self.default_interval = default_interval
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.upload_max_age = upload_max_age
+        self.max_interval = max_interval
+        self.smoothing = smoothing
+        self.on_offline = on_offline
+        self.on_online = on_online
+
+        self._devices = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="device-heartbeat", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _timeout(self, record):
+        return max(self.min_timeout, self.upload_max_age + self.default_interval, record.interval * self.timeout_factor)
+
+    def _push(self, record):
+        heapq.heappush(self._heap, (record.deadline, record.name))
+        if self._heap[0][1] == record.name:
+            # New earliest deadline, the monitor has to wake up sooner
+            self._wakeup.set()
+
+    def record(self, device_name, count=1, now=None, power=()):
+        """
+        Registers an upload of `count` readings from a device arriving now,
+        with the power values of those readings in order.
+        """
+        if now is None:
+            now = time.time()
+        came_back = None
+        with self._lock:
+            record = self._devices.get(device_name)
+            if record is None:
+                record = self._devices[device_name] = DeviceRecord(device_name, now, self.default_interval)
+                record.deadline = now + self._timeout(record)
+                self._push(record)
+            else:
+                # Liveness is about requests: a batch of n readings arrives after one gap, not n
+                gap = min(now - record.last_seen, self.max_interval)
+                record.interval += self.smoothing * (gap - record.interval)
+                record.batch_size += self.smoothing * (count - record.batch_size)
+                record.deadline = now + self._timeout(record)
+                if not record.online:
+                    # Learning from the gap that made it look offline keeps a slower device from flapping
+                    record.online = True
+                    self._push(record)
+                    came_back = record
+            record.last_seen = now
+            record.readings += count
+            record.power.extend(power)
+
+        if came_back is not None and self.on_online is not None:
+            self.on_online(came_back)
+
+    def devices(self, now=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            return [record.to_dict(now) for record in sorted(self._devices.values(), key=lambda r: r.name)]
+
+    def stats(self):
+        with self._lock:
+            online = sum(1 for record in self._devices.values() if record.online)
+            return {"devices": len(self._devices), "online": online, "offline": len(self._devices) - online}
+
+    def expire(self, now=None):
+        """
+        Flags every device whose deadline has passed and returns the records that went offline.
+        """
+        if now is None:
+            now = time.time()
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, device_name = heapq.heappop(self._heap)
+                record = self._devices[device_name]
+                if record.deadline > now:
+                    # The device reported since this entry was pushed
+                    heapq.heappush(self._heap, (record.deadline, device_name))
+                    continue
+                record.online = False
+                expired.append(record)
+
+        if self.on_offline is not None:
+            for record in expired:
+                self.on_offline(record)
+        return expired
+
+    def _next_deadline(self):
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.clear()
+            deadline = self._next_deadline()
+            if deadline is None:
+                self._wakeup.wait()
+                continue
+            delay = deadline - time.time()
+            if delay > 0:
+                self._wakeup.wait(delay)
+                continue
+            self.expire()
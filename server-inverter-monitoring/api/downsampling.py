@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from influxdb_client import BucketRetentionRules, TaskCreateRequest, TaskUpdateRequest
+
+log = logging.getLogger(__name__)
+
+# Every rollup tier stores one series per aggregate, told apart by the "agg" tag
+ROLLUP_AGGREGATES = ("mean", "max", "min", "last")
+MEASUREMENT = "inverter_readings"
+# Written into the description of a tier bucket once its backfill has completed
+BACKFILL_DONE = "backfill complete"
+
+
+class RollupTier:
+    """
+    A downsampled copy of inverter_readings kept in its own bucket.
+    It is filled by an InfluxDB task that aggregates the source bucket (the raw
+    bucket or a finer tier) every `resolution` seconds, and expires after
+    `retention` seconds (None keeps it forever). Windows follow the local time
+    of `location` (an IANA time zone name), so daily points cover local days.
+    Every point is stamped with the start of its window: re-aggregating it
+    with aggregateWindow then stamps it like the raw readings of that window.
+    """
+
+    def __init__(self, name, bucket, resolution, retention, source_bucket, source_is_rollup=False,
+                 location="UTC", backfill_days=7):
+        self.name = name
+        self.bucket = bucket
+        self.resolution = resolution
+        self.retention = retention
+        self.source_bucket = source_bucket
+        self.source_is_rollup = source_is_rollup
+        self.location = location
+        # Days of source data aggregated per backfill query, so none runs into the client timeout
+        self.backfill_days = backfill_days
+        # Where an interrupted backfill resumes
+        self.backfill_position = None
+        self.ready = False
+
+    @property
+    def task_name(self):
+        return f"downsample_{self.bucket}"
+
+    @property
+    def every(self):
+        return format_seconds(self.resolution)
+
+    @property
+    def offset(self):
+        # A tier built from another one runs after it has written its last window
+        return "15m" if self.source_is_rollup else "5m"
+
+    def flux(self, org, start=None, stop=None):
+        """
+        Builds the Flux script that writes every aggregate of the source into this tier.
+        Without a start the script is a task re-aggregating the last two complete local
+        windows, so late readings are picked up and no partial window is written; with a
+        start (and stop) it is a one-off backfill query.
+        """
+        lines = ['import "date"', 'import "timezone"', ""]
+        if start is None:
+            lines.append(f'option task = {{name: "{self.task_name}", every: {self.every}, offset: {self.offset}}}')
+            # date.truncate follows the location option, so the range starts and ends on local window boundaries
+            start = f"date.truncate(t: -{format_seconds(self.resolution * 2)}, unit: {self.every})"
+            stop = f"date.truncate(t: now(), unit: {self.every})"
+        lines.append(f'option location = timezone.location(name: "{self.location}")')
+        lines.append("")
+        lines.append(f'data = from(bucket: "{self.source_bucket}")')
+        lines.append(f"    |> range(start: {start}, stop: {stop})" if stop else f"    |> range(start: {start})")
+        lines.append(f'    |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")')
+        for aggregate in ROLLUP_AGGREGATES:
+            lines.append("")
+            lines.append("data")
+            if self.source_is_rollup:
+                lines.append(f'    |> filter(fn: (r) => r.agg == "{aggregate}")')
+            lines.append(f'    |> aggregateWindow(every: {self.every}, fn: {aggregate}, timeSrc: "_start", createEmpty: false)')
+            lines.append(f'    |> set(key: "agg", value: "{aggregate}")')
+            lines.append(f'    |> to(bucket: "{self.bucket}", org: "{org}")')
+            # Nothing needs to come back to the caller, only the writes matter
+            lines.append("    |> filter(fn: (r) => false)")
+            lines.append(f'    |> yield(name: "{aggregate}")')
+        return "\n".join(lines) + "\n"
+
+
+def format_seconds(seconds):
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+def build_tiers(raw_bucket, hourly_retention, daily_retention, location="UTC"):
+    """
+    Returns the hourly and daily tiers, coarsest last. Retentions are in seconds, 0 means forever.
+    """
+    hourly = RollupTier("1h", f"{raw_bucket}_1h", 3600, hourly_retention or None, raw_bucket, location=location,
+                        backfill_days=7)
+    daily = RollupTier("1d", f"{raw_bucket}_1d", 86400, daily_retention or None, hourly.bucket,
+                       source_is_rollup=True, location=location, backfill_days=366)
+    return [hourly, daily]
+
+
+def select_tier(tiers, window, start_age):
+    """
+    Picks the coarsest ready tier whose resolution fits in the requested window
+    and whose retention still covers the start of the range, or None for raw data.
+    """
+    for tier in sorted(tiers, key=lambda t: t.resolution, reverse=True):
+        if not tier.ready or tier.resolution > window:
+            continue
+        if tier.retention is not None and start_age > tier.retention:
+            continue
+        return tier
+    return None
+
+
+def retention_rules(seconds):
+    if not seconds:
+        return []
+    return [BucketRetentionRules(type="expire", every_seconds=seconds)]
+
+
+def ensure_bucket(client, org, bucket_name, retention):
+    """
+    Creates the bucket or aligns its retention. Returns the bucket.
+    """
+    buckets_api = client.buckets_api()
+    bucket = buckets_api.find_bucket_by_name(bucket_name)
+    if bucket is None:
+        bucket = buckets_api.create_bucket(bucket_name=bucket_name, retention_rules=retention_rules(retention), org=org)
+        log.info("Created bucket '%s'.", bucket_name)
+        return bucket
+
+    current = bucket.retention_rules[0].every_seconds if bucket.retention_rules else 0
+    if current != (retention or 0):
+        bucket.retention_rules = retention_rules(retention)
+        buckets_api.update_bucket(bucket)
+        log.info("Updated retention of bucket '%s' to %s seconds.", bucket_name, retention or "infinite")
+    return bucket
+
+
+def ensure_task(client, org, tier):
+    tasks_api = client.tasks_api()
+    flux = tier.flux(org)
+    existing = [task for task in tasks_api.find_tasks(name=tier.task_name) if task.name == tier.task_name]
+    if not existing:
+        tasks_api.create_task(task_create_request=TaskCreateRequest(
+            org=org, flux=flux, status="active", description=f"Downsamples {tier.source_bucket} into {tier.bucket}"))
+        log.info("Created downsampling task '%s'.", tier.task_name)
+    elif existing[0].flux != flux:
+        tasks_api.update_task_request(existing[0].id, TaskUpdateRequest(flux=flux))
+        log.info("Updated downsampling task '%s'.", tier.task_name)
+
+
+def earliest_time(query_api, org, bucket):
+    """
+    Time of the oldest reading in a bucket, or None when it is empty.
+    """
+    query = f'''
+    from(bucket: "{bucket}")
+    |> range(start: 0)
+    |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")
+    |> first()
+    |> group()
+    |> min(column: "_time")
+    '''
+    for table in query_api.query(query, org=org):
+        for record in table.records:
+            return record.get_time()
+    return None
+
+
+def backfill(query_api, org, tier, now=None):
+    """
+    Aggregates the data already in the source of a tier up to its current window,
+    in queries of backfill_days whole local days. A failed query raises; the
+    next call resumes from the last chunk written.
+    """
+    tz = ZoneInfo(tier.location)
+    now = (now or datetime.now(tz)).astimezone(tz)
+    stop = now.replace(minute=0, second=0, microsecond=0)
+    if tier.resolution >= 86400:
+        stop = stop.replace(hour=0)
+
+    start = tier.backfill_position
+    if start is None:
+        oldest = earliest_time(query_api, org, tier.source_bucket)
+        if oldest is None:
+            return
+        start = oldest.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        if tier.retention:
+            start = max(start, (now - timedelta(seconds=tier.retention)).replace(hour=0, minute=0, second=0,
+                                                                                   microsecond=0))
+    while start < stop:
+        # Adding days keeps local midnight across DST changes, so every chunk holds whole windows
+        end = min(start + timedelta(days=tier.backfill_days), stop)
+        query_api.query(tier.flux(org, start=start.isoformat(), stop=end.isoformat()), org=org)
+        tier.backfill_position = start = end
+
+
+def ensure_downsampling(client, org, raw_bucket, tiers, raw_retention=None):
+    """
+    Creates or updates the rollup buckets, their retention and their tasks.
+    A tier is backfilled from the data already in its source until the backfill
+    has completed once (recorded in the bucket description), and is only read
+    by /api/series after that.
+    """
+    if raw_retention is not None:
+        ensure_bucket(client, org, raw_bucket, raw_retention)
+
+    query_api = client.query_api()
+    for tier in tiers:
+        bucket = ensure_bucket(client, org, tier.bucket, tier.retention)
+        ensure_task(client, org, tier)
+        if BACKFILL_DONE not in (bucket.description or ""):
+            backfill(query_api, org, tier)
+            bucket.description = f"{tier.name} rollup of {tier.source_bucket}, {BACKFILL_DONE}"
+            client.buckets_api().update_bucket(bucket)
+            log.info("Backfilled tier '%s' from '%s'.", tier.name, tier.source_bucket)
+        tier.ready = True
+
+
+def start_downsampling_setup(client, org, raw_bucket, tiers, raw_retention=None, retry_delay=30.0):
+    """
+    Runs ensure_downsampling in the background, retrying until InfluxDB is reachable.
+    """
+    def run():
+        while True:
+            try:
+                ensure_downsampling(client, org, raw_bucket, tiers, raw_retention)
+                return
+            except Exception as e:
+                log.error("Could not set up downsampling, retrying in %.0fs: %s", retry_delay, e)
+                time.sleep(retry_delay)
+
+    thread = threading.Thread(target=run, name="downsampling-setup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,30 @@
+import os
+
+# Production server for the API: gunicorn with gevent workers. Each worker
+# serves many concurrent requests on cooperative greenlets instead of one
+# thread per request, and the InfluxDB and HTTP clients share pooled
+# connections within the worker.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = "gevent"
+# Live stream clients are capped at half of this (see STREAM_MAX_CLIENTS in app.py)
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", "1000"))
+# Always one worker, scaled with greenlets (WORKER_CONNECTIONS): the last-value
+# and Grafana caches, anomaly, derived-metric and device state, the live stream
+# subscribers and the spool all live in the process. Several workers would each
+# see only part of every device's readings (stale latest values, partial anomaly
+# checks, false offline alerts, streams missing readings).
+workers = 1
+timeout = 60
+# Time given to a worker to flush queued writes before it is killed
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+accesslog = None
+
+def on_starting(server):
+    if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+        server.log.warning("The API keeps per-device state in the process and runs a single worker, "
+                           "ignoring WEB_CONCURRENCY.")
+
+
+def worker_exit(server, worker):
+    import app
+    app.shutdown()
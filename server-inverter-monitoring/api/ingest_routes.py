@@ -0,0 +1,46 @@
+class IngestRoute:
+    """
+    Destination of one tenant's readings: its bucket and the writer for the
+    ingest mode. Points go to the write pipeline (async mode), the spool (spool
+    mode) or, without either, straight to write_fn.
+    """
+
+    def __init__(self, name, bucket, write_fn, pipeline=None, spool=None, replayer=None):
+        self.name = name
+        self.bucket = bucket
+        self.write_fn = write_fn
+        self.pipeline = pipeline
+        self.spool = spool
+        self.replayer = replayer
+
+    @property
+    def deferred(self):
+        return self.pipeline is not None or self.spool is not None
+
+    def store(self, points):
+        """
+        Writes, queues or spools points. Returns the number of points accepted.
+        """
+        if not isinstance(points, list):
+            points = [points]
+        if self.spool is not None:
+            return self.spool.append([point.to_line_protocol() for point in points])
+        if self.pipeline is not None:
+            return self.pipeline.submit(points)
+        self.write_fn(points)
+        return len(points)
+
+    def stats(self):
+        stats = {}
+        if self.pipeline is not None:
+            stats.update(self.pipeline.stats())
+        if self.spool is not None:
+            stats.update(self.spool.stats())
+            stats["spool_replay_errors"] = self.replayer.write_errors
+        return stats
+
+    def stop(self):
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.replayer is not None:
+            self.replayer.stop()
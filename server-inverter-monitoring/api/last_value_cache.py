@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+class LastValueCache:
+    """
+    Latest value of every (device, field) pair seen by this process.
+    Entries older than ttl seconds are treated as missing so callers fall back
+    to InfluxDB, e.g. after a restart or when a device stopped reporting.
+    """
+
+    def __init__(self, ttl=3600.0):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def update(self, device_name, fields, timestamp=None):
+        """
+        Stores the fields of a reading; older readings never replace newer ones.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            for field, value in fields.items():
+                key = (device_name, field)
+                current = self._values.get(key)
+                if current is None or current[1] <= timestamp:
+                    self._values[key] = (value, timestamp)
+
+    def get(self, device_name, field):
+        """
+        Returns (value, timestamp) or None if the field is unknown or stale.
+        """
+        entry = self._values.get((device_name, field))
+        if entry is None or time.time() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def stats(self):
+        return {"entries": len(self._values), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,91 @@
+import json
+import queue
+import threading
+
+
+class Subscriber:
+    __slots__ = ("devices", "fields", "queue", "dropped")
+
+    def __init__(self, devices, fields, queue_size):
+        self.devices = devices
+        self.fields = fields
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class LiveBroadcaster:
+    """
+    Fans out accepted readings to Server-Sent Events subscribers of this process.
+    Each subscriber has a small bounded queue: publishing never blocks, and a
+    subscriber whose queue is full has fallen behind, so it is dropped and its
+    stream ends. An event is encoded once per distinct field filter, not once
+    per subscriber.
+    """
+
+    def __init__(self, queue_size=100, max_subscribers=1000):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        # Replaced on every change so publish can iterate without the lock
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, devices=None, fields=None):
+        """
+        Returns a new Subscriber, or None when the subscriber limit is reached.
+        devices and fields are sets, None meaning everything.
+        """
+        subscriber = Subscriber(devices, fields, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers = self._subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+
+    def publish(self, device_name, fields, timestamp):
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        encoded = {}
+        delivered = 0
+        slow = []
+        for subscriber in subscribers:
+            if subscriber.devices is not None and device_name not in subscriber.devices:
+                continue
+            key = subscriber.fields
+            event = encoded.get(key)
+            if event is None:
+                selected = fields if key is None else {k: v for k, v in fields.items() if k in key}
+                event = encoded[key] = format_event(device_name, selected, timestamp) if selected else ""
+            if not event:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+                delivered += 1
+            except queue.Full:
+                slow.append(subscriber)
+
+        with self._lock:
+            self.published += 1
+            self.delivered += delivered
+            self.dropped += len(slow)
+        for subscriber in slow:
+            subscriber.dropped = True
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "published": self.published,
+                    "delivered": self.delivered, "dropped": self.dropped}
+
+
+def format_event(device_name, fields, timestamp, event="reading"):
+    data = {"device_name": device_name, "time": timestamp}
+    data.update(fields)
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
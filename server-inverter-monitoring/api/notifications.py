@@ -0,0 +1,205 @@
+import logging
+import queue
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+
+class Notification:
+    __slots__ = ("key", "title", "message", "priority", "created")
+
+    def __init__(self, key, title, message, priority=5):
+        self.key = key
+        self.title = title
+        self.message = message
+        self.priority = priority
+        self.created = time.time()
+
+
+def pooled_session(pool_size):
+    """
+    Shared keep-alive HTTP session, so repeated deliveries reuse their connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class GotifySink:
+    name = "gotify"
+
+    def __init__(self, url, token, session, timeout=5):
+        self.url = f"{url.rstrip('/')}/message"
+        self.token = token
+        self.session = session
+        self.timeout = timeout
+
+    def send(self, notification):
+        response = self.session.post(
+            self.url,
+            params={"token": self.token},
+            json={"title": notification.title, "message": notification.message, "priority": notification.priority},
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"Gotify answered {response.status_code} - {response.text}")
+
+
+class WebhookSink:
+    name = "webhook"
+
+    def __init__(self, url, session, timeout=5):
+        self.url = url
+        self.session = session
+        self.timeout = timeout
+
+    def send(self, notification):
+        response = self.session.post(
+            self.url,
+            json={"key": notification.key, "title": notification.title, "message": notification.message,
+                  "priority": notification.priority, "created": notification.created},
+            timeout=self.timeout,
+        )
+        if response.status_code >= 300:
+            raise RuntimeError(f"Webhook answered {response.status_code}")
+
+
+class SmtpSink:
+    name = "smtp"
+
+    def __init__(self, host, port, sender, recipients, username=None, password=None, starttls=False, timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = recipients
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, notification):
+        email = EmailMessage()
+        email["Subject"] = notification.title
+        email["From"] = self.sender
+        email["To"] = ", ".join(self.recipients)
+        email.set_content(notification.message)
+
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            smtp.send_message(email)
+
+
+class NotificationDispatcher:
+    """
+    Delivers notifications from a pool of background workers, so the caller never
+    waits on an outbound request. Notifications sharing a key are deduplicated:
+    one still waiting in the queue absorbs the new one, and a key that was
+    delivered less than `cooldown` seconds ago is skipped. Every sink is retried
+    with exponential backoff on its own.
+    """
+
+    def __init__(self, sinks, workers=2, queue_size=1000, cooldown=300, max_retries=3,
+                 retry_base_delay=2.0, retry_max_delay=60.0):
+        self.sinks = sinks
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._last_sent = {}
+        self._stop_event = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"notification-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+
+        self.queued = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self, key, title, message, priority=5):
+        """
+        Queues a notification without blocking. Returns False if it was deduplicated or dropped.
+        """
+        if not self.sinks:
+            return False
+
+        now = time.time()
+        with self._lock:
+            if key in self._pending or now - self._last_sent.get(key, float("-inf")) < self.cooldown:
+                self.deduplicated += 1
+                return False
+            try:
+                self._queue.put_nowait(Notification(key, title, message, priority))
+            except queue.Full:
+                self.dropped += 1
+                return False
+            self._pending.add(key)
+            self.queued += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queued": self.queued,
+                "deduplicated": self.deduplicated,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "failed": self.failed,
+                "sinks": [sink.name for sink in self.sinks],
+            }
+
+    def _deliver(self, sink, notification):
+        delay = self.retry_base_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                sink.send(notification)
+                return True
+            except Exception as e:
+                log.warning("Failed to send %s notification (attempt %d/%d): %s",
+                            sink.name, attempt + 1, self.max_retries + 1, e)
+            if attempt == self.max_retries or self._stop_event.wait(delay):
+                break
+            delay = min(delay * 2, self.retry_max_delay)
+        return False
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                notification = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            delivered = [self._deliver(sink, notification) for sink in self.sinks]
+            with self._lock:
+                self._pending.discard(notification.key)
+                if any(delivered):
+                    self._last_sent[notification.key] = time.time()
+                self.sent += sum(delivered)
+                self.failed += len(delivered) - sum(delivered)
@@ -0,0 +1,134 @@
+import math
+import re
+from datetime import datetime, timezone
+
+# Every key the ESP32 sends (see esphome-aurora-inverter/config.yaml).
+# "field" entries are stored as float fields, "tag" entries as tags. Tags must
+# match an allowed list or pattern so a client cannot create unbounded series.
+READING_SCHEMA = {
+    "power_in_total": {"kind": "field", "unit": "W", "min": 0, "max": 10000},
+    "power_peak_today": {"kind": "field", "unit": "W", "min": 0, "max": 10000},
+    "power_peak_max": {"kind": "field", "unit": "W", "min": 0, "max": 10000},
+    "inverter_temp": {"kind": "field", "unit": "°C", "min": -20, "max": 120},
+    "cumulated_energy_today": {"kind": "field", "unit": "Wh", "min": 0},
+    "cumulated_energy_week": {"kind": "field", "unit": "Wh", "min": 0},
+    "cumulated_energy_month": {"kind": "field", "unit": "Wh", "min": 0},
+    "cumulated_energy_year": {"kind": "field", "unit": "Wh", "min": 0},
+    "cumulated_energy_total": {"kind": "field", "unit": "Wh", "min": 0},
+    "grid_voltage": {"kind": "field", "unit": "V", "min": 180, "max": 280},
+    "device_name": {"kind": "tag", "pattern": r"^[A-Za-z0-9_.-]{1,64}$"},
+    "connection_status": {"kind": "tag", "allowed": ["CONNECTED", "DISCONNECTED"]},
+}
+
+FIELD = 0
+TAG = 1
+
+
+class ReadingValidator:
+    """
+    Validator compiled once from a schema table. Each key maps to a flat tuple
+    so validating a reading is a dict lookup plus a few comparisons per value.
+    With strict=False, unknown numeric keys are still stored as fields, up to
+    max_extra_fields distinct names so a client cannot create unbounded fields;
+    unknown string keys are always rejected.
+    """
+
+    def __init__(self, schema, strict=False, max_extra_fields=20):
+        self.strict = strict
+        self.max_extra_fields = max_extra_fields
+        self.extra_fields = set()
+        self.rules = {}
+        for key, spec in schema.items():
+            if spec["kind"] == "field":
+                low = spec.get("min", -math.inf)
+                high = spec.get("max", math.inf)
+                self.rules[key] = (FIELD, low, high, None, None)
+            elif spec["kind"] == "tag":
+                allowed = frozenset(spec["allowed"]) if "allowed" in spec else None
+                pattern = re.compile(spec["pattern"]) if "pattern" in spec else None
+                self.rules[key] = (TAG, None, None, allowed, pattern)
+            else:
+                raise ValueError(f"Unknown schema kind for '{key}': {spec['kind']}")
+
+    def check_tag(self, key, value):
+        """
+        Returns None when value is acceptable for tag `key`, otherwise the rejection reason.
+        """
+        rule = self.rules.get(key)
+        if rule is None or rule[0] != TAG:
+            return "unknown tag"
+        if not isinstance(value, str) or not value:
+            return "tag value must be a non-empty string"
+        _, _, _, allowed, pattern = rule
+        if allowed is not None and value not in allowed:
+            return "tag value not allowed"
+        if pattern is not None and not pattern.match(value):
+            return "tag value does not match the allowed pattern"
+        return None
+
+    def validate(self, data):
+        """
+        Splits a reading into (fields, tags, rejections). Null values are skipped;
+        every other value that cannot be stored gets a {"field", "reason"} entry.
+        """
+        fields = {}
+        tags = {}
+        rejections = []
+        rules = self.rules
+        isfinite = math.isfinite
+
+        for key, value in data.items():
+            if value is None:
+                continue
+            rule = rules.get(key)
+
+            if rule is None:
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and not self.strict:
+                    if not isfinite(value):
+                        rejections.append({"field": key, "reason": "non-finite value"})
+                    elif key in self.extra_fields or len(self.extra_fields) < self.max_extra_fields:
+                        self.extra_fields.add(key)
+                        fields[key] = float(value)
+                    else:
+                        rejections.append({"field": key, "reason": "too many unknown fields"})
+                else:
+                    rejections.append({"field": key, "reason": "unknown field"})
+                continue
+
+            if rule[0] == FIELD:
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    rejections.append({"field": key, "reason": "not a number"})
+                elif not isfinite(value):
+                    rejections.append({"field": key, "reason": "non-finite value"})
+                elif value < rule[1]:
+                    rejections.append({"field": key, "reason": f"below minimum {rule[1]}"})
+                elif value > rule[2]:
+                    rejections.append({"field": key, "reason": f"above maximum {rule[2]}"})
+                else:
+                    fields[key] = float(value)
+            else:
+                reason = self.check_tag(key, value)
+                if reason is None:
+                    tags[key] = value
+                else:
+                    rejections.append({"field": key, "reason": reason})
+
+        return fields, tags, rejections
+
+
+def parse_timestamp(value):
+    """
+    Converts an epoch (seconds) or ISO 8601 timestamp into an aware UTC datetime.
+    """
+    if isinstance(value, bool):
+        raise ValueError("invalid timestamp")
+    if isinstance(value, (int, float)):
+        if not math.isfinite(value):
+            raise ValueError("invalid timestamp")
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed
+    raise ValueError("invalid timestamp")
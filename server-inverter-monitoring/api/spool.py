@@ -0,0 +1,277 @@
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "segment-"
+SEGMENT_SUFFIX = ".lp"
+CHECKPOINT_FILE = "checkpoint"
+
+
+def segment_name(seq):
+    return f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}"
+
+
+class Spool:
+    """
+    Append-only, segment-rotated write-ahead log of line protocol records.
+    Every accepted reading is appended here before it reaches InfluxDB. The
+    read position is kept in a checkpoint file, so after a restart replay
+    resumes from the first record that was not yet confirmed as written.
+    """
+
+    def __init__(self, directory, segment_max_bytes=16 * 1024 * 1024, max_total_bytes=1024 * 1024 * 1024,
+                 fsync_interval=1.0, fsync_batch=100):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+
+        self._lock = threading.Lock()
+        self._data_available = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_bytes = 0
+
+        segments = self._list_segments()
+        # Never append to a segment left over from a previous run: its tail may be torn
+        self._active_seq = (segments[-1] + 1) if segments else 1
+        self._active_file = open(self._segment_path(self._active_seq), "ab")
+        self._active_size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+        self._read_seq, self._read_offset = self._load_checkpoint()
+        if segments and self._read_seq < segments[0]:
+            self._read_seq, self._read_offset = segments[0], 0
+        if segments:
+            self._data_available.set()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, segment_name(seq))
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _save_checkpoint(self, seq, offset):
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(f"{seq} {offset}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def append(self, lines):
+        """
+        Appends line protocol records to the active segment.
+        The data is fsynced once fsync_batch records are pending or fsync_interval seconds have passed.
+        """
+        if not lines:
+            return 0
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+
+        with self._lock:
+            self._active_file.write(data)
+            self._active_file.flush()
+            self._active_size += len(data)
+            self._unsynced += len(lines)
+            self.appended += len(lines)
+
+            if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+                self._sync_locked()
+            if self._active_size >= self.segment_max_bytes:
+                self._rotate_locked()
+
+        self._data_available.set()
+        return len(lines)
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                self._sync_locked()
+
+    def _sync_locked(self):
+        os.fsync(self._active_file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate_locked(self):
+        self._sync_locked()
+        self._active_file.close()
+        self._active_seq += 1
+        self._active_file = open(self._segment_path(self._active_seq), "ab")
+        self._active_size = 0
+        self._enforce_disk_limit_locked()
+
+    def _enforce_disk_limit_locked(self):
+        """
+        Deletes the oldest closed segments, replayed or not, until the spool fits in max_total_bytes.
+        """
+        segments = [seq for seq in self._list_segments() if seq != self._active_seq]
+        sizes = {seq: os.path.getsize(self._segment_path(seq)) for seq in segments}
+        total = sum(sizes.values()) + self._active_size
+
+        for seq in segments:
+            if total <= self.max_total_bytes:
+                break
+            os.remove(self._segment_path(seq))
+            total -= sizes[seq]
+            if seq >= self._read_seq:
+                unread = sizes[seq] - (self._read_offset if seq == self._read_seq else 0)
+                self.dropped_bytes += max(unread, 0)
+                log.warning("Spool over its disk limit, dropped unreplayed segment %s.", segment_name(seq))
+                self._read_seq, self._read_offset = seq + 1, 0
+
+    def read_batch(self, max_lines=5000, max_bytes=4 * 1024 * 1024):
+        """
+        Returns (lines, position) with the next complete records after the read position.
+        The position must be passed to commit() once the lines have been written.
+        """
+        with self._lock:
+            seq, offset = self._read_seq, self._read_offset
+            active_seq = self._active_seq
+
+        while seq <= active_seq:
+            try:
+                with open(self._segment_path(seq), "rb") as f:
+                    f.seek(offset)
+                    chunk = f.read(max_bytes)
+            except FileNotFoundError:
+                chunk = b""
+
+            end = chunk.rfind(b"\n")
+            if end >= 0:
+                lines = chunk[:end].decode("utf-8", errors="replace").split("\n")
+                if len(lines) > max_lines:
+                    lines = lines[:max_lines]
+                    end = sum(len(line.encode("utf-8")) + 1 for line in lines) - 1
+                return [line for line in lines if line], (seq, offset + end + 1)
+
+            if seq == active_seq:
+                break
+            # A closed segment with no complete record left (possibly a torn tail after a crash)
+            seq, offset = seq + 1, 0
+
+        return [], (seq, offset)
+
+    def read_position(self):
+        with self._lock:
+            return self._read_seq, self._read_offset
+
+    def commit(self, position, replayed=0):
+        """
+        Persists the read position and removes segments that have been fully replayed.
+        """
+        seq, offset = position
+        with self._lock:
+            self.replayed += replayed
+            if (seq, offset) < (self._read_seq, self._read_offset):
+                # The disk limit moved the read position past this batch in the meantime
+                return
+            self._read_seq, self._read_offset = seq, offset
+            self._save_checkpoint(seq, offset)
+            for old_seq in self._list_segments():
+                if old_seq < seq and old_seq != self._active_seq:
+                    os.remove(self._segment_path(old_seq))
+
+    def wait_for_data(self, timeout):
+        self._data_available.wait(timeout)
+        self._data_available.clear()
+
+    def stats(self):
+        with self._lock:
+            segments = self._list_segments()
+            disk_bytes = sum(os.path.getsize(self._segment_path(seq)) for seq in segments)
+            return {
+                "spool_segments": len(segments),
+                "spool_disk_bytes": disk_bytes,
+                "spool_appended": self.appended,
+                "spool_replayed": self.replayed,
+                "spool_dropped_bytes": self.dropped_bytes,
+                "spool_read_position": f"{self._read_seq}:{self._read_offset}",
+            }
+
+    def close(self):
+        with self._lock:
+            if not self._active_file.closed:
+                self._sync_locked()
+                self._active_file.close()
+
+
+class SpoolReplayer:
+    """
+    Background thread that drains the spool into InfluxDB in large batches.
+    While InfluxDB is unreachable it backs off and the records stay on disk.
+    A crash between a write and its checkpoint replays that batch once more,
+    which InfluxDB absorbs because every record carries its own timestamp.
+    """
+
+    def __init__(self, spool, write_fn, batch_size=5000, idle_interval=1.0,
+                 retry_base_delay=1.0, retry_max_delay=60.0):
+        self.spool = spool
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        self.write_errors = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="spool-replayer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.spool.close()
+
+    def _run(self):
+        delay = self.retry_base_delay
+        while not self._stop_event.is_set():
+            self.spool.sync()
+            lines, position = self.spool.read_batch(max_lines=self.batch_size)
+            if not lines:
+                if position != self.spool.read_position():
+                    self.spool.commit(position)
+                    continue
+                self.spool.wait_for_data(self.idle_interval)
+                continue
+
+            try:
+                self.write_fn(lines)
+            except Exception as e:
+                self.write_errors += 1
+                log.error("Spool replay to InfluxDB failed, retrying in %.0fs: %s", delay, e)
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+                continue
+
+            delay = self.retry_base_delay
+            self.spool.commit(position, replayed=len(lines))
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Tenant configuration, loaded from the JSON file named by TENANTS_FILE:
+#
+#   {
+#     "tenants": {
+#       "acme": {"bucket": "acme_inverters", "rate_limit": 5, "burst": 600, "batch_size": 1000}
+#     },
+#     "devices": {
+#       "acme_roof": {"tenant": "acme", "token_sha256": "<sha256 hex of the device token>"}
+#     }
+#   }
+#
+# "org" defaults to INFLUXDB_ORG, "rate_limit" is in readings per second and
+# "burst" is the largest number of readings accepted at once. A device may
+# give its token in clear as "token" instead of "token_sha256".
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "lock")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount=1):
+        """
+        Takes `amount` tokens if available. Returns 0 on success, otherwise the
+        seconds to wait until they will be (infinite when amount exceeds the
+        capacity; callers refuse such requests up front).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if amount <= self.tokens:
+                self.tokens -= amount
+                return 0
+            if amount > self.capacity or self.rate <= 0:
+                return float("inf")
+            return (amount - self.tokens) / self.rate
+
+
+class Tenant:
+    __slots__ = ("name", "bucket", "org", "batch_size", "limiter")
+
+    def __init__(self, name, bucket, org, batch_size, limiter):
+        self.name = name
+        self.bucket = bucket
+        self.org = org
+        self.batch_size = batch_size
+        self.limiter = limiter
+
+
+class DeviceCredential:
+    __slots__ = ("device_name", "tenant")
+
+    def __init__(self, device_name, tenant):
+        self.device_name = device_name
+        self.tenant = tenant
+
+
+class TenantIndex:
+    """
+    In-memory index from token hash to device and tenant, so authenticating a
+    request is one hash and one dict lookup. The file is checked for changes at
+    most every `reload_interval` seconds; rate limiter state survives reloads.
+    """
+
+    def __init__(self, path, default_org, default_batch_size=500, reload_interval=30.0):
+        self.path = path
+        self.default_org = default_org
+        self.default_batch_size = default_batch_size
+        self.reload_interval = reload_interval
+        self.tenants = {}
+        self._credentials = {}
+        self._devices = {}
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        (Re)builds the index from the file. Raises ValueError on an invalid configuration.
+        """
+        mtime = os.path.getmtime(self.path)
+        with open(self.path) as f:
+            config = json.load(f)
+
+        tenants = {}
+        for name, spec in config.get("tenants", {}).items():
+            if not spec.get("bucket"):
+                raise ValueError(f"Tenant '{name}' has no bucket")
+            rate = float(spec.get("rate_limit", 10))
+            burst = float(spec.get("burst", max(rate * 60, 1)))
+            previous = self.tenants.get(name)
+            if previous is not None:
+                limiter = previous.limiter
+                limiter.rate, limiter.capacity = rate, burst
+            else:
+                limiter = TokenBucket(rate, burst)
+            tenants[name] = Tenant(name, spec["bucket"], spec.get("org", self.default_org),
+                                   int(spec.get("batch_size", self.default_batch_size)), limiter)
+
+        credentials = {}
+        devices = {}
+        for device_name, spec in config.get("devices", {}).items():
+            tenant = tenants.get(spec.get("tenant"))
+            if tenant is None:
+                raise ValueError(f"Device '{device_name}' refers to unknown tenant '{spec.get('tenant')}'")
+            token_hash = spec.get("token_sha256") or (hash_token(spec["token"]) if spec.get("token") else None)
+            if not token_hash:
+                raise ValueError(f"Device '{device_name}' has no token")
+            credential = DeviceCredential(device_name, tenant)
+            credentials[token_hash.lower()] = credential
+            devices[device_name] = credential
+
+        with self._lock:
+            self.tenants = tenants
+            self._credentials = credentials
+            self._devices = devices
+            self._mtime = mtime
+
+    def maybe_reload(self):
+        """
+        Reloads the file if it changed. Returns True when the index was rebuilt.
+        A broken file keeps the previous index in place.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + self.reload_interval
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            self.load()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def authenticate(self, token):
+        """
+        Returns the DeviceCredential of a token, or None when it is unknown.
+        """
+        if not token:
+            return None
+        self.maybe_reload()
+        return self._credentials.get(hash_token(token))
+
+    def device(self, device_name):
+        return self._devices.get(device_name)
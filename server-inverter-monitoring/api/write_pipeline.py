@@ -0,0 +1,144 @@
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class WritePipeline:
+    """
+    Bounded in-memory queue of InfluxDB records drained by a background flusher.
+    Records are written in batches once the batch is full or the oldest queued
+    record is older than max_batch_age seconds. Failed writes are retried with
+    exponential backoff before the batch is dropped.
+    """
+
+    def __init__(self, write_fn, max_queue_size=10000, batch_size=500, max_batch_age=1.0,
+                 max_retries=5, retry_base_delay=0.5, retry_max_delay=30.0):
+        self.write_fn = write_fn
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped_queue_full = 0
+        self.dropped_write_failed = 0
+        self.write_errors = 0
+        self.retries = 0
+        self.batches = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="influx-write-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Stops the flusher after it has written everything still in the queue.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, records):
+        """
+        Queues one or more records without blocking.
+        Returns the number of records accepted; the rest are counted as dropped.
+        """
+        if not isinstance(records, list):
+            records = [records]
+
+        accepted = 0
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+                accepted += 1
+            except queue.Full:
+                break
+
+        with self._lock:
+            self.enqueued += accepted
+            self.dropped_queue_full += len(records) - accepted
+        return accepted
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "enqueued": self.enqueued,
+                "written": self.written,
+                "batches": self.batches,
+                "retries": self.retries,
+                "write_errors": self.write_errors,
+                "dropped_queue_full": self.dropped_queue_full,
+                "dropped_write_failed": self.dropped_write_failed,
+            }
+
+    def _next_batch(self):
+        """
+        Blocks until a batch is ready: either batch_size records are queued or
+        the first record of the batch has waited max_batch_age seconds.
+        """
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.max_batch_age))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.max_batch_age
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop_event.is_set():
+                # Take whatever is already queued without waiting any longer
+                try:
+                    while len(batch) < self.batch_size:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_with_retry(self, batch):
+        delay = self.retry_base_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_fn(batch)
+                with self._lock:
+                    self.written += len(batch)
+                    self.batches += 1
+                return
+            except Exception as e:
+                with self._lock:
+                    self.write_errors += 1
+                log.error("InfluxDB batch write failed (attempt %d/%d): %s", attempt + 1, self.max_retries + 1, e)
+
+            if attempt == self.max_retries or self._stop_event.wait(delay):
+                break
+            with self._lock:
+                self.retries += 1
+            delay = min(delay * 2, self.retry_max_delay)
+
+        with self._lock:
+            self.dropped_write_failed += len(batch)
+        log.error("Dropping batch of %d records after repeated write failures.", len(batch))
+
+    def _run(self):
+        while not self._stop_event.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._write_with_retry(batch)
@@ -0,0 +1,145 @@
+"""
+Aurora RS485 protocol frames, as exchanged by esphome-aurora-inverter/ABBAurora.cpp.
+
+    request:  address, command, 6 parameter bytes, CRC16 (low, high)    10 bytes
+    response: transmission state, global state, 4 data bytes, CRC16     8 bytes
+
+DSP values come back as a big-endian float32 and cumulated energies as a
+big-endian uint32 (Wh); a state response carries the inverter, channel and
+alarm states in the data bytes. VirtualInverter answers frames from a solar
+plant model and AuroraClient reads it the way the firmware does, so the
+simulator exercises the same encoding on both ends of the bus.
+"""
+import struct
+
+COMMAND_STATE = 50
+COMMAND_DSP = 59
+COMMAND_CUMULATED_ENERGY = 78
+
+# DSP_VALUE_TYPE and CUMULATED_ENERGY_TYPE of ABBAuroraEnums.h used by the uploaded reading
+GRID_VOLTAGE = 1
+GRID_POWER = 3
+POWER_IN_1 = 8
+POWER_IN_2 = 9
+TEMPERATURE_INVERTER = 21
+POWER_PEAK = 34
+POWER_PEAK_TODAY = 35
+
+CURRENT_DAY = 0
+CURRENT_WEEK = 1
+CURRENT_MONTH = 3
+CURRENT_YEAR = 4
+TOTAL = 5
+
+GLOBAL_STATE_RUN = 6
+GLOBAL_STATE_WAIT_SUN = 1
+INVERTER_STATE_RUN = 2
+INVERTER_STATE_STAND_BY = 0
+
+FLOAT32 = struct.Struct(">f")
+UINT32 = struct.Struct(">I")
+
+
+def crc16(data):
+    """
+    CRC of the Aurora protocol (ABBAurora::Crc16), returned as (low byte, high byte).
+    """
+    bcc_lo = 0xFF
+    bcc_hi = 0xFF
+    for byte in data:
+        new = (byte ^ bcc_lo) & 0xFF
+        tmp = (new << 4) & 0xFF
+        new = tmp ^ new
+        tmp = new >> 5
+        bcc_lo = bcc_hi
+        bcc_hi = new ^ tmp
+        tmp = (new << 3) & 0xFF
+        bcc_lo = bcc_lo ^ tmp
+        tmp = new >> 4
+        bcc_lo = bcc_lo ^ tmp
+    return ~bcc_lo & 0xFF, ~bcc_hi & 0xFF
+
+
+def build_request(address, command, *params):
+    frame = bytes([address, command] + list(params) + [0] * (6 - len(params)))
+    return frame + bytes(crc16(frame))
+
+
+def build_response(global_state, data, transmission_state=0):
+    frame = bytes([transmission_state, global_state]) + data
+    return frame + bytes(crc16(frame))
+
+
+def check_crc(frame):
+    return len(frame) >= 2 and bytes(crc16(frame[:-2])) == frame[-2:]
+
+
+class VirtualInverter:
+    """
+    Answers Aurora requests from a SolarPlant. Like a real Aurora, it does not
+    answer at all while it has no DC input (at night).
+    """
+
+    def __init__(self, plant, address=2):
+        self.plant = plant
+        self.address = address
+
+    def handle(self, request):
+        if len(request) != 10 or not check_crc(request) or request[0] != self.address:
+            return None
+        if not self.plant.awake:
+            return None
+        running = self.plant.power > 0
+        global_state = GLOBAL_STATE_RUN if running else GLOBAL_STATE_WAIT_SUN
+        command, param = request[1], request[2]
+
+        if command == COMMAND_STATE:
+            inverter_state = INVERTER_STATE_RUN if running else INVERTER_STATE_STAND_BY
+            return build_response(global_state, bytes([inverter_state, 2, 2, 0]))
+        if command == COMMAND_DSP:
+            value = self.plant.dsp_value(param)
+            if value is None:
+                return build_response(global_state, bytes(4), transmission_state=51)
+            return build_response(global_state, FLOAT32.pack(value))
+        if command == COMMAND_CUMULATED_ENERGY:
+            value = self.plant.cumulated_energy(param)
+            if value is None:
+                return build_response(global_state, bytes(4), transmission_state=51)
+            return build_response(global_state, UINT32.pack(int(value)))
+        return build_response(global_state, bytes(4), transmission_state=51)
+
+
+class AuroraClient:
+    """
+    Reads values the way ABBAurora does: one attempt per request, a reply with a
+    bad CRC or a non-zero transmission state counts as no value.
+    """
+
+    def __init__(self, transport, address=2):
+        self.transport = transport
+        self.address = address
+        self.requests = 0
+        self.failures = 0
+
+    def _exchange(self, command, *params):
+        self.requests += 1
+        response = self.transport(build_request(self.address, command, *params))
+        if response is None or len(response) != 8 or not check_crc(response) or response[0] != 0:
+            self.failures += 1
+            return None
+        return response
+
+    def read_state(self):
+        """
+        Returns (global state, inverter state), or None when the inverter does not answer.
+        """
+        response = self._exchange(COMMAND_STATE)
+        return None if response is None else (response[1], response[2])
+
+    def read_dsp(self, value_type):
+        response = self._exchange(COMMAND_DSP, value_type, 0)
+        return None if response is None else FLOAT32.unpack(response[2:6])[0]
+
+    def read_cumulated_energy(self, energy_type):
+        response = self._exchange(COMMAND_CUMULATED_ENERGY, energy_type)
+        return None if response is None else UINT32.unpack(response[2:6])[0]
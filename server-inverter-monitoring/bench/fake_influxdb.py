@@ -0,0 +1,197 @@
+"""
+Minimal InfluxDB 2.x stand-in for offline benchmarks.
+
+It accepts writes on /api/v2/write (counting points, optionally sleeping to
+mimic a slow database) and answers Flux queries on /api/v2/query with a small
+pivoted annotated-CSV table holding every field named in the query. With
+series tracking on, written points are also summarised per device so a
+simulation can check what was stored.
+
+    python fake_influxdb.py --port 8086 --write-latency-ms 5
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_PATTERN = re.compile(r'r\._field == "([A-Za-z0-9_]+)"')
+
+
+class SeriesStats:
+    """
+    What was written for one device: point count, line protocol size, time
+    range, the fields of its newest point and the sum of every field.
+    """
+
+    def __init__(self):
+        self.points = 0
+        self.bytes = 0
+        self.first_time = None
+        self.last_time = None
+        self.out_of_order = 0
+        self.last_fields = {}
+        self.field_sums = {}
+
+    def add(self, size, timestamp, fields):
+        self.points += 1
+        self.bytes += size
+        if self.first_time is None or timestamp < self.first_time:
+            self.first_time = timestamp
+        if self.last_time is not None and timestamp < self.last_time:
+            self.out_of_order += 1
+        else:
+            self.last_time = timestamp
+            self.last_fields = fields
+        for key, value in fields.items():
+            self.field_sums[key] = self.field_sums.get(key, 0.0) + value
+
+    def as_dict(self):
+        return {"points": self.points, "bytes": self.bytes, "first_time": self.first_time,
+                "last_time": self.last_time, "out_of_order": self.out_of_order,
+                "last_fields": self.last_fields, "field_sums": self.field_sums}
+
+
+def parse_line(line):
+    """
+    Splits a line of the API's line protocol into (device_name, timestamp in ns, numeric fields).
+    Tags and field keys written by the API never contain spaces, commas or quotes.
+    """
+    parts = line.split(" ")
+    tags = dict(tag.split("=", 1) for tag in parts[0].split(",")[1:])
+    fields = {}
+    for item in parts[1].split(","):
+        key, value = item.split("=", 1)
+        try:
+            fields[key] = float(value[:-1] if value.endswith("i") else value)
+        except ValueError:
+            continue
+    timestamp = int(parts[2]) if len(parts) > 2 else time.time_ns()
+    return tags.get("device_name"), timestamp, fields
+
+
+class Stats:
+    def __init__(self, track_series=False):
+        self.lock = threading.Lock()
+        self.write_requests = 0
+        self.points_written = 0
+        self.queries = 0
+        self.series = {} if track_series else None
+
+    def observe(self, lines):
+        parsed = [(len(line),) + parse_line(line) for line in lines]
+        with self.lock:
+            for size, device, timestamp, fields in parsed:
+                series = self.series.get(device)
+                if series is None:
+                    series = self.series[device] = SeriesStats()
+                series.add(size, timestamp, fields)
+
+    def as_dict(self):
+        with self.lock:
+            stats = {"write_requests": self.write_requests, "points_written": self.points_written,
+                     "queries": self.queries}
+            if self.series is not None:
+                stats["series"] = {device: series.as_dict() for device, series in self.series.items()}
+            return stats
+
+
+def query_response(query, rows=3):
+    """
+    Builds an annotated CSV answer with one column per field found in the query.
+    """
+    fields = list(dict.fromkeys(FIELD_PATTERN.findall(query))) or ["power_in_total"]
+    header = ["result", "table", "_time", "device_name"] + fields
+    lines = [
+        "#datatype,string,long,dateTime:RFC3339,string" + ",double" * len(fields),
+        "#group,false,false,false,true" + ",false" * len(fields),
+        "#default,_result,,,," + "," * (len(fields) - 1),
+        "," + ",".join(header),
+    ]
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    for i in range(rows):
+        moment = (now - timedelta(minutes=rows - 1 - i)).isoformat().replace("+00:00", "Z")
+        values = [f"{1000.0 + 10 * i + n:.1f}" for n in range(len(fields))]
+        lines.append(",," + ",".join(["0", moment, "main_inverter"] + values))
+    return "\r\n".join(lines) + "\r\n\r\n"
+
+
+def make_handler(stats, write_latency):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _reply(self, status, body=b"", content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.startswith("/ping") or self.path.startswith("/health"):
+                self._reply(200 if self.path.startswith("/health") else 204,
+                            json.dumps({"status": "pass"}).encode() if self.path.startswith("/health") else b"")
+            elif self.path.startswith("/stats"):
+                self._reply(200, json.dumps(stats.as_dict()).encode())
+            else:
+                self._reply(404)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path.startswith("/api/v2/write"):
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                lines = [line for line in body.decode().split("\n") if line.strip()]
+                points = len(lines)
+                if stats.series is not None:
+                    stats.observe(lines)
+                if write_latency:
+                    time.sleep(write_latency)
+                with stats.lock:
+                    stats.write_requests += 1
+                    stats.points_written += points
+                self._reply(204)
+            elif self.path.startswith("/api/v2/query"):
+                with stats.lock:
+                    stats.queries += 1
+                try:
+                    query = json.loads(body).get("query", "")
+                except ValueError:
+                    query = body.decode(errors="replace")
+                self._reply(200, query_response(query).encode(), content_type="text/csv; charset=utf-8")
+            else:
+                self._reply(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(port=0, write_latency=0.0, track_series=False):
+    """
+    Starts the stand-in in a background thread. Returns (server, stats).
+    """
+    stats = Stats(track_series)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(stats, write_latency))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-influxdb", daemon=True).start()
+    return server, stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--write-latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, stats = start_server(args.port, args.write_latency_ms / 1000)
+    print(f"Fake InfluxDB listening on http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
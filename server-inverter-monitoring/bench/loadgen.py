@@ -0,0 +1,172 @@
+"""
+Load generator simulating ESP32 devices and API readers.
+
+Every simulated device owns a keep-alive connection and POSTs the payload of
+esphome-aurora-inverter/config.yaml (as JSON, binary or bulk NDJSON) at a fixed
+interval. Readers poll the read endpoints as fast as they can. Latencies are
+collected per request and summarised as percentiles and requests per second.
+"""
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import binary_format  # noqa: E402
+
+
+def device_name(index):
+    return f"inverter_{index:04d}"
+
+
+def realistic_payload(index, moment):
+    """
+    The ten fields the ESPHome interval action sends, with a daytime-like production value.
+    """
+    power = 1500 + 1500 * math.sin(moment / 600 + index) + random.uniform(-50, 50)
+    energy_today = 8000 + (moment % 86400) / 10
+    return {
+        "power_in_total": round(max(power, 0.0), 1),
+        "power_peak_today": 3200.0,
+        "power_peak_max": 4800.0,
+        "inverter_temp": round(45 + random.uniform(-2, 2), 2),
+        "cumulated_energy_today": round(energy_today),
+        "cumulated_energy_week": round(energy_today * 4),
+        "cumulated_energy_month": round(energy_today * 15),
+        "cumulated_energy_year": round(energy_today * 180),
+        "cumulated_energy_total": round(energy_today * 900),
+        "grid_voltage": round(230 + random.uniform(-3, 3), 2),
+    }
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.statuses = {}
+
+    def record(self, latency, status):
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status is None or status >= 400:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            statuses = dict(self.statuses)
+            errors = self.errors
+        if not latencies:
+            return {"requests": 0, "errors": errors}
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "statuses": {str(k): v for k, v in statuses.items()},
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(50), 2),
+            "p90_ms": round(percentile(90), 2),
+            "p99_ms": round(percentile(99), 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+        }
+
+
+def timed_request(connection, method, path, body, headers, recorder):
+    started = time.perf_counter()
+    try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        status = response.status
+    except (OSError, http.client.HTTPException):
+        status = None
+        connection.close()
+    recorder.record(time.perf_counter() - started, status)
+
+
+def _connection(base_url):
+    parts = urlsplit(base_url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+
+
+def run_ingest(base_url, devices, interval, duration, payload_format="json", batch_size=10):
+    """
+    Simulates `devices` ESP32s posting every `interval` seconds for `duration` seconds.
+    With payload_format="bulk" each device buffers batch_size readings per POST.
+    """
+    recorder = LatencyRecorder()
+    deadline = time.monotonic() + duration
+
+    def device_loop(index):
+        connection = _connection(base_url)
+        # Spread the devices over the interval like real, unsynchronised clocks
+        next_send = time.monotonic() + random.uniform(0, interval)
+        while True:
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if time.monotonic() >= deadline:
+                break
+            next_send += interval
+
+            reading = realistic_payload(index, time.time())
+            if payload_format == "binary":
+                body = binary_format.encode_reading(reading)
+                headers = {"Content-Type": binary_format.MIMETYPES[0]}
+                path = "/api/inverter_data"
+            elif payload_format == "bulk":
+                now = time.time()
+                body = "\n".join(
+                    json.dumps({"device_name": device_name(index), "timestamp": now - interval * n, **reading})
+                    for n in range(batch_size)
+                ).encode()
+                headers = {"Content-Type": "application/x-ndjson"}
+                path = "/api/inverter_data/bulk"
+            else:
+                body = json.dumps({"device_name": device_name(index), **reading}).encode()
+                headers = {"Content-Type": "application/json"}
+                path = "/api/inverter_data"
+            timed_request(connection, "POST", path, body, headers, recorder)
+        connection.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=device_loop, args=(i,), daemon=True) for i in range(devices)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.monotonic() - started)
+
+
+def run_reads(base_url, readers, duration, paths):
+    """
+    Runs `readers` closed-loop clients cycling through `paths` for `duration` seconds.
+    """
+    recorder = LatencyRecorder()
+    deadline = time.monotonic() + duration
+
+    def reader_loop(offset):
+        connection = _connection(base_url)
+        n = offset
+        while time.monotonic() < deadline:
+            timed_request(connection, "GET", paths[n % len(paths)], None, {}, recorder)
+            n += 1
+        connection.close()
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=reader_loop, args=(i,), daemon=True) for i in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary(time.monotonic() - started)
@@ -0,0 +1,148 @@
+"""
+Offline ingest and query benchmark for the inverter API.
+
+Starts the fake InfluxDB, launches the API against it (Flask development
+server or gunicorn), drives it with simulated ESP32 devices and readers, and
+prints p50/p99 latency, requests/s, database traffic and API memory use.
+
+    python run_bench.py --devices 50 --interval 1 --duration 20
+    python run_bench.py --server gunicorn --ingest-mode async --format binary
+    python run_bench.py --format bulk --batch-size 60 --json-out results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from fake_influxdb import start_server
+from loadgen import device_name, run_ingest, run_reads
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"API did not come up at {url}")
+
+
+def process_rss_kb(pid):
+    """
+    Resident memory of a process and all its children (gunicorn workers), from /proc.
+    """
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return total
+
+
+def start_api(args, influx_port, api_port, spool_dir, extra_env=None):
+    env = dict(
+        os.environ,
+        INFLUXDB_URL=f"http://127.0.0.1:{influx_port}",
+        INFLUXDB_TOKEN="bench-token",
+        INFLUXDB_ORG="bench",
+        INFLUXDB_BUCKET="inverter_data",
+        INGEST_MODE=args.ingest_mode,
+        SPOOL_DIR=spool_dir,
+        PORT=str(api_port),
+        **(extra_env or {}),
+    )
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(api_port), "--with-threads"]
+    return subprocess.Popen(command, cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50, help="simulated ESP32 devices")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between posts of one device")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds per phase")
+    parser.add_argument("--format", choices=["json", "binary", "bulk"], default="json")
+    parser.add_argument("--batch-size", type=int, default=10, help="readings per bulk POST")
+    parser.add_argument("--readers", type=int, default=10, help="concurrent read clients")
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    parser.add_argument("--ingest-mode", choices=["sync", "async", "spool"], default="sync")
+    parser.add_argument("--write-latency-ms", type=float, default=0.0, help="simulated InfluxDB write latency")
+    parser.add_argument("--json-out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    influx, influx_stats = start_server(write_latency=args.write_latency_ms / 1000)
+    api_port = free_port()
+    base_url = f"http://127.0.0.1:{api_port}"
+    spool_dir = tempfile.mkdtemp(prefix="bench-spool-")
+    api = start_api(args, influx.server_port, api_port, spool_dir)
+
+    try:
+        wait_until_up(f"{base_url}/api/ingest/stats")
+        rss_idle = process_rss_kb(api.pid)
+
+        ingest = run_ingest(base_url, args.devices, args.interval, args.duration, args.format, args.batch_size)
+        rss_after_ingest = process_rss_kb(api.pid)
+        influx_after_ingest = influx_stats.as_dict()
+
+        paths = ["/api/power", "/api/energy/today", "/api/latest"]
+        paths += [f"/api/latest?device={device_name(i)}" for i in range(min(args.devices, 10))]
+        paths.append("/api/series?start=-24h&fields=power_in_total,inverter_temp")
+        reads = run_reads(base_url, args.readers, args.duration, paths)
+        rss_after_reads = process_rss_kb(api.pid)
+        influx_final = influx_stats.as_dict()
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            api.kill()
+        influx.shutdown()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    report = {
+        "config": vars(args),
+        "ingest": ingest,
+        "reads": reads,
+        "influxdb": {
+            "write_requests": influx_final["write_requests"],
+            "points_written": influx_final["points_written"],
+            "queries_during_ingest": influx_after_ingest["queries"],
+            "queries_during_reads": influx_final["queries"] - influx_after_ingest["queries"],
+        },
+        "api_rss_kb": {"idle": rss_idle, "after_ingest": rss_after_ingest, "after_reads": rss_after_reads},
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
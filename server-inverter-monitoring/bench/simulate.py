@@ -0,0 +1,349 @@
+"""
+End-to-end simulation of the ESP32 -> API -> InfluxDB path at accelerated time.
+
+Every virtual device is a solar plant model behind a virtual Aurora inverter.
+It is read over Aurora protocol frames the way the firmware does, its readings
+are buffered and posted to /api/inverter_data/bulk with their timestamps (as
+ReadingBuffer.h does), and the API writes them to the fake InfluxDB, which
+keeps a per-device summary of what was stored. Time runs as fast as the API
+ingests, so a year of one-minute readings takes minutes, not a year.
+
+At the end the stored data is checked against what the devices sent (point
+counts, final energy counters, the API's energy_delta adding up to the energy
+produced) and a capacity report is printed: ingest rate, write requests, line
+protocol bytes per point and the projected points and bytes per device-year.
+
+    python simulate.py --devices 10 --days 365 --step 300
+    python simulate.py --devices 50 --days 30 --step 60 --format binary --ingest-mode async
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import aurora_protocol as aurora
+from fake_influxdb import start_server
+from loadgen import _connection, device_name
+from run_bench import free_port, process_rss_kb, start_api, wait_until_up
+from solar_model import SolarPlant
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+import binary_format  # noqa: E402
+
+# Fields of the upload in config.yaml and how the firmware reads them
+DSP_FIELDS = {
+    "power_peak_today": aurora.POWER_PEAK_TODAY,
+    "power_peak_max": aurora.POWER_PEAK,
+    "inverter_temp": aurora.TEMPERATURE_INVERTER,
+    "grid_voltage": aurora.GRID_VOLTAGE,
+}
+ENERGY_FIELDS = {
+    "cumulated_energy_today": aurora.CURRENT_DAY,
+    "cumulated_energy_week": aurora.CURRENT_WEEK,
+    "cumulated_energy_month": aurora.CURRENT_MONTH,
+    "cumulated_energy_year": aurora.CURRENT_YEAR,
+    "cumulated_energy_total": aurora.TOTAL,
+}
+
+
+class VirtualDevice:
+    """
+    One ESP32 with its inverter: reads the bus, keeps the last value of every
+    sensor like ESPHome does, and remembers what it uploaded for the checks.
+    """
+
+    def __init__(self, index, plant, frame_error_rate=0.0):
+        self.name = device_name(index)
+        self.token = f"sim-token-{index:04d}"
+        self.plant = plant
+        self.inverter = aurora.VirtualInverter(plant)
+        self.client = aurora.AuroraClient(self._transport)
+        self.frame_error_rate = frame_error_rate
+        self.random = random.Random(index)
+        self.sensors = {}
+        self.sent = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0
+        self.first_total = None
+        self.last_total = None
+
+    def _transport(self, request):
+        response = self.inverter.handle(request)
+        if response is not None and self.frame_error_rate and self.random.random() < self.frame_error_rate:
+            position = self.random.randrange(len(response))
+            response = response[:position] + bytes([response[position] ^ 0x5A]) + response[position + 1:]
+        return response
+
+    def _update(self, name, value):
+        if value is not None:
+            self.sensors[name] = value
+
+    def read(self, timestamp):
+        """
+        Advances the plant and returns the reading the firmware would upload, or
+        None while the inverter sleeps or produces nothing.
+        """
+        self.plant.advance(timestamp)
+        if self.client.read_state() is None:
+            return None
+        self._update("power_in_1", self.client.read_dsp(aurora.POWER_IN_1))
+        self._update("power_in_2", self.client.read_dsp(aurora.POWER_IN_2))
+        power = self.sensors.get("power_in_1", 0.0) + self.sensors.get("power_in_2", 0.0)
+        if power <= 0:
+            return None
+        for name, value_type in DSP_FIELDS.items():
+            self._update(name, self.client.read_dsp(value_type))
+        for name, energy_type in ENERGY_FIELDS.items():
+            self._update(name, self.client.read_cumulated_energy(energy_type))
+
+        reading = {"timestamp": int(timestamp), "power_in_total": round(power, 1)}
+        for name in list(DSP_FIELDS) + list(ENERGY_FIELDS):
+            if name in self.sensors:
+                value = self.sensors[name]
+                reading[name] = value if name in ENERGY_FIELDS else round(value, 2)
+        return reading
+
+
+def encode_batch(device, batch, payload_format):
+    if payload_format == "binary":
+        body = b"".join(binary_format.encode_reading(reading) for reading in batch)
+        content_type = binary_format.MIMETYPES[0]
+    else:
+        body = json.dumps([dict(reading, device_name=device.name) for reading in batch]).encode()
+        content_type = "application/json"
+    return body, {"Content-Type": content_type, "Authorization": f"Bearer {device.token}"}
+
+
+def upload(connection, device, batch, payload_format):
+    """
+    Posts one batch, retrying while the API asks to (429, 503) like the firmware buffer does.
+    Returns the connection to keep using.
+    """
+    body, headers = encode_batch(device, batch, payload_format)
+    for attempt in range(20):
+        try:
+            connection.request("POST", "/api/inverter_data/bulk", body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except OSError:
+            connection.close()
+            time.sleep(0.5)
+            continue
+        if response.status in (429, 503):
+            time.sleep(float(response.getheader("Retry-After") or 0.5))
+            continue
+        break
+    else:
+        device.failed += len(batch)
+        return connection
+
+    device.sent += len(batch)
+    if response.status >= 300:
+        device.failed += len(batch)
+        return connection
+    result = json.loads(payload)
+    device.accepted += result.get("accepted", 0)
+    device.rejected += result.get("rejected", 0)
+    accepted = [batch[item["index"]] for item in result.get("results", []) if item["status"] == "accepted"]
+    totals = [reading["cumulated_energy_total"] for reading in accepted if "cumulated_energy_total" in reading]
+    if totals:
+        if device.first_total is None:
+            device.first_total = totals[0]
+        device.last_total = totals[-1]
+    return connection
+
+
+def run_device(device, base_url, start, end, step, batch_size, payload_format):
+    connection = _connection(base_url)
+    batch = []
+    for timestamp in range(start, end, step):
+        reading = device.read(timestamp)
+        if reading is not None:
+            batch.append(reading)
+        if len(batch) >= batch_size:
+            connection = upload(connection, device, batch, payload_format)
+            batch = []
+    if batch:
+        upload(connection, device, batch, payload_format)
+    connection.close()
+
+
+def write_tenants_file(path, devices):
+    config = {
+        "tenants": {"simulation": {"bucket": "inverter_data", "rate_limit": 1e9, "burst": 1e9}},
+        "devices": {device.name: {"tenant": "simulation", "token": device.token} for device in devices},
+    }
+    with open(path, "w") as f:
+        json.dump(config, f)
+
+
+def wait_for_drain(influx_stats, expected_points, timeout=120):
+    """
+    In async and spool mode the API answers before InfluxDB has the points; waits until they arrive or stop coming.
+    """
+    deadline = time.monotonic() + timeout
+    last, stable_since = -1, time.monotonic()
+    while time.monotonic() < deadline:
+        points = influx_stats.as_dict()["points_written"]
+        if points >= expected_points:
+            return
+        if points != last:
+            last, stable_since = points, time.monotonic()
+        elif time.monotonic() - stable_since > 10:
+            return
+        time.sleep(0.2)
+
+
+def check_devices(devices, series):
+    """
+    Compares what each device had accepted with what reached InfluxDB. Returns a list of failures.
+    """
+    failures = []
+    for device in devices:
+        stored = series.get(device.name)
+        if stored is None:
+            if device.accepted:
+                failures.append(f"{device.name}: {device.accepted} readings accepted but none stored")
+            continue
+        if stored["points"] != device.accepted:
+            failures.append(f"{device.name}: {stored['points']} points stored, {device.accepted} accepted")
+        if stored["out_of_order"]:
+            failures.append(f"{device.name}: {stored['out_of_order']} points stored out of order")
+        last_total = stored["last_fields"].get("cumulated_energy_total")
+        if device.last_total is not None and last_total != device.last_total:
+            failures.append(f"{device.name}: last cumulated_energy_total {last_total}, sent {device.last_total}")
+        if device.first_total is not None:
+            produced = device.last_total - device.first_total
+            delta_sum = stored["field_sums"].get("energy_delta", 0.0)
+            if abs(delta_sum - produced) > 0.5:
+                failures.append(f"{device.name}: energy_delta adds up to {delta_sum:.1f} Wh, "
+                                f"counters moved {produced} Wh")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=10, help="virtual inverters")
+    parser.add_argument("--days", type=float, default=365.0, help="simulated days")
+    parser.add_argument("--start", default="2025-01-01", help="first simulated day (YYYY-MM-DD, local time)")
+    parser.add_argument("--step", type=int, default=300, help="simulated seconds between readings (60 on the ESP32)")
+    parser.add_argument("--batch-size", type=int, default=500, help="readings per bulk POST")
+    parser.add_argument("--format", choices=["json", "binary"], default="json")
+    parser.add_argument("--latitude", type=float, default=45.46)
+    parser.add_argument("--longitude", type=float, default=9.19)
+    parser.add_argument("--timezone", default="Europe/Rome")
+    parser.add_argument("--frame-error-rate", type=float, default=0.0,
+                        help="fraction of Aurora responses corrupted on the bus")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--server", choices=["flask", "gunicorn"], default="flask")
+    parser.add_argument("--ingest-mode", choices=["sync", "async", "spool"], default="sync")
+    parser.add_argument("--write-latency-ms", type=float, default=0.0, help="simulated InfluxDB write latency")
+    parser.add_argument("--json-out", help="also write the report to this file")
+    args = parser.parse_args()
+
+    tz = ZoneInfo(args.timezone)
+    start = int(datetime.fromisoformat(args.start).replace(tzinfo=tz).timestamp())
+    end = start + int(args.days * 86400)
+    rng = random.Random(args.seed)
+    devices = [
+        VirtualDevice(index, SolarPlant(rng.randrange(2 ** 32), peak_power=rng.choice([3000, 4500, 6000]),
+                                        latitude=args.latitude, longitude=args.longitude, tz=tz),
+                      frame_error_rate=args.frame_error_rate)
+        for index in range(args.devices)
+    ]
+
+    work_dir = tempfile.mkdtemp(prefix="simulate-")
+    tenants_file = os.path.join(work_dir, "tenants.json")
+    write_tenants_file(tenants_file, devices)
+    influx, influx_stats = start_server(write_latency=args.write_latency_ms / 1000, track_series=True)
+    api_port = free_port()
+    base_url = f"http://127.0.0.1:{api_port}"
+    api = start_api(args, influx.server_port, api_port, os.path.join(work_dir, "spool"), extra_env={
+        "TENANTS_FILE": tenants_file,
+        "SITE_TIMEZONE": args.timezone,
+        "SITE_LATITUDE": str(args.latitude),
+        "SITE_LONGITUDE": str(args.longitude),
+        "MAX_BULK_ITEMS": str(max(args.batch_size, 5000)),
+        "LOG_LEVEL": "WARNING",
+    })
+
+    try:
+        wait_until_up(f"{base_url}/api/ingest/stats")
+        started = time.monotonic()
+        threads = [threading.Thread(target=run_device, daemon=True,
+                                    args=(device, base_url, start, end, args.step, args.batch_size, args.format))
+                   for device in devices]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            threads[0].join(timeout=5)
+            sent = sum(device.sent for device in devices)
+            print(f"{sent} readings uploaded, {time.monotonic() - started:.0f} s", file=sys.stderr)
+        ingest_seconds = time.monotonic() - started
+
+        accepted = sum(device.accepted for device in devices)
+        wait_for_drain(influx_stats, accepted)
+        drain_seconds = time.monotonic() - started - ingest_seconds
+        rss = process_rss_kb(api.pid)
+        stored = influx_stats.as_dict()
+    finally:
+        api.terminate()
+        try:
+            api.wait(timeout=30)
+        except Exception:
+            api.kill()
+        influx.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    failures = check_devices(devices, stored["series"])
+    points = stored["points_written"]
+    line_bytes = sum(series["bytes"] for series in stored["series"].values())
+    device_years = args.devices * args.days / 365
+    bus_requests = sum(device.client.requests for device in devices)
+    report = {
+        "config": vars(args),
+        "devices": {
+            "readings_uploaded": sum(device.sent for device in devices),
+            "readings_accepted": accepted,
+            "readings_rejected": sum(device.rejected for device in devices),
+            "readings_failed": sum(device.failed for device in devices),
+            "bus_requests": bus_requests,
+            "bus_failures": sum(device.client.failures for device in devices),
+        },
+        "ingest": {
+            "wall_seconds": round(ingest_seconds, 1),
+            "drain_seconds": round(drain_seconds, 1),
+            "readings_per_second": round(accepted / ingest_seconds, 1) if ingest_seconds else None,
+            "simulated_seconds_per_second": round((end - start) / ingest_seconds) if ingest_seconds else None,
+        },
+        "influxdb": {
+            "write_requests": stored["write_requests"],
+            "points_written": points,
+            "line_protocol_bytes": line_bytes,
+            "bytes_per_point": round(line_bytes / points, 1) if points else None,
+        },
+        "per_device_year": {
+            "points": round(points / device_years) if device_years else None,
+            "line_protocol_bytes": round(line_bytes / device_years) if device_years else None,
+        },
+        "api_rss_kb": rss,
+        "checks": {"passed": not failures, "failures": failures},
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Solar plant model behind a virtual Aurora inverter.
+
+Production follows the clear-sky curve of the site (the same approximation the
+API's low-production rule uses), scaled by a clearness drawn for every day
+(sunny, mixed or overcast, cloudier in winter) and by short-lived cloud noise.
+Energy is integrated between steps into the counters the inverter keeps: today,
+this week (from Monday), this month, this year and total, each resetting at the
+local boundary like on a real Aurora.
+"""
+import math
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+from anomaly import clear_sky_factor  # noqa: E402
+
+import aurora_protocol as aurora  # noqa: E402
+
+
+class SolarPlant:
+    def __init__(self, seed, peak_power=4500.0, latitude=45.0, longitude=9.0, tz=timezone.utc):
+        self.random = random.Random(seed)
+        self.peak_power = peak_power
+        self.latitude = latitude
+        self.longitude = longitude
+        self.tz = tz
+        # A plant that has been running for a few years already
+        self.energy_total = self.random.uniform(1e6, 2e7)
+        self.peak_max = peak_power * self.random.uniform(0.85, 0.95)
+        self.string_share = self.random.uniform(0.45, 0.55)
+
+        self.timestamp = None
+        self.power = 0.0
+        self.awake = False
+        self.inverter_temp = 20.0
+        self.grid_voltage = 230.0
+        self.peak_today = 0.0
+        self.energy = {aurora.CURRENT_DAY: 0.0, aurora.CURRENT_WEEK: 0.0, aurora.CURRENT_MONTH: 0.0,
+                       aurora.CURRENT_YEAR: 0.0}
+        self._period = None
+        self._clearness = 1.0
+        self._cloud = 0.0
+
+    def _draw_clearness(self, moment):
+        # More overcast days around the winter solstice (northern hemisphere)
+        winter = (1 + math.cos(2 * math.pi * (moment.timetuple().tm_yday + 10) / 365)) / 2
+        roll = self.random.random()
+        if roll < 0.15 + 0.25 * winter:
+            return self.random.uniform(0.1, 0.35)
+        if roll < 0.45 + 0.2 * winter:
+            return self.random.uniform(0.4, 0.85)
+        return self.random.uniform(0.88, 1.0)
+
+    def _reset_counters(self, moment):
+        iso_year, iso_week, _ = moment.isocalendar()
+        period = (moment.date(), (iso_year, iso_week), (moment.year, moment.month), moment.year)
+        previous = self._period
+        self._period = period
+        if previous is None:
+            self._clearness = self._draw_clearness(moment)
+            return
+        if period[0] != previous[0]:
+            self.energy[aurora.CURRENT_DAY] = 0.0
+            self.peak_today = 0.0
+            self._clearness = self._draw_clearness(moment)
+        if period[1] != previous[1]:
+            self.energy[aurora.CURRENT_WEEK] = 0.0
+        if period[2] != previous[2]:
+            self.energy[aurora.CURRENT_MONTH] = 0.0
+        if period[3] != previous[3]:
+            self.energy[aurora.CURRENT_YEAR] = 0.0
+
+    def advance(self, timestamp):
+        """
+        Moves the plant to `timestamp` (epoch seconds), integrating the energy produced since the last call.
+        """
+        moment = datetime.fromtimestamp(timestamp, tz=self.tz)
+        self._reset_counters(moment)
+
+        sun = clear_sky_factor(timestamp, self.latitude, self.longitude)
+        self._cloud = 0.8 * self._cloud + 0.2 * self.random.uniform(-1, 1)
+        factor = sun * self._clearness * (1 + 0.3 * self._cloud) if sun > 0 else 0.0
+        # The inverter clips at its rated power and wakes once the panels give enough voltage
+        power = min(self.peak_power * max(factor, 0.0), self.peak_power * 0.97)
+        self.awake = sun > 0.02
+        power = power if self.awake and power > 5 else 0.0
+
+        if self.timestamp is not None and timestamp > self.timestamp:
+            produced = (self.power + power) / 2 * (timestamp - self.timestamp) / 3600
+            for key in self.energy:
+                self.energy[key] += produced
+            self.energy_total += produced
+        self.timestamp = timestamp
+        self.power = power
+        self.peak_today = max(self.peak_today, power)
+        self.peak_max = max(self.peak_max, power)
+
+        season = math.cos(2 * math.pi * (moment.timetuple().tm_yday - 200) / 365)
+        ambient = 13 + 10 * season + 6 * sun
+        target = ambient + 28 * power / self.peak_power
+        self.inverter_temp += 0.5 * (target - self.inverter_temp)
+        # Grid voltage rises a little while the plant exports
+        self.grid_voltage = 229 + 4 * power / self.peak_power + self.random.gauss(0, 1.2)
+
+    def dsp_value(self, value_type):
+        if value_type == aurora.POWER_IN_1:
+            return self.power * self.string_share
+        if value_type == aurora.POWER_IN_2:
+            return self.power * (1 - self.string_share)
+        if value_type == aurora.GRID_POWER:
+            return self.power * 0.965
+        if value_type == aurora.GRID_VOLTAGE:
+            return self.grid_voltage
+        if value_type == aurora.TEMPERATURE_INVERTER:
+            return self.inverter_temp
+        if value_type == aurora.POWER_PEAK_TODAY:
+            return self.peak_today
+        if value_type == aurora.POWER_PEAK:
+            return self.peak_max
+        return None
+
+    def cumulated_energy(self, energy_type):
+        if energy_type == aurora.TOTAL:
+            return self.energy_total
+        return self.energy.get(energy_type)